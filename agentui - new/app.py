@@ -4,10 +4,16 @@ import os
 import requests
 import json
 import time
-from threading import Lock, RLock
+from threading import active_count
 from flask_cors import CORS
 from concurrent.futures import ThreadPoolExecutor
 import html
+from upstream import upstream_client
+from session_store import create_session_manager
+from history import MessageHistory, HistoryRecord
+from relay import sse_relay, sse_event, socket_disconnected, StreamCancelled, RelayTimer
+from singleflight import SingleFlight
+from response_cache import ResponseCache
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
@@ -18,83 +24,15 @@ os.makedirs('templates', exist_ok=True)
 
 
 # ========== 会话管理 ==========
-class SessionManager:
-    def __init__(self):
-        self.sessions = {}  # session_id -> session_data
-        self.lock = RLock()
-        self.message_counter = 0
-        self.pending_forms = {}  # 存储待处理的表单
-
-    def get_or_create_session(self, session_id):
-        """获取或创建会话"""
-        with self.lock:
-            if session_id not in self.sessions:
-                self.sessions[session_id] = {
-                    "conversationId": "",
-                    "lastMessageId": 0,
-                    "messages": [],
-                    "created_at": datetime.now().isoformat(),
-                    "last_activity": datetime.now().isoformat()
-                }
-            else:
-                self.sessions[session_id]["last_activity"] = datetime.now().isoformat()
-            return self.sessions[session_id]
-
-    def update_session(self, session_id, updates):
-        """更新会话数据"""
-        with self.lock:
-            if session_id in self.sessions:
-                self.sessions[session_id].update(updates)
-                self.sessions[session_id]["last_activity"] = datetime.now().isoformat()
-
-    def get_next_message_id(self):
-        """获取下一个消息ID"""
-        with self.lock:
-            self.message_counter += 1
-            return self.message_counter
-
-    def add_pending_form(self, session_id, form_data):
-        """添加待处理表单"""
-        with self.lock:
-            if session_id not in self.pending_forms:
-                self.pending_forms[session_id] = []
-
-            form_id = f"form_{int(time.time())}_{len(self.pending_forms[session_id])}"
-            form_data['form_id'] = form_id
-            self.pending_forms[session_id].append(form_data)
-            print(f"✅ 添加表单: {form_id}, 类型: {form_data.get('type')}, 问题: {form_data.get('question', '')[:50]}")
-            return form_id
-
-    def get_pending_forms(self, session_id):
-        """获取所有待处理表单"""
-        with self.lock:
-            return self.pending_forms.get(session_id, [])
-
-    def remove_form(self, session_id, form_id):
-        """移除已处理的表单"""
-        with self.lock:
-            if session_id in self.pending_forms:
-                original_count = len(self.pending_forms[session_id])
-                self.pending_forms[session_id] = [
-                    f for f in self.pending_forms[session_id]
-                    if f['form_id'] != form_id
-                ]
-                if len(self.pending_forms[session_id]) < original_count:
-                    print(f"🗑️ 移除表单: {form_id}")
-
-    def clear_all_forms(self, session_id):
-        """清空所有表单"""
-        with self.lock:
-            if session_id in self.pending_forms:
-                count = len(self.pending_forms[session_id])
-                self.pending_forms[session_id] = []
-                print(f"🧹 清空 {count} 个表单")
-                return count
-            return 0
+session_manager = create_session_manager()
+session_manager.start_sweeper()
+messages = MessageHistory()  # 全局消息历史（定长环形缓冲）
+single_flight = SingleFlight(upstream_client)  # 相同的无上下文并发请求共享一个上游流
+response_cache = ResponseCache()  # 无上下文问答的完整响应缓存
 
-
-session_manager = SessionManager()
-messages = []  # 全局消息历史
+# 表单推送通道：心跳间隔及单个连接最长保持时间（秒），到期后由 EventSource 自动重连
+FORMS_STREAM_HEARTBEAT = 25
+FORMS_STREAM_MAX_SECONDS = 300
 
 # 线程池
 executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix="chat_worker")
@@ -154,6 +92,139 @@ def create_api_payload(user_input, conversation_id=""):
     }
 
 
+def forms_event(version, forms):
+    """序列化表单推送帧，id 为版本号，断线重连时通过 Last-Event-ID 带回"""
+    payload = {"status": "success", "version": version, "forms": forms, "count": len(forms)}
+    return f"id: {version}\ndata: {json.dumps(payload)}\n\n"
+
+
+def parse_forms_version(value):
+    """解析客户端已知的表单版本号（since 参数或 Last-Event-ID）"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def prepare_chat_request(data, session_id):
+    """校验聊天请求并构建上游请求上下文，返回 (错误信息, 上下文)"""
+    if not data:
+        return "无效的请求数据", None
+
+    user_input = data.get("message", "").strip()
+
+    if not user_input:
+        return "消息不能为空", None
+
+    if not validate_message_length(user_input, 2000):
+        return "消息过长，请缩短内容", None
+
+    user_input = sanitize_input(user_input)
+
+    # 获取会话
+    session_data = session_manager.get_or_create_session(session_id)
+
+    # 获取conversationId
+    conversation_id = ""
+    if data.get("conversation_id"):
+        conversation_id = data["conversation_id"]
+    elif session_data["conversationId"]:
+        conversation_id = session_data["conversationId"]
+
+    print(f"📤 用户消息: {user_input[:100]}...")
+    print(f"   conversation_id: {conversation_id}")
+
+    return None, {
+        "session_id": session_id,
+        "session_data": session_data,
+        "conversation_id": conversation_id,
+        # 构建API请求体
+        "payload": create_api_payload(user_input, conversation_id)
+    }
+
+
+def parse_upstream_line(line):
+    """解析上游的一行SSE数据，返回 data 字典；空行、非 data 行或无法解析时返回 None"""
+    if not line:
+        return None
+    decoded_line = line.decode('utf-8') if isinstance(line, bytes) else line
+    if not decoded_line.startswith('data:'):
+        return None
+    try:
+        return json.loads(decoded_line[5:])
+    except json.JSONDecodeError:
+        return None
+
+
+def stream_events(data):
+    """流式过程中的上游事件（非 workflow_finished）转换为转发给前端的事件列表，不访问会话存储"""
+    event = data.get("event")
+    if event == "stream_start":
+        # 流式输出开始
+        return [{'type': 'start', 'message': '开始接收回答...'}]
+
+    elif event == "stream_chunk":
+        # 流式输出中间片段
+        chunk = data.get("data", {}).get("chunk", "")
+        if chunk:
+            return [{'type': 'chunk', 'chunk': chunk}]
+
+    return []
+
+
+def complete_chat(data, chat):
+    """处理 workflow_finished：更新会话并保存答案，返回完整答案事件（会写会话存储）"""
+    answer = data.get("data", {}).get("outputs", {}).get("answer", "")
+
+    # 更新conversationId（共享他人上游流或命中缓存的请求不接管对方的会话）
+    if "conversationId" in data and not chat.get("shared"):
+        chat["conversation_id"] = data["conversationId"]
+        session_manager.update_session(chat["session_id"], {
+            "conversationId": chat["conversation_id"]
+        })
+        print(f"   🔄 更新conversationId: {chat['conversation_id']}")
+
+    # 保存消息到历史记录
+    save_answer(chat, answer)
+
+    # 流式输出的最后一部分：完整答案
+    chat["completed"] = True
+    return [{'type': 'complete', 'answer': answer, 'conversation_id': chat["conversation_id"]}]
+
+
+def handle_upstream_line(line, chat):
+    """处理上游的一行SSE数据，返回需要转发给前端的事件列表"""
+    data = parse_upstream_line(line)
+    if data is None:
+        return []
+    if data.get("event") == "workflow_finished":
+        return complete_chat(data, chat)
+    return stream_events(data)
+
+
+def iter_upstream_events(lines, chat):
+    """把上游SSE行流转换为转发给前端的事件流；上游等待超时产出的 None 原样交给转发层"""
+    for line in lines:
+        if line is None:
+            yield None
+            continue
+        yield from handle_upstream_line(line, chat)
+
+
+def save_answer(chat, answer):
+    """保存完整答案到全局及会话历史"""
+    record = HistoryRecord(
+        id=session_manager.get_next_message_id(),
+        message=answer,
+        timestamp=datetime.now().isoformat(),
+        session_id=chat["session_id"]
+    )
+
+    # 全局与会话历史共享同一条记录，不做拷贝
+    messages.append(record)
+    session_manager.append_message(chat["session_id"], record)
+
+
 # ========== 路由 ==========
 @app.route('/')
 def index():
@@ -164,12 +235,44 @@ def index():
 def get_pending_forms():
     """获取所有待处理表单"""
     session_id = request.remote_addr or "anonymous"
-    forms = session_manager.get_pending_forms(session_id)
-    return jsonify({
+    version, forms = session_manager.get_forms_snapshot(session_id)
+    response = jsonify({
         "status": "success",
+        "version": version,
         "forms": forms,
         "count": len(forms)
     })
+    # 支持 If-None-Match：表单未变化时返回 304
+    response.set_etag(f"forms-{version}")
+    return response.make_conditional(request)
+
+
+@app.route('/api/forms/stream', methods=['GET'])
+def stream_pending_forms():
+    """表单推送通道（SSE）：表单变更时推送完整列表，空闲时只发送心跳"""
+    session_id = request.remote_addr or "anonymous"
+    known_version = parse_forms_version(
+        request.headers.get('Last-Event-ID') or request.args.get('since')
+    )
+
+    def generate_forms():
+        version = known_version
+        deadline = time.monotonic() + FORMS_STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            if version is None:
+                current_version, forms = session_manager.get_forms_snapshot(session_id)
+            else:
+                current_version, forms = session_manager.wait_forms_changed(
+                    session_id, version, FORMS_STREAM_HEARTBEAT
+                )
+            if current_version == version:
+                yield ": heartbeat\n\n"
+                continue
+            version = current_version
+            yield forms_event(version, forms)
+
+    return Response(generate_forms(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route('/api/submit_form', methods=['POST'])
@@ -360,122 +463,75 @@ def post_message():
     """处理用户消息 - 流式输出"""
     try:
         data = request.get_json()
-        if not data:
-            return jsonify({
-                "status": "error",
-                "message": "无效的请求数据"
-            }), 400
-
-        user_input = data.get("message", "").strip()
-        option_value = data.get("option_value", "")
-
-        if not user_input:
-            return jsonify({
-                "status": "error",
-                "message": "消息不能为空"
-            }), 400
-
-        if not validate_message_length(user_input, 2000):
+        session_id = request.remote_addr or "anonymous"
+        error_message, chat = prepare_chat_request(data, session_id)
+        if error_message:
             return jsonify({
                 "status": "error",
-                "message": "消息过长，请缩短内容"
+                "message": error_message
             }), 400
 
-        user_input = sanitize_input(user_input)
-
-        # 获取会话
-        session_id = request.remote_addr or "anonymous"
-        session_data = session_manager.get_or_create_session(session_id)
-
-        # 获取conversationId
-        conversation_id = ""
-        if data.get("conversation_id"):
-            conversation_id = data["conversation_id"]
-        elif session_data["conversationId"]:
-            conversation_id = session_data["conversationId"]
-
-        print(f"📤 用户消息: {user_input[:100]}...")
-        print(f"   conversation_id: {conversation_id}")
-
-        # 构建API请求体
-        payload = create_api_payload(user_input, conversation_id)
+        # 开发服务器暴露客户端socket：等待响应头以及上游停顿期间每隔 disconnect_poll 秒检查浏览器是否已断开
+        client_socket = request.environ.get('werkzeug.socket')
+        should_stop = (lambda: socket_disconnected(client_socket)) if client_socket else None
 
         def generate_stream():
             """生成流式响应"""
+            response = None
+            flight = None
+            cancelled = False
+            timer = RelayTimer()
             try:
-                response = requests.post(
-                    "https://auodigital.corpnet.auo.com:8080/ex/api/dfApp/run",
-                    json=payload,
-                    headers={
-                        "Authorization": "K2405124",
-                        "Content-Type": "application/json"
-                    },
-                    verify=False,
-                    stream=True,
-                    timeout=30
-                )
-                response.raise_for_status()
-
-                answer = ""
-                new_conversation_id = conversation_id
-
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith('data:'):
-                            try:
-                                data = json.loads(decoded_line[5:])
-                                if data.get("event") == "workflow_finished":
-                                    answer = data.get("data", {}).get("outputs", {}).get("answer", "")
-
-                                    # 更新conversationId
-                                    if "conversationId" in data:
-                                        new_conversation_id = data["conversationId"]
-                                        session_manager.update_session(session_id, {
-                                            "conversationId": new_conversation_id
-                                        })
-                                        print(f"   🔄 更新conversationId: {new_conversation_id}")
-
-                                    # 流式输出的最后一部分：完整答案
-                                    yield f"data: {json.dumps({'type': 'complete', 'answer': answer,'conversation_id': new_conversation_id})}\n\n"
-
-                                    # 保存消息到历史记录
-                                    timestamp = datetime.now().isoformat()
-                                    message_id = session_manager.get_next_message_id()
-
-                                    new_message = {
-                                        "id": message_id,
-                                        "message": answer,
-                                        "timestamp": timestamp,
-                                        "session_id": session_id
-                                    }
-
-                                    messages.append(new_message)
-                                    session_data["messages"].append(new_message)
-                                    if len(session_data["messages"]) > 100:
-                                        session_data["messages"] = session_data["messages"][-100:]
-
-                                elif data.get("event") == "stream_start":
-                                    # 流式输出开始
-                                    yield f"data: {json.dumps({'type': 'start','message': '开始接收回答...'})}\n\n"
-
-                                elif data.get("event") == "stream_chunk":
-                                    # 流式输出中间片段
-                                    chunk = data.get("data", {}).get("chunk", "")
-                                    if chunk:
-                                        yield f"data: {json.dumps({'type': 'chunk','chunk': chunk})}\n\n"
-
-                            except json.JSONDecodeError:
-                                continue
+                cache_key = response_cache.key(chat["payload"])
+                cached = response_cache.get(cache_key) if cache_key is not None else None
+                flight_key = single_flight.key(chat["payload"])
+                if cached is not None:
+                    # 命中缓存：重放上游原始行，前端收到相同的事件序列
+                    chat["shared"] = True
+                    lines = iter(cached)
+                elif flight_key is not None:
+                    # 相同的无上下文请求正在进行时直接订阅其上游流
+                    flight, is_leader = single_flight.join(flight_key, chat["payload"])
+                    chat["shared"] = not is_leader
+                    lines = single_flight.iter_lines(flight, timer)
                 else:
+                    # 使用共享连接池，复用keep-alive连接，避免每轮对话重新握手
+                    response = upstream_client.post_stream(chat["payload"], should_stop=should_stop,
+                                                           poll=sse_relay.disconnect_poll)
+                    response.raise_for_status()
+                    lines = upstream_client.iter_lines(response, timer)
+
+                if cache_key is not None and cached is None and not chat.get("shared"):
+                    lines = response_cache.record(cache_key, lines)
+
+                # 经转发层合并小帧，客户端读得慢时暂停读取上游
+                events = iter_upstream_events(lines, chat)
+                for frame in sse_relay.relay(events, should_stop, timer):
+                    yield frame
+
+                if not chat.get("completed"):
                     # 如果没有获取到完整答案，返回错误
-                    yield f"data: {json.dumps({'type': 'error','message': '未获取到完整响应'})}\n\n"
+                    yield sse_event({'type': 'error', 'message': '未获取到完整响应'})
 
+            except (StreamCancelled, GeneratorExit):
+                # 浏览器已关闭或中止请求：不再继续读取上游
+                cancelled = True
+                print(f"⏹️ 客户端已断开，取消上游请求: {session_id[:8]}")
             except requests.exceptions.Timeout:
-                yield f"data: {json.dumps({'type': 'error','message': '请求超时，请稍后重试'})}\n\n"
-            except requests.exceptions.RequestException as e:yield f"data: {json.dumps({'type': 'error','message': f'API请求失败: {str(e)}'})}\n\n"
+                yield sse_event({'type': 'error', 'message': '请求超时，请稍后重试'})
+            except requests.exceptions.RequestException as e:
+                yield sse_event({'type': 'error', 'message': f'API请求失败: {str(e)}'})
             except Exception as e:
-                yield f"data: {json.dumps({'type': 'error','message': f'处理失败: {str(e)}'})}\n\n"
+                yield sse_event({'type': 'error', 'message': f'处理失败: {str(e)}'})
+            finally:
+                # 归还连接到连接池；已取消的流直接断开上游连接
+                if flight is not None:
+                    single_flight.leave(flight)
+                elif response is not None:
+                    if cancelled:
+                        upstream_client.cancel(response)
+                    else:
+                        response.close()
 
         # 返回流式响应
         return Response(generate_stream(), mimetype='text/event-stream')
@@ -495,15 +551,13 @@ def post_message():
 @app.route('/reset', methods=['POST'])
 def reset_conversation():
     """重置会话"""
-    global messages
-
     session_id = request.remote_addr or "anonymous"
 
-    # 清空消息历史
-    messages = []
+    # 清空消息历史（原地清空，ASGI模式共享同一个列表）
+    messages.clear()
 
     # 清空会话
-    session_manager.sessions.clear()
+    session_manager.clear_sessions()
 
     # 清空待处理表单
     session_manager.clear_all_forms(session_id)
@@ -529,7 +583,14 @@ def health_check():
         "service": "chatbot",
         "version": "2.0",
         "pending_forms": len(forms),
-        "active_sessions": len(session_manager.sessions)
+        "active_sessions": session_manager.session_count(),
+        "threads": active_count(),
+        "session_store": session_manager.stats(),
+        "message_history": messages.stats(),
+        "upstream": upstream_client.stats(),
+        "relay": sse_relay.stats(),
+        "single_flight": single_flight.stats(),
+        "response_cache": response_cache.stats()
     })
 
 
@@ -569,6 +630,8 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         print("\n🛑 正在关闭应用...")
         executor.shutdown(wait=True)
+        upstream_client.close()
+        messages.flush()
         print("✅ 应用已关闭")
     except Exception as e:
         print(f"❌ 启动失败: {e}")
@@ -0,0 +1,424 @@
+"""
+异步（ASGI）服务模式
+
+/post、/api/forms、/reset、/api/health 使用 asyncio 原生实现，上游请求走 aiohttp 异步连接池，
+空闲的SSE流只占用协程而不占用线程；其余路由挂载原 Flask 应用（在线程池中执行）。
+
+启动: python asgi_app.py  或  uvicorn asgi_app:application --port 5008
+"""
+import asyncio
+import contextlib
+import time
+from datetime import datetime
+from threading import Lock, active_count
+
+import aiohttp
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (app as flask_app, session_manager, messages, response_cache,
+                 prepare_chat_request, parse_upstream_line, stream_events, complete_chat, sse_event, forms_event, parse_forms_version,
+                 FORMS_STREAM_HEARTBEAT, FORMS_STREAM_MAX_SECONDS)
+from relay import sse_relay, StreamCancelled
+from singleflight import AsyncSingleFlight
+from response_cache import replay_async
+from upstream import (UPSTREAM_RUN_URL, UPSTREAM_HEADERS, UPSTREAM_POOL_PER_HOST,
+                      UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_FIRST_BYTE_TIMEOUT, UPSTREAM_IDLE_TIMEOUT)
+
+
+class AsyncUpstreamClient:
+    """基于 aiohttp 的上游客户端：连接池 + 分阶段超时"""
+
+    def __init__(self, pool_per_host=UPSTREAM_POOL_PER_HOST,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+                 first_byte_timeout=UPSTREAM_FIRST_BYTE_TIMEOUT,
+                 idle_timeout=UPSTREAM_IDLE_TIMEOUT, verify=False):
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.idle_timeout = idle_timeout
+        self.pool_per_host = pool_per_host
+        self.verify = verify
+        self.session = None
+
+        self.lock = Lock()
+        self.counters = {
+            "requests": 0,
+            "errors": 0,
+            "handshakes": 0,
+            "pool_reuses": 0,
+            "first_byte_timeouts": 0,
+            "idle_timeouts": 0,
+            "cancelled": 0,
+            "first_byte_ms_total": 0.0
+        }
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def _get_session(self):
+        # 延迟创建，保证绑定到运行中的事件循环
+        if self.session is None:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_end.append(self._on_connection_create)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+            self.session = aiohttp.ClientSession(
+                headers=UPSTREAM_HEADERS,
+                connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_per_host,
+                                               ssl=None if self.verify else False),
+                # 首字节与块间空闲超时由 post_stream / iter_lines 分阶段控制
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout),
+                trace_configs=[trace_config]
+            )
+        return self.session
+
+    async def _on_connection_create(self, session, context, params):
+        self._count("handshakes")
+
+    async def _on_connection_reuse(self, session, context, params):
+        self._count("pool_reuses")
+
+    async def post_stream(self, payload, url=UPSTREAM_RUN_URL):
+        """发送流式POST请求，返回已收到响应头的 ClientResponse（调用方负责 release）"""
+        session = self._get_session()
+        self._count("requests")
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                session.post(url, json=payload),
+                self.connect_timeout + self.first_byte_timeout
+            )
+        except asyncio.TimeoutError:
+            self._count("first_byte_timeouts")
+            self._count("errors")
+            raise
+        except aiohttp.ClientError:
+            self._count("errors")
+            raise
+        self._count("first_byte_ms_total", (time.monotonic() - started) * 1000)
+        return response
+
+    async def iter_lines(self, response):
+        """逐行读取流式响应，两行之间超过空闲超时则抛出 asyncio.TimeoutError"""
+        while True:
+            try:
+                line = await asyncio.wait_for(response.content.readline(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                self._count("idle_timeouts")
+                raise
+            if not line:
+                return
+            yield line.rstrip(b"\r\n")
+
+    def cancel(self, response):
+        """客户端已离开：关闭上游响应，连接直接断开而不放回连接池"""
+        self._count("cancelled")
+        response.close()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+
+        completed = counters["requests"] - counters["errors"]
+        avg_first_byte = counters.pop("first_byte_ms_total") / completed if completed > 0 else 0.0
+        pool_requests = counters["handshakes"] + counters["pool_reuses"]
+        hit_rate = counters["pool_reuses"] / pool_requests if pool_requests else 0.0
+
+        return {
+            **counters,
+            "pool_requests": pool_requests,
+            "pool_hit_rate": round(hit_rate, 4),
+            "avg_first_byte_ms": round(avg_first_byte, 1),
+            "limits": {
+                "pool_per_host": self.pool_per_host,
+                "connect_timeout": self.connect_timeout,
+                "first_byte_timeout": self.first_byte_timeout,
+                "idle_timeout": self.idle_timeout
+            }
+        }
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+async_upstream_client = AsyncUpstreamClient()
+async_single_flight = AsyncSingleFlight(async_upstream_client)
+
+
+class FormWaiters:
+    """表单变更的协程唤醒器：SessionManager 可能在任意线程回调，这里转回事件循环"""
+
+    def __init__(self):
+        self.loop = None
+        self.waiters = {}  # session_id -> set(asyncio.Event)
+
+    def attach(self, loop):
+        self.loop = loop
+        session_manager.add_form_listener(self.on_forms_changed)
+
+    def on_forms_changed(self, session_id, version):
+        if self.loop is not None and session_id in self.waiters:
+            self.loop.call_soon_threadsafe(self._wake, session_id)
+
+    def _wake(self, session_id):
+        for event in self.waiters.get(session_id, ()):
+            event.set()
+
+    def register(self, session_id):
+        event = asyncio.Event()
+        self.waiters.setdefault(session_id, set()).add(event)
+        return event
+
+    def unregister(self, session_id, event):
+        events = self.waiters.get(session_id)
+        if events is not None:
+            events.discard(event)
+            if not events:
+                del self.waiters[session_id]
+
+
+form_waiters = FormWaiters()
+
+
+def client_session_id(request):
+    """与 Flask 模式一致：以客户端IP作为会话ID"""
+    return request.client.host if request.client else "anonymous"
+
+
+async def iter_upstream_events(lines, chat):
+    """把上游SSE行流转换为转发给前端的事件流（异步）
+
+    逐行解析在事件循环上完成；只有 workflow_finished 会写会话存储（SQLite 后端为阻塞调用），放到线程池中执行
+    """
+    async for line in lines:
+        data = parse_upstream_line(line)
+        if data is None:
+            continue
+        if data.get("event") == "workflow_finished":
+            payloads = await asyncio.to_thread(complete_chat, data, chat)
+        else:
+            payloads = stream_events(data)
+        for payload in payloads:
+            yield payload
+
+
+# ========== 路由 ==========
+async def post_message(request):
+    """处理用户消息 - 流式输出（异步）"""
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        session_id = client_session_id(request)
+        # 读取/创建会话会访问会话存储，不在事件循环线程上阻塞
+        error_message, chat = await asyncio.to_thread(prepare_chat_request, data, session_id)
+        if error_message:
+            return JSONResponse({
+                "status": "error",
+                "message": error_message
+            }, status_code=400)
+
+        async def generate_stream():
+            """生成流式响应"""
+            response = None
+            flight = None
+            cancelled = False
+            try:
+                cache_key = response_cache.key(chat["payload"])
+                cached = response_cache.get(cache_key) if cache_key is not None else None
+                flight_key = async_single_flight.key(chat["payload"])
+                if cached is not None:
+                    # 命中缓存：重放上游原始行，前端收到相同的事件序列
+                    chat["shared"] = True
+                    lines = replay_async(cached)
+                elif flight_key is not None:
+                    # 相同的无上下文请求正在进行时直接订阅其上游流
+                    flight, is_leader = async_single_flight.join(flight_key, chat["payload"])
+                    chat["shared"] = not is_leader
+                    lines = async_single_flight.iter_lines(flight)
+                else:
+                    response = await async_upstream_client.post_stream(chat["payload"])
+                    response.raise_for_status()
+                    lines = async_upstream_client.iter_lines(response)
+
+                if cache_key is not None and cached is None and not chat.get("shared"):
+                    lines = response_cache.record_async(cache_key, lines)
+
+                events = iter_upstream_events(lines, chat)
+                async for frame in sse_relay.relay_async(events, request.is_disconnected):
+                    yield frame
+
+                if not chat.get("completed"):
+                    # 与同步模式一致：没有获取到完整答案时返回错误
+                    yield sse_event({'type': 'error', 'message': '未获取到完整响应'})
+
+            except (StreamCancelled, asyncio.CancelledError, GeneratorExit) as e:
+                # 浏览器已关闭或中止请求：不再继续读取上游
+                cancelled = True
+                print(f"⏹️ 客户端已断开，取消上游请求: {chat['session_id'][:8]}")
+                if not isinstance(e, StreamCancelled):
+                    raise
+            except asyncio.TimeoutError:
+                yield sse_event({'type': 'error', 'message': '请求超时，请稍后重试'})
+            except aiohttp.ClientError as e:
+                yield sse_event({'type': 'error', 'message': f'API请求失败: {str(e)}'})
+            except Exception as e:
+                yield sse_event({'type': 'error', 'message': f'处理失败: {str(e)}'})
+            finally:
+                # 归还连接到连接池；已取消的流直接断开上游连接
+                if flight is not None:
+                    async_single_flight.leave(flight)
+                elif response is not None:
+                    if cancelled:
+                        async_upstream_client.cancel(response)
+                    else:
+                        response.release()
+
+        return StreamingResponse(generate_stream(), media_type='text/event-stream')
+
+    except Exception as e:
+        error_msg = f"请求处理失败: {str(e)}"
+        print(f"❌ 处理消息时出错: {error_msg}")
+
+        return JSONResponse({
+            "status": "error",
+            "message": error_msg,
+            "timestamp": datetime.now().isoformat()
+        }, status_code=500)
+
+
+async def get_pending_forms(request):
+    """获取所有待处理表单"""
+    version, forms = await asyncio.to_thread(session_manager.get_forms_snapshot, client_session_id(request))
+    etag = f'"forms-{version}"'
+    # 支持 If-None-Match：表单未变化时返回 304
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({
+        "status": "success",
+        "version": version,
+        "forms": forms,
+        "count": len(forms)
+    }, headers={"ETag": etag})
+
+
+async def stream_pending_forms(request):
+    """表单推送通道（SSE）：表单变更时推送完整列表，空闲时只发送心跳"""
+    session_id = client_session_id(request)
+    known_version = parse_forms_version(
+        request.headers.get("last-event-id") or request.query_params.get("since")
+    )
+
+    async def generate_forms():
+        version = known_version
+        event = form_waiters.register(session_id)
+        # 共享存储后端的变更可能来自其他进程，需按其轮询间隔重新检查版本号
+        wait_timeout = session_manager.forms_poll_interval or FORMS_STREAM_HEARTBEAT
+        deadline = time.monotonic() + FORMS_STREAM_MAX_SECONDS
+        last_sent = time.monotonic()
+        try:
+            while time.monotonic() < deadline:
+                event.clear()
+                current_version, forms = await asyncio.to_thread(session_manager.get_forms_snapshot, session_id)
+                if current_version != version:
+                    version = current_version
+                    last_sent = time.monotonic()
+                    yield forms_event(version, forms)
+                    continue
+                try:
+                    await asyncio.wait_for(event.wait(), wait_timeout)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - last_sent >= FORMS_STREAM_HEARTBEAT:
+                        last_sent = time.monotonic()
+                        yield ": heartbeat\n\n"
+        finally:
+            form_waiters.unregister(session_id, event)
+
+    return StreamingResponse(generate_forms(), media_type='text/event-stream',
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def reset_conversation(request):
+    """重置会话"""
+    session_id = client_session_id(request)
+
+    def reset():
+        messages.clear()
+        session_manager.clear_sessions()
+        session_manager.clear_all_forms(session_id)
+
+    await asyncio.to_thread(reset)
+
+    print(f"🔄 重置会话: {session_id[:8]}")
+
+    return JSONResponse({
+        "status": "success",
+        "message": "会话已重置",
+        "timestamp": datetime.now().isoformat()
+    })
+
+
+async def health_check(request):
+    """健康检查"""
+    session_id = client_session_id(request)
+
+    def collect():
+        return (session_manager.get_pending_forms(session_id), session_manager.session_count(),
+                session_manager.stats())
+
+    forms, session_count, session_stats = await asyncio.to_thread(collect)
+
+    return JSONResponse({
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "service": "chatbot",
+        "version": "2.0",
+        "mode": "asgi",
+        "pending_forms": len(forms),
+        "active_sessions": session_count,
+        "threads": active_count(),
+        "session_store": session_stats,
+        "message_history": messages.stats(),
+        "upstream": async_upstream_client.stats(),
+        "relay": sse_relay.stats(),
+        "single_flight": async_single_flight.stats(),
+        "response_cache": response_cache.stats()
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    form_waiters.attach(asyncio.get_running_loop())
+    yield
+    await async_upstream_client.close()
+    messages.flush()
+
+
+application = Starlette(
+    routes=[
+        Route('/post', post_message, methods=['POST']),
+        Route('/api/forms', get_pending_forms, methods=['GET']),
+        Route('/api/forms/stream', stream_pending_forms, methods=['GET']),
+        Route('/reset', reset_conversation, methods=['POST']),
+        Route('/api/health', health_check, methods=['GET']),
+        # 其余路由（页面、静态文件、表单提交等）交给原 Flask 应用
+        Mount('/', app=WSGIMiddleware(flask_app))
+    ],
+    lifespan=lifespan
+)
+
+
+# ========== 启动应用 ==========
+if __name__ == '__main__':
+    print("=" * 50)
+    print("🤖 AUKS会议预约助手 v2.0 (ASGI模式)")
+    print(f"⏰ 启动时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("=" * 50)
+
+    uvicorn.run(application, host="0.0.0.0", port=5008)
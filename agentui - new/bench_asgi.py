@@ -0,0 +1,184 @@
+"""
+并发压测：线程模式（Flask threaded=True）vs 异步模式（ASGI）
+
+模拟上游 dfApp 以固定间隔缓慢吐出数据块，大量并发的、基本空闲的SSE流同时挂起，
+对比两种模式的完成情况、首块延迟和服务端线程数峰值。
+
+用法: python bench_asgi.py --clients 500 --chunks 5 --interval 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ========== 模拟上游 ==========
+def serve_upstream(port, chunks, interval):
+    """基于 Starlette 的慢速SSE上游，按固定间隔输出数据块"""
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import StreamingResponse
+    from starlette.routing import Route
+
+    async def run(request):
+        body = await request.json()
+
+        async def gen():
+            yield 'data:' + json.dumps({"event": "stream_start"}) + '\n\n'
+            for i in range(chunks):
+                await asyncio.sleep(interval)
+                yield 'data:' + json.dumps({"event": "stream_chunk", "data": {"chunk": f"片段{i} "}}) + '\n\n'
+            yield 'data:' + json.dumps({
+                "event": "workflow_finished",
+                "conversationId": "bench",
+                "data": {"outputs": {"answer": body.get("query", "")}}
+            }) + '\n\n'
+
+        return StreamingResponse(gen(), media_type='text/event-stream')
+
+    app = Starlette(routes=[Route('/run', run, methods=['POST'])])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+# ========== 压测客户端 ==========
+async def one_stream(session, url, index, results):
+    started = time.monotonic()
+    first_chunk = None
+    completed = False
+    try:
+        async with session.post(url, json={"message": f"压测消息 {index}"}) as response:
+            async for raw in response.content:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[6:])
+                if data["type"] == "chunk" and first_chunk is None:
+                    first_chunk = time.monotonic() - started
+                elif data["type"] == "complete":
+                    completed = True
+    except Exception as e:
+        results["errors"].append(type(e).__name__)
+    results["total"].append(time.monotonic() - started)
+    if first_chunk is not None:
+        results["first_chunk"].append(first_chunk)
+    if completed:
+        results["completed"] += 1
+
+
+async def sample_threads(session, health_url, results, stop):
+    while not stop.is_set():
+        try:
+            async with session.get(health_url) as response:
+                health = await response.json()
+            results["peak_threads"] = max(results["peak_threads"], health.get("threads", 0))
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+
+
+async def run_load(base_url, clients):
+    results = {"completed": 0, "errors": [], "total": [], "first_chunk": [], "peak_threads": 0}
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_threads(session, base_url + "/api/health", results, stop))
+        started = time.monotonic()
+        await asyncio.gather(*(one_stream(session, base_url + "/post", i, results) for i in range(clients)))
+        results["wall"] = time.monotonic() - started
+        stop.set()
+        await sampler
+    return results
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def wait_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"端口 {port} 启动超时")
+
+
+def start_server(mode, port, env):
+    if mode == "threaded":
+        code = ("import app; app.app.run(host='127.0.0.1', port=%d, threaded=True, "
+                "debug=False)" % port)
+        cmd = [sys.executable, "-c", code]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi_app:application", "--host", "127.0.0.1",
+               "--port", str(port), "--log-level", "warning", "--backlog", "4096"]
+    return subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程模式 vs ASGI模式 并发压测")
+    parser.add_argument("--clients", type=int, default=500, help="并发流数量")
+    parser.add_argument("--chunks", type=int, default=5, help="每个回答的数据块数量")
+    parser.add_argument("--interval", type=float, default=1.0, help="上游数据块间隔（秒）")
+    parser.add_argument("--modes", default="threaded,asgi")
+    parser.add_argument("--serve-upstream", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_upstream:
+        serve_upstream(args.serve_upstream, args.chunks, args.interval)
+        return
+
+    upstream_port, server_port = 5911, 5912
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve-upstream", str(upstream_port),
+         "--chunks", str(args.chunks), "--interval", str(args.interval)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    env = dict(os.environ,
+               UPSTREAM_RUN_URL=f"http://127.0.0.1:{upstream_port}/run",
+               UPSTREAM_POOL_PER_HOST=str(args.clients))
+
+    print("=" * 60)
+    print(f"📊 并发流: {args.clients}, 每流 {args.chunks} 块, 间隔 {args.interval}s")
+    print("=" * 60)
+    try:
+        time.sleep(1.5)
+        for mode in args.modes.split(","):
+            server = start_server(mode, server_port, env)
+            try:
+                wait_port(server_port)
+                results = asyncio.run(run_load(f"http://127.0.0.1:{server_port}", args.clients))
+            finally:
+                server.terminate()
+                server.wait()
+
+            print(f"\n[{mode}]")
+            print(f"  完成: {results['completed']}/{args.clients}, 错误: {len(results['errors'])}")
+            print(f"  总耗时: {results['wall']:.2f}s")
+            if results["first_chunk"]:
+                print(f"  首块延迟 p50/p95: {statistics.median(results['first_chunk']):.3f}s / "
+                      f"{percentile(results['first_chunk'], 0.95):.3f}s")
+            print(f"  单流耗时 p50/p95: {statistics.median(results['total']):.3f}s / "
+                  f"{percentile(results['total'], 0.95):.3f}s")
+            print(f"  服务端线程峰值: {results['peak_threads']}")
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+编码检测微基准：旧版 auto_decode（全文 chardet）vs EncodingDetector
+
+1. 校验新旧实现在各类样例上的解码结果一致；GBK 样例旧版因 chardet 置信度不足回退为
+   UTF-8(ignore) 而乱码，新版校验 GB18030 后得到原文，标记为"修正"
+2. 对比解码耗时；非UTF-8样例额外给出按路径缓存命中后的耗时
+
+用法: python bench_decode.py --scale 1 --repeat 3
+"""
+import argparse
+import time
+
+import chardet
+
+from text_encoding import EncodingDetector
+
+
+def legacy_auto_decode(byte_content):
+    """旧版实现（去掉日志输出）：无BOM时对全文运行 chardet"""
+    if not byte_content:
+        return ""
+    if byte_content.startswith(b'\xef\xbb\xbf'):
+        try:
+            return byte_content.decode('utf-8-sig')
+        except Exception:
+            pass
+    elif byte_content.startswith(b'\xff\xfe'):
+        try:
+            return byte_content.decode('utf-16')
+        except Exception:
+            pass
+    elif byte_content.startswith(b'\xfe\xff'):
+        try:
+            return byte_content.decode('utf-16-be')
+        except Exception:
+            pass
+    try:
+        detect_result = chardet.detect(byte_content)
+        if detect_result['confidence'] > 0.7 and detect_result['encoding']:
+            return byte_content.decode(detect_result['encoding'], errors='ignore')
+    except Exception:
+        pass
+    return byte_content.decode('utf-8', errors='ignore')
+
+
+def make_ini(sections):
+    return "\n".join(
+        f"[设备{i}]\nname=工位{i}\nip=10.12.{i % 255}.{i % 200}\nenabled=true\n描述=第{i}号产线配置\n"
+        for i in range(sections))
+
+
+def make_xml(items):
+    body = "".join(f'  <item id="{i}" name="参数{i}">value {i} 温度{i % 90}℃</item>\n' for i in range(items))
+    return f'<?xml version="1.0" encoding="utf-8"?>\n<root>\n{body}</root>\n'
+
+
+def make_log(lines):
+    levels = ["INFO", "WARN", "ERROR", "DEBUG"]
+    return "".join(
+        f"2024-05-20 14:{i % 60:02d}:{i % 60:02d}.{i % 1000:03d} {levels[i % 4]} [线程-{i % 8}] "
+        f"处理请求 {i} 完成，耗时 {i % 300}ms\n" for i in range(lines))
+
+
+def build_samples(scale):
+    """返回 [(名称, 字节内容, 原文)]"""
+    ini = make_ini(20)
+    xml = make_xml(20000 * scale)
+    log = make_log(40000 * scale)
+    ascii_log = make_log(20000 * scale).replace("处理请求", "handled").replace("完成，耗时", "cost") \
+        .replace("线程", "thread")
+    return [
+        ("ini utf-8 (小)", ini.encode("utf-8"), ini),
+        ("ini gbk (小)", ini.encode("gbk"), ini),
+        ("xml utf-8", xml.encode("utf-8"), xml),
+        ("xml utf-8 BOM", b"\xef\xbb\xbf" + xml.encode("utf-8"), xml),
+        ("log ascii", ascii_log.encode("ascii"), ascii_log),
+        ("log utf-8", log.encode("utf-8"), log),
+        ("log gbk", log.encode("gbk"), log),
+    ]
+
+
+def verdict(legacy_text, new_text, text):
+    if new_text == legacy_text:
+        return "是"
+    if new_text == text:
+        return "修正"
+    return "否"
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1, help="样例规模倍数")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最快一次")
+    args = parser.parse_args()
+
+    print(f"{'样例':<16}{'大小':>10}{'旧版(ms)':>12}{'新版(ms)':>12}{'缓存命中(ms)':>14}{'加速':>10}  一致")
+    for name, data, text in build_samples(args.scale):
+        detector = EncodingDetector()
+        legacy_text, legacy_ms = timed(lambda: legacy_auto_decode(data), args.repeat)
+        new_text, new_ms = timed(lambda: EncodingDetector().decode(data, name), args.repeat)
+        detector.decode(data, name)
+        _, cached_ms = timed(lambda: detector.decode(data, name), args.repeat)
+        print(f"{name:<16}{len(data) / 1024:>9.0f}K{legacy_ms:>12.1f}{new_ms:>12.2f}{cached_ms:>14.2f}"
+              f"{legacy_ms / max(new_ms, 1e-6):>9.0f}x  {verdict(legacy_text, new_text, text)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+并发压测：process_ftp_file（每个调用占一个线程）vs async_process_ftp_file（同一事件循环）
+
+模拟FTP服务器对每条命令延迟固定时间后应答（远端服务器的往返时间），
+大量并发的工具调用同时读取/搜索配置文件，对比吞吐、单次调用耗时、线程数峰值与建立的FTP连接数。
+
+用法: python bench_ftp_async.py --calls 4000 --concurrency 1000 --latency 0.05 --connections 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = "/bench"
+
+
+# ========== 模拟FTP服务器 ==========
+def make_files(count, file_kb):
+    """生成 count 个约 file_kb KB 的 JSON 配置文件"""
+    files = {}
+    for i in range(count):
+        items = []
+        size = 0
+        while size < file_kb * 1024:
+            item = {"name": f"param_{len(items)}", "value": f"value {i}-{len(items)}", "enabled": True,
+                    "limits": {"min": 0, "max": len(items)}}
+            items.append(item)
+            size += len(json.dumps(item)) + 2
+        files[f"{BENCH_DIR}/config_{i}.json"] = json.dumps({"recipe": i, "items": items}, indent=1).encode()
+    return files
+
+
+def serve_ftp(port, latency, files):
+    """基于 asyncio 的最小FTP服务器：每条命令等待 latency 秒后应答，只支持被动模式"""
+    modify = "20240101000000"
+
+    async def open_passive():
+        accepted = asyncio.get_running_loop().create_future()
+
+        async def on_connect(reader, writer):
+            if accepted.done():
+                writer.close()
+            else:
+                accepted.set_result((reader, writer))
+
+        server = await asyncio.start_server(on_connect, "127.0.0.1", 0)
+        return server, accepted, server.sockets[0].getsockname()[1]
+
+    async def session(reader, writer):
+        cwd = "/"
+        rest = 0
+        passive = None
+
+        def reply(line):
+            writer.write((line + "\r\n").encode())
+
+        def path_of(name):
+            return os.path.normpath(os.path.join(cwd, name or "."))
+
+        async def data_connection():
+            nonlocal passive
+            server, accepted, _ = passive
+            passive = None
+            reply("150 opening data connection")
+            data_reader, data_writer = await accepted
+            server.close()
+            return data_reader, data_writer
+
+        reply("220 bench")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                cmd, _, arg = raw.decode("utf-8", "replace").rstrip("\r\n").partition(" ")
+                cmd = cmd.upper()
+                if latency:
+                    await asyncio.sleep(latency)
+                if cmd == "USER":
+                    reply("331 password")
+                elif cmd == "PASS":
+                    reply("230 logged in")
+                elif cmd == "PWD":
+                    reply(f'257 "{cwd}"')
+                elif cmd == "CWD":
+                    target = path_of(arg)
+                    if target == "/" or any(name.startswith(target.rstrip("/") + "/") for name in files):
+                        cwd = target
+                        reply("250 ok")
+                    else:
+                        reply("550 no such directory")
+                elif cmd in ("TYPE", "NOOP", "OPTS"):
+                    reply("200 ok")
+                elif cmd == "PASV":
+                    passive = await open_passive()
+                    port_number = passive[2]
+                    reply(f"227 Entering Passive Mode (127,0,0,1,{port_number >> 8},{port_number & 255})")
+                elif cmd == "REST":
+                    rest = int(arg)
+                    reply("350 ok")
+                elif cmd in ("SIZE", "MDTM", "MLST"):
+                    data = files.get(path_of(arg))
+                    if data is None:
+                        reply("550 no such file")
+                    elif cmd == "SIZE":
+                        reply(f"213 {len(data)}")
+                    elif cmd == "MDTM":
+                        reply(f"213 {modify}")
+                    else:
+                        reply(f"250-Listing {arg}\r\n type=file;size={len(data)};modify={modify}; {arg}\r\n250 End")
+                elif cmd == "MLSD":
+                    prefix = cwd.rstrip("/") + "/"
+                    lines = [f"type=cdir;modify={modify}; ."]
+                    lines += [f"type=file;size={len(data)};modify={modify}; {name[len(prefix):]}"
+                              for name, data in files.items()
+                              if name.startswith(prefix) and "/" not in name[len(prefix):]]
+                    _, data_writer = await data_connection()
+                    data_writer.write(("\r\n".join(lines) + "\r\n").encode())
+                    await data_writer.drain()
+                    data_writer.close()
+                    reply("226 done")
+                elif cmd == "RETR":
+                    data = files.get(path_of(arg))
+                    if data is None:
+                        reply("550 no such file")
+                        continue
+                    _, data_writer = await data_connection()
+                    try:
+                        data_writer.write(data[rest:])
+                        await data_writer.drain()
+                        data_writer.close()
+                        reply("226 done")
+                    except ConnectionError:
+                        reply("426 aborted")
+                    rest = 0
+                elif cmd in ("STOR", "APPE"):
+                    data_reader, data_writer = await data_connection()
+                    data = await data_reader.read()
+                    data_writer.close()
+                    path = path_of(arg)
+                    files[path] = (files.get(path, b"") if cmd == "APPE" else b"") + data
+                    reply("226 done")
+                elif cmd == "DELE":
+                    reply("250 deleted" if files.pop(path_of(arg), None) is not None else "550 no such file")
+                elif cmd == "QUIT":
+                    reply("221 bye")
+                    break
+                else:
+                    reply("502 not implemented")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(session, "127.0.0.1", port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+# ========== 压测客户端 ==========
+def workload(calls, files, operations):
+    """第 i 次调用的 (文件名, 操作, 搜索词)"""
+    names = sorted(os.path.basename(name) for name in files)
+    operations = operations.split(",")
+    for i in range(calls):
+        operation = operations[i % len(operations)]
+        yield names[i % len(names)], operation, "param_1" if operation == "search" else None
+
+
+class ThreadSampler:
+    """定时记录进程的线程数峰值"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop.wait(0.05):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+
+def run_sync(jobs, concurrency, credentials):
+    from post import process_ftp_file
+
+    def one(job):
+        filename, operation, content = job
+        started = time.monotonic()
+        result = process_ftp_file(file_path=BENCH_DIR, filename=filename, content=content, operation=operation,
+                                  **credentials)
+        return time.monotonic() - started, result
+
+    with ThreadSampler() as sampler:
+        started = time.monotonic()
+        # MCP 服务器的同步写法：每个并发的工具调用占用一个线程
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(one, jobs))
+        wall = time.monotonic() - started
+    return wall, outcomes, sampler.peak
+
+
+def run_async(jobs, concurrency, credentials):
+    from post_async import async_process_ftp_file
+
+    async def one(job, limit):
+        filename, operation, content = job
+        async with limit:
+            started = time.monotonic()
+            result = await async_process_ftp_file(file_path=BENCH_DIR, filename=filename, content=content,
+                                                  operation=operation, **credentials)
+            return time.monotonic() - started, result
+
+    async def main():
+        limit = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(one(job, limit) for job in jobs))
+
+    with ThreadSampler() as sampler:
+        started = time.monotonic()
+        outcomes = asyncio.run(main())
+        wall = time.monotonic() - started
+    return wall, outcomes, sampler.peak
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def wait_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"端口 {port} 启动超时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步 vs 异步 FTP 工具调用并发压测")
+    parser.add_argument("--calls", type=int, default=4000, help="工具调用总数")
+    parser.add_argument("--concurrency", type=int, default=1000, help="同时进行的工具调用数（同步模式的线程数）")
+    parser.add_argument("--files", type=int, default=50, help="文件数")
+    parser.add_argument("--file-kb", type=int, default=16, help="每个文件的大小（KB）")
+    parser.add_argument("--latency", type=float, default=0.05, help="服务器每条命令的应答延迟（秒）")
+    parser.add_argument("--operations", default="read,search", help="轮流执行的操作")
+    parser.add_argument("--connections", type=int, default=64, help="异步模式每个主机同时使用的连接数上限")
+    parser.add_argument("--no-content-cache", action="store_true", help="关闭内容缓存，每次调用都下载与解析")
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--port", type=int, default=2199)
+    parser.add_argument("--serve-ftp", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    files = make_files(args.files, args.file_kb)
+    if args.serve_ftp:
+        serve_ftp(args.port, args.latency, files)
+        return
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve-ftp", "--port", str(args.port),
+         "--files", str(args.files), "--file-kb", str(args.file_kb), "--latency", str(args.latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    os.environ["FTP_ASYNC_MAX_CONNECTIONS"] = str(args.connections)
+    # 空闲连接上限放宽到并发数，两种模式都不因归还时超出上限而反复重连
+    os.environ["FTP_POOL_MAX_SIZE"] = str(max(args.concurrency, args.connections))
+    if args.no_content_cache:
+        os.environ["FTP_CONTENT_CACHE_ENABLED"] = "0"
+    sys.path.insert(0, HERE)
+    import ftplib
+    # 工具函数没有端口参数，连接默认端口 FTP.port
+    ftplib.FTP.port = args.port
+    from ftp_pool import ftp_pool
+    from ftp_async import async_ftp_pool
+    from ftp_listing import listing_cache
+    from content_cache import content_cache
+
+    credentials = {"ftp_host": "127.0.0.1", "ftp_user": "bench", "ftp_pass": "bench"}
+    jobs = list(workload(args.calls, files, args.operations))
+    runners = {"sync": run_sync, "async": run_async}
+    pools = {"sync": ftp_pool, "async": async_ftp_pool}
+
+    print("=" * 60)
+    print(f"📊 调用: {args.calls}, 并发: {args.concurrency}, 文件: {args.files} x {args.file_kb}KB, "
+          f"命令延迟: {args.latency * 1000:.0f}ms, 操作: {args.operations}")
+    print("=" * 60)
+    try:
+        wait_port(args.port)
+        for mode in args.modes.split(","):
+            # 各模式从冷缓存开始
+            listing_cache.clear()
+            content_cache.clear()
+            connects = pools[mode].stats()["connects"]
+            wall, outcomes, peak_threads = runners[mode](jobs, args.concurrency, credentials)
+            durations = [duration for duration, _ in outcomes]
+            errors = [result for _, result in outcomes if not isinstance(result, dict) or "error" in result]
+
+            print(f"\n[{mode}]")
+            print(f"  完成: {len(outcomes) - len(errors)}/{len(outcomes)}, 错误: {len(errors)}")
+            if errors:
+                print(f"  首个错误: {errors[0]}")
+            print(f"  总耗时: {wall:.2f}s, 吞吐: {len(outcomes) / wall:.1f} 次/秒")
+            print(f"  单次调用 p50/p95: {statistics.median(durations) * 1000:.1f}ms / "
+                  f"{percentile(durations, 0.95) * 1000:.1f}ms")
+            print(f"  线程峰值: {peak_threads}, 新建FTP连接: {pools[mode].stats()['connects'] - connects}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+# ========== FTP文件内容缓存配置 ==========
+# 按 (主机, 用户, 路径) 缓存解码后的文本与解析结果，以服务器返回的 SIZE + MDTM 校验是否仍有效
+FTP_CONTENT_CACHE_ENABLED = os.environ.get("FTP_CONTENT_CACHE_ENABLED", "1") == "1"
+# 内存中缓存文本（含搜索索引）的总字符数上限
+FTP_CONTENT_CACHE_MAX_CHARS = int(os.environ.get("FTP_CONTENT_CACHE_MAX_CHARS", str(64 * 1024 * 1024)))
+# 超过该大小（字节）的文件不缓存，如大日志文件
+FTP_CONTENT_CACHE_MAX_FILE_BYTES = int(os.environ.get("FTP_CONTENT_CACHE_MAX_FILE_BYTES", str(8 * 1024 * 1024)))
+# 磁盘缓存目录，为空时不启用磁盘层；磁盘层只保存文本，命中后重新解析并放回内存
+FTP_CONTENT_CACHE_DIR = os.environ.get("FTP_CONTENT_CACHE_DIR", "")
+
+
+class ContentEntry:
+    """一个文件的缓存内容；parsed 为 None 表示尚未解析（来自磁盘层），index 为再次搜索时建立的搜索索引"""
+
+    def __init__(self, size, modify, byte_size, text, file_type, parsed=None):
+        self.size = size
+        self.modify = modify
+        self.byte_size = byte_size
+        self.text = text
+        self.file_type = file_type
+        self.parsed = parsed
+        self.index = None
+        self.searches = 0
+        self.key = None
+
+    def matches(self, stat):
+        return stat['size'] == self.size and stat['modify'] == self.modify
+
+    def weight(self):
+        """计入容量的字符数：文本 + 搜索索引"""
+        return len(self.text) + (self.index.chars if self.index is not None else 0)
+
+
+class ContentCache:
+    """FTP文件内容缓存：内存层 LRU（按文本与搜索索引的长度计容量）+ 可选磁盘层
+
+    只有 SIZE 与 MDTM 都可用时才缓存；两者任一变化即视为文件已修改。
+    解析结果由调用方只读使用，需要交给外部的对象应由文本重新解析。
+    """
+
+    def __init__(self, enabled=FTP_CONTENT_CACHE_ENABLED, max_chars=FTP_CONTENT_CACHE_MAX_CHARS,
+                 max_file_bytes=FTP_CONTENT_CACHE_MAX_FILE_BYTES, cache_dir=FTP_CONTENT_CACHE_DIR):
+        self.enabled = enabled
+        self.max_chars = max_chars
+        self.max_file_bytes = max_file_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()  # (主机, 用户, 路径) -> ContentEntry
+        self.chars = 0
+        self.lock = Lock()
+        self.counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(conn, filename):
+        return conn.path_key(filename)
+
+    def cacheable(self, stat):
+        return (self.enabled and stat is not None and stat.get('size') is not None
+                and stat.get('modify') is not None and stat['size'] <= self.max_file_bytes)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1('\0'.join(key).encode('utf-8')).hexdigest() + '.json')
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return ContentEntry(data['size'], data['modify'], data['byte_size'], data['text'], data['file_type'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, entry):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'size': entry.size,
+                    'modify': entry.modify,
+                    'byte_size': entry.byte_size,
+                    'file_type': entry.file_type,
+                    'text': entry.text
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _evict_over_budget(self):
+        """调用方需持有 self.lock"""
+        while self.chars > self.max_chars and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.chars -= evicted.weight()
+            self.counters["evictions"] += 1
+
+    def _store(self, key, entry):
+        entry.key = key
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.chars -= old.weight()
+            self.entries[key] = entry
+            self.chars += entry.weight()
+            self._evict_over_budget()
+
+    def get(self, conn, filename, stat):
+        """返回与 stat 一致的缓存内容，没有则返回 None"""
+        if not self.cacheable(stat):
+            return None
+        key = self.key(conn, filename)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and not entry.matches(stat):
+                del self.entries[key]
+                self.chars -= entry.weight()
+                self.counters["stale"] += 1
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry
+
+        if self.cache_dir:
+            entry = self._read_disk(key)
+            if entry is not None and entry.matches(stat):
+                self._store(key, entry)
+                with self.lock:
+                    self.counters["disk_hits"] += 1
+                return entry
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, conn, filename, stat, byte_size, text, file_type, parsed):
+        """缓存文件内容，返回新条目；不可缓存时返回 None"""
+        if not self.cacheable(stat):
+            return None
+        key = self.key(conn, filename)
+        entry = ContentEntry(stat['size'], stat['modify'], byte_size, text, file_type, parsed)
+        self._store(key, entry)
+        with self.lock:
+            self.counters["stores"] += 1
+        if self.cache_dir:
+            self._write_disk(key, entry)
+        return entry
+
+    def count_search(self, entry):
+        """记录一次对该条目的搜索，返回累计次数"""
+        with self.lock:
+            entry.searches += 1
+            return entry.searches
+
+    def attach_index(self, entry, index):
+        """把搜索索引挂到条目上并计入容量，超出上限时按 LRU 淘汰"""
+        with self.lock:
+            if index is None or entry.index is not None:
+                return
+            entry.index = index
+            # 条目已被淘汰或替换时索引随条目一起丢弃，不再计入
+            if self.entries.get(entry.key) is entry:
+                self.chars += index.chars
+                self._evict_over_budget()
+
+    def invalidate(self, conn, filename):
+        """本进程写入或删除文件后调用"""
+        key = self.key(conn, filename)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.chars -= entry.weight()
+        if self.cache_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.chars = 0
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.entries)
+            chars = self.chars
+        lookups = counters["hits"] + counters["disk_hits"] + counters["misses"] + counters["stale"]
+        return {
+            "enabled": self.enabled,
+            "size": size,
+            "chars": chars,
+            "max_chars": self.max_chars,
+            "disk": bool(self.cache_dir),
+            **counters,
+            "hit_rate": round((counters["hits"] + counters["disk_hits"]) / lookups, 4) if lookups else 0.0
+        }
+
+
+content_cache = ContentCache()
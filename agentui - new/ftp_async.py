@@ -0,0 +1,415 @@
+import os
+import time
+import asyncio
+import socket
+from collections import deque
+from ftplib import FTP, error_reply, error_temp, error_perm, error_proto, parse227, parse229, parse257
+from threading import Lock
+
+from ftp_pool import PooledFTP, FTP_POOL_MAX_SIZE, FTP_POOL_IDLE_TIMEOUT, FTP_POOL_CHECK_INTERVAL, FTP_TIMEOUT
+from ftp_trace import tracer
+
+# ========== 异步FTP连接配置 ==========
+# 每个 (主机, 用户) 同时使用的连接数上限；并发调用超出时排队等待，避免压垮服务器的连接数限制
+FTP_ASYNC_MAX_CONNECTIONS = int(os.environ.get("FTP_ASYNC_MAX_CONNECTIONS", "16"))
+# 数据连接每次读取的块大小
+FTP_ASYNC_BLOCK_SIZE = 64 * 1024
+
+CRLF = '\r\n'
+
+
+class AsyncFTP:
+    """基于 asyncio 流的FTP客户端，只实现本项目用到的命令
+
+    方法名、参数与 ftplib.FTP 一致（改为协程），应答错误抛出 ftplib 的异常类型，
+    因此 is_unsupported 等判断可以直接沿用。只使用被动模式（IPv4 用 PASV，IPv6 用 EPSV）。
+    """
+
+    def __init__(self, timeout=FTP_TIMEOUT, encoding='utf-8'):
+        self.timeout = timeout
+        self.encoding = encoding
+        self.reader = None
+        self.writer = None
+        self.host = None
+        self.family = socket.AF_INET
+        self.transfer_type = None  # 当前的 TYPE，相同时不再发送
+        self.welcome = None
+
+    async def connect(self, host, port=0):
+        # 与 ftplib 一致，端口默认取 FTP.port
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port or FTP.port), self.timeout)
+        peer = self.writer.get_extra_info('peername')
+        self.host = peer[0]
+        self.family = self.writer.get_extra_info('socket').family
+        self.welcome = await self.getresp()
+        return self.welcome
+
+    async def _readline(self, reader):
+        line = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not line:
+            raise EOFError
+        return line.decode(self.encoding, errors='replace').rstrip('\r\n')
+
+    async def getresp(self):
+        """读取一条应答（含多行应答），按首位数字抛出 ftplib 的异常"""
+        line = await self._readline(self.reader)
+        if line[3:4] == '-':
+            code = line[:3]
+            lines = [line]
+            while True:
+                next_line = await self._readline(self.reader)
+                lines.append(next_line)
+                if next_line[:3] == code and next_line[3:4] != '-':
+                    break
+            line = '\n'.join(lines)
+        first = line[:1]
+        if first in {'1', '2', '3'}:
+            return line
+        if first == '4':
+            raise error_temp(line)
+        if first == '5':
+            raise error_perm(line)
+        raise error_proto(line)
+
+    async def voidresp(self):
+        resp = await self.getresp()
+        if resp[:1] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def sendcmd(self, cmd):
+        if '\r' in cmd or '\n' in cmd:
+            raise ValueError('an illegal newline character should not be contained')
+        self.writer.write((cmd + CRLF).encode(self.encoding))
+        await self.writer.drain()
+        return await self.getresp()
+
+    async def voidcmd(self, cmd):
+        resp = await self.sendcmd(cmd)
+        if resp[:1] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def login(self, user='', passwd=''):
+        resp = await self.sendcmd('USER ' + user)
+        if resp[0] == '3':
+            resp = await self.sendcmd('PASS ' + passwd)
+        if resp[0] != '2':
+            raise error_reply(resp)
+        return resp
+
+    async def pwd(self):
+        resp = await self.voidcmd('PWD')
+        if not resp.startswith('257'):
+            return ''
+        return parse257(resp)
+
+    async def cwd(self, dirname):
+        return await self.voidcmd('CWD ' + dirname)
+
+    async def size(self, filename):
+        resp = await self.sendcmd('SIZE ' + filename)
+        if resp[:3] == '213':
+            return int(resp[3:].strip())
+        return None
+
+    async def delete(self, filename):
+        resp = await self.sendcmd('DELE ' + filename)
+        if resp[:3] in {'250', '200'}:
+            return resp
+        raise error_reply(resp)
+
+    async def _set_type(self, transfer_type):
+        if self.transfer_type != transfer_type:
+            await self.voidcmd('TYPE ' + transfer_type)
+            self.transfer_type = transfer_type
+
+    async def transfercmd(self, cmd, rest=None):
+        """建立被动模式数据连接并发送传输命令，返回数据连接的 (reader, writer)"""
+        if self.family == socket.AF_INET:
+            # 与 ftplib 默认行为一致，忽略 PASV 应答中的地址，连接控制连接的对端
+            _, port = parse227(await self.sendcmd('PASV'))
+            host = self.host
+        else:
+            host, port = parse229(await self.sendcmd('EPSV'), self.writer.get_extra_info('peername'))
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        try:
+            if rest is not None:
+                await self.sendcmd(f'REST {rest}')
+            resp = await self.sendcmd(cmd)
+            if resp[0] == '2':
+                resp = await self.getresp()
+            if resp[0] != '1':
+                raise error_reply(resp)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def retrbinary(self, cmd, callback, blocksize=FTP_ASYNC_BLOCK_SIZE, rest=None):
+        """callback 为普通函数；抛出异常时关闭数据连接并原样抛出，传输结束应答留给调用方读取"""
+        await self._set_type('I')
+        reader, writer = await self.transfercmd(cmd, rest)
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(blocksize), self.timeout)
+                if not data:
+                    break
+                callback(data)
+        finally:
+            writer.close()
+        return await self.voidresp()
+
+    async def retrlines(self, cmd, callback):
+        await self._set_type('A')
+        reader, writer = await self.transfercmd(cmd)
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not line:
+                    break
+                callback(line.decode(self.encoding, errors='replace').rstrip('\r\n'))
+        finally:
+            writer.close()
+        return await self.voidresp()
+
+    async def storbinary(self, cmd, data, blocksize=FTP_ASYNC_BLOCK_SIZE):
+        """上传 bytes（ftplib 为文件对象）"""
+        await self._set_type('I')
+        reader, writer = await self.transfercmd(cmd)
+        try:
+            view = memoryview(data)
+            for start in range(0, len(view), blocksize):
+                writer.write(view[start:start + blocksize])
+                await asyncio.wait_for(writer.drain(), self.timeout)
+        finally:
+            writer.close()
+        await writer.wait_closed()
+        return await self.voidresp()
+
+    async def mlsd(self, path=''):
+        """返回 [(名称, facts)]（ftplib 为生成器）"""
+        rows = []
+
+        def collect(line):
+            facts_found, _, name = line.rstrip(CRLF).partition(' ')
+            entry = {}
+            for fact in facts_found[:-1].split(';'):
+                key, _, value = fact.partition('=')
+                entry[key.lower()] = value
+            rows.append((name, entry))
+
+        await self.retrlines(f'MLSD {path}' if path else 'MLSD', collect)
+        return rows
+
+    async def quit(self):
+        try:
+            return await self.voidcmd('QUIT')
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            try:
+                writer.close()
+            except RuntimeError:
+                # 所属事件循环已关闭（如多次 asyncio.run），套接字随传输对象回收
+                pass
+
+
+class AsyncPooledFTP(PooledFTP):
+    """一个已登录的 AsyncFTP 会话；path_key/resolve 同 PooledFTP，chdir/close 为协程"""
+
+    def __init__(self, key, ftp, home):
+        self.key = key
+        self.ftp = ftp
+        self.home = home
+        self.cwd = home
+        self.last_used = time.monotonic()
+        self.needs_check = False
+
+    async def chdir(self, path=None):
+        target = self.resolve(path)
+        if target == self.cwd:
+            return
+        with tracer.span('cwd'):
+            if path and not path.startswith('/') and self.cwd != self.home:
+                await self.ftp.cwd(self.home)
+                self.cwd = self.home
+            await self.ftp.cwd(path or self.home)
+        self.cwd = target
+
+    async def close(self):
+        try:
+            await self.ftp.quit()
+        except Exception:
+            self.ftp.close()
+
+
+class AsyncFTPPool:
+    """AsyncFTP 会话池，复用规则与 FTPConnectionPool 相同
+
+    另按 (主机, 用户, 密码) 限制同时使用的连接数（FTP_ASYNC_MAX_CONNECTIONS），
+    大量并发调用在事件循环上排队，而不是各自新建连接；有调用排队时归还的连接直接留给它。
+    空闲连接与信号量绑定在创建它们的事件循环上，换了事件循环时丢弃重建。
+    """
+
+    def __init__(self, max_size=FTP_POOL_MAX_SIZE, idle_timeout=FTP_POOL_IDLE_TIMEOUT,
+                 check_interval=FTP_POOL_CHECK_INTERVAL, timeout=FTP_TIMEOUT,
+                 max_connections=FTP_ASYNC_MAX_CONNECTIONS):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.idle = {}  # key -> deque(AsyncPooledFTP)，右端为最近归还
+        self.limits = {}  # key -> asyncio.Semaphore
+        self.waiting = {}  # key -> 正在等待连接数的调用数
+        self.loop = None
+        self.lock = Lock()  # 只保护计数，供其他线程读取 stats()
+        self.counters = {
+            "connects": 0,
+            "reuses": 0,
+            "health_checks": 0,
+            "health_failures": 0,
+            "expired": 0,
+            "discarded": 0,
+            "in_use": 0,
+            "waits": 0
+        }
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.ftp.close()
+            self.idle = {}
+            self.limits = {}
+            self.waiting = {}
+            self.loop = loop
+
+    async def connect(self, host, user, password):
+        """新建并登录一个连接（不经过连接池，也不占用连接数）"""
+        ftp = AsyncFTP(self.timeout)
+        with tracer.span('connect'):
+            await ftp.connect(host)
+        try:
+            with tracer.span('login'):
+                await ftp.login(user, password)
+                conn = AsyncPooledFTP((host, user, password), ftp, await ftp.pwd())
+        except BaseException:
+            ftp.close()
+            raise
+        self._count("connects")
+        return conn
+
+    async def acquire(self, host, user, password):
+        """取出一个可用连接；达到连接数上限时等待其他调用归还"""
+        self._bind_loop()
+        key = (host, user, password)
+        limit = self.limits.get(key)
+        if limit is None:
+            limit = self.limits[key] = asyncio.Semaphore(self.max_connections)
+        if limit.locked():
+            self._count("waits")
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+        try:
+            await limit.acquire()
+        finally:
+            self.waiting[key] -= 1
+        try:
+            conn = await self._take(key)
+            if conn is None:
+                conn = await self.connect(host, user, password)
+        except BaseException:
+            limit.release()
+            raise
+        self._count("in_use")
+        return conn
+
+    async def _take(self, key):
+        idle = self.idle.get(key)
+        while idle:
+            conn = idle.pop()
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for > self.idle_timeout:
+                self._count("expired")
+                conn.ftp.close()
+                continue
+            if idle_for > self.check_interval:
+                self._count("health_checks")
+                try:
+                    with tracer.span('NOOP'):
+                        await conn.ftp.voidcmd("NOOP")
+                except Exception:
+                    self._count("health_failures")
+                    conn.ftp.close()
+                    continue
+            self._count("reuses")
+            return conn
+        return None
+
+    async def release(self, conn, reusable=True):
+        """归还连接；reusable=False 时（如操作出错）先检查连接是否仍可用"""
+        self._count("in_use", -1)
+        limit = self.limits.get(conn.key)
+        try:
+            if not reusable or conn.needs_check:
+                try:
+                    with tracer.span('NOOP'):
+                        reply = await conn.ftp.sendcmd("NOOP")
+                    if not reply.startswith("200"):
+                        raise ValueError("unexpected NOOP reply")
+                    conn.needs_check = False
+                except Exception:
+                    self._count("discarded")
+                    conn.ftp.close()
+                    return
+
+            conn.last_used = time.monotonic()
+            idle = self.idle.setdefault(conn.key, deque())
+            while idle and conn.last_used - idle[0].last_used > self.idle_timeout:
+                self._count("expired")
+                idle.popleft().ftp.close()
+            # 有调用在排队时留给它复用，不关闭后再重连；没有排队时收缩到 max_size
+            idle.append(conn)
+            if not self.waiting.get(conn.key):
+                while len(idle) > self.max_size:
+                    self._count("discarded")
+                    await idle.popleft().close()
+        finally:
+            if limit is not None:
+                limit.release()
+
+    async def close_all(self):
+        conns = [conn for idle in self.idle.values() for conn in idle]
+        self.idle = {}
+        for conn in conns:
+            await conn.close()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        idle = {f"{key[1]}@{key[0]}": len(conns) for key, conns in list(self.idle.items()) if conns}
+        acquires = counters["connects"] + counters["reuses"]
+        return {
+            **counters,
+            "idle": idle,
+            "reuse_rate": round(counters["reuses"] / acquires, 4) if acquires else 0.0,
+            "limits": {
+                "max_size": self.max_size,
+                "max_connections": self.max_connections,
+                "idle_timeout": self.idle_timeout,
+                "check_interval": self.check_interval
+            }
+        }
+
+
+async_ftp_pool = AsyncFTPPool()
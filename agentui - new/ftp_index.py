@@ -0,0 +1,385 @@
+import os
+import time
+import fnmatch
+import calendar
+import sqlite3
+import posixpath
+from ftplib import error_perm
+from threading import Lock, Thread, Event
+from urllib.parse import urlsplit, unquote
+
+from ftp_pool import ftp_pool
+from ftp_listing import listing_cache
+
+# ========== FTP目录索引配置 ==========
+# SQLite 索引文件路径，为空时不启用索引，list/search_files 实时列目录
+FTP_INDEX_PATH = os.environ.get("FTP_INDEX_PATH", "")
+# 后台爬取的根目录，格式 ftp://用户:密码@主机/路径，多个用逗号分隔（密码中的特殊字符需 URL 编码）
+FTP_INDEX_ROOTS = os.environ.get("FTP_INDEX_ROOTS", "")
+# 增量刷新间隔（秒）：只重新列出修改时间变化的目录
+FTP_INDEX_REFRESH_SECONDS = float(os.environ.get("FTP_INDEX_REFRESH_SECONDS", "300"))
+# 完整刷新间隔（秒）：原地修改的文件不会改变目录修改时间，定期全部重新列出
+FTP_INDEX_FULL_REFRESH_SECONDS = float(os.environ.get("FTP_INDEX_FULL_REFRESH_SECONDS", "3600"))
+FTP_INDEX_MAX_DEPTH = int(os.environ.get("FTP_INDEX_MAX_DEPTH", "16"))
+
+GLOB_CHARS = ('*', '?', '[')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    host TEXT NOT NULL,
+    user TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER,
+    modify TEXT,
+    ext TEXT,
+    PRIMARY KEY (host, user, path)
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (host, user, parent);
+CREATE TABLE IF NOT EXISTS directories (
+    host TEXT NOT NULL,
+    user TEXT NOT NULL,
+    path TEXT NOT NULL,
+    modify TEXT,
+    listed_at REAL NOT NULL,
+    PRIMARY KEY (host, user, path)
+);
+"""
+
+
+def is_glob(pattern):
+    return any(char in pattern for char in GLOB_CHARS)
+
+
+def match_name(name, pattern):
+    """文件名匹配：含 * ? [ 时按通配符（'abc*' 即前缀），否则按子串；pattern 已转小写"""
+    if is_glob(pattern):
+        return fnmatch.fnmatchcase(name.lower(), pattern)
+    return pattern in name.lower()
+
+
+def parse_root(url):
+    """ftp://用户:密码@主机/路径 -> (主机, 用户, 密码, 路径)"""
+    parts = urlsplit(url.strip())
+    return (parts.hostname, unquote(parts.username or ''), unquote(parts.password or ''),
+            unquote(parts.path) or '/')
+
+
+def modify_timestamp(modify):
+    """MLSD/MLST 的 modify（UTC，YYYYMMDDHHMMSS[.sss]）转为时间戳，无法解析时返回 None"""
+    try:
+        return calendar.timegm(time.strptime(modify[:14], '%Y%m%d%H%M%S'))
+    except (TypeError, ValueError):
+        return None
+
+
+def trusted_modify(row):
+    """directories 表的 (modify, listed_at) 中可信的目录修改时间，不可信时返回 None
+
+    修改时间只精确到秒：列出目录时距其修改时间不足 2 秒的，同一秒内之后的变化可能无法察觉，视为不可信
+    """
+    if row is None or row[0] is None:
+        return None
+    timestamp = modify_timestamp(row[0])
+    if timestamp is None or row[1] - timestamp < 2:
+        return None
+    return row[0]
+
+
+def format_listed_at(listed_at):
+    """directories.listed_at（时间戳）转为本地时间字符串"""
+    if listed_at is None:
+        return None
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(listed_at))
+
+
+def _subtree_range(path):
+    """path 之下所有路径的区间 [起, 止)，可直接利用主键索引"""
+    prefix = path.rstrip('/') + '/'
+    return prefix, prefix[:-1] + '0'  # '0' 紧跟在 '/' 之后
+
+
+class FTPIndex:
+    """远程FTP目录树的本地元数据索引（SQLite）：路径、大小、修改时间、类型
+
+    - 后台线程按配置的根目录爬取；增量刷新时先用 MLST 读取目录修改时间，未变化的目录不重新列出
+    - list / search_files 先用 MLST 读取目录当前的修改时间，与索引一致时直接查询本地索引；
+      未索引、修改时间不一致或无法读取（服务器不支持 MLST）的目录仍实时列出
+    - 本进程的 STOR/DELE 通过 note_change 立即更新索引
+    """
+
+    def __init__(self, path=FTP_INDEX_PATH, roots=FTP_INDEX_ROOTS, refresh_interval=FTP_INDEX_REFRESH_SECONDS,
+                 full_refresh_interval=FTP_INDEX_FULL_REFRESH_SECONDS, max_depth=FTP_INDEX_MAX_DEPTH):
+        self.path = path
+        self.enabled = bool(path)
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.max_depth = max_depth
+        self.roots = [parse_root(url) for url in roots.split(',') if url.strip()]
+        self.lock = Lock()
+        self.db = None
+        self.thread = None
+        self.stop_event = Event()
+        self.last_full_refresh = None
+        self.last_error = None
+        self.counters = {
+            "crawls": 0,
+            "directories_listed": 0,
+            "directories_unchanged": 0,
+            "lookups": 0,
+            "stale_lookups": 0,
+            "errors": 0
+        }
+
+    def _connect(self):
+        if self.db is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+        return self.db
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    # ---------- 查询 ----------
+
+    def is_indexed(self, host, user, path):
+        if not self.enabled:
+            return False
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT 1 FROM directories WHERE host=? AND user=? AND path=?", (host, user, path)).fetchone()
+        return row is not None
+
+    def directory_modify(self, host, user, path):
+        """索引中记录的目录修改时间；未启用、目录未索引或修改时间不可信时返回 None"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT modify, listed_at FROM directories WHERE host=? AND user=? AND path=?",
+                (host, user, path)).fetchone()
+        return trusted_modify(row)
+
+    def list_directory(self, host, user, path, current_modify):
+        """返回已索引目录的 (文件列表, 目录列表)
+
+        current_modify 为服务器上该目录当前的修改时间（MLST）；与索引记录的不一致或任一方不可用时
+        索引可能已过期，返回 None，由调用方实时列出
+        """
+        modify = self.directory_modify(host, user, path)
+        if modify is None or current_modify is None:
+            return None
+        if modify != current_modify:
+            self._count("stale_lookups")
+            return None
+        self._count("lookups")
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT name, kind FROM entries WHERE host=? AND user=? AND parent=? ORDER BY name",
+                (host, user, path)).fetchall()
+        files = [name for name, kind in rows if kind == 'file']
+        dirs = [name for name, kind in rows if kind == 'dir']
+        return files, dirs
+
+    def search(self, host, user, path, pattern, limit=None):
+        """在已索引目录的整棵子树中按文件名匹配（子串 / 通配符 / 前缀 'abc*'）
+
+        返回条目列表 {'path'（相对 path）, 'name', 'type', 'size', 'modify', 'listed_at'}；目录未索引时返回 None。
+        子目录不做实时校验，结果反映的是所在目录上次列出（listed_at，本地时间）时的状态
+        """
+        if not self.is_indexed(host, user, path):
+            return None
+        self._count("lookups")
+        start, end = _subtree_range(path)
+        pattern = pattern.lower()
+        if is_glob(pattern):
+            condition, argument = "e.name_lower GLOB ?", pattern
+        else:
+            condition, argument = "instr(e.name_lower, ?) > 0", pattern
+        sql = (f"SELECT e.path, e.name, e.kind, e.size, e.modify, d.listed_at FROM entries e "
+               f"LEFT JOIN directories d ON d.host=e.host AND d.user=e.user AND d.path=e.parent "
+               f"WHERE e.host=? AND e.user=? AND e.path>=? AND e.path<? AND {condition} ORDER BY e.path")
+        arguments = [host, user, start, end, argument]
+        if limit:
+            sql += " LIMIT ?"
+            arguments.append(int(limit))
+        with self.lock:
+            rows = self._connect().execute(sql, arguments).fetchall()
+        return [{
+            'path': full_path[len(start):],
+            'name': name,
+            'type': kind,
+            'size': size,
+            'modify': modify,
+            'listed_at': format_listed_at(listed_at)
+        } for full_path, name, kind, size, modify, listed_at in rows]
+
+    # ---------- 写入 ----------
+
+    def _store_directory(self, host, user, path, entries, modify):
+        """用一次目录列表替换该目录的直接子项；消失的子目录连同其子树一起删除"""
+        rows = []
+        for entry in entries:
+            name = entry['name']
+            rows.append((host, user, posixpath.join(path, name), path, name, name.lower(), entry['type'],
+                         entry['size'], entry['modify'],
+                         os.path.splitext(name)[1].lower() if entry['type'] == 'file' else None))
+        with self.lock:
+            db = self._connect()
+            with db:
+                new_dirs = {entry['name'] for entry in entries if entry['type'] == 'dir'}
+                old_dirs = [name for (name,) in db.execute(
+                    "SELECT name FROM entries WHERE host=? AND user=? AND parent=? AND kind='dir'",
+                    (host, user, path))]
+                for name in old_dirs:
+                    if name not in new_dirs:
+                        self._delete_subtree(db, host, user, posixpath.join(path, name))
+                db.execute("DELETE FROM entries WHERE host=? AND user=? AND parent=?", (host, user, path))
+                db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                db.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?)",
+                           (host, user, path, modify, time.time()))
+
+    @staticmethod
+    def _delete_subtree(db, host, user, path):
+        start, end = _subtree_range(path)
+        db.execute("DELETE FROM entries WHERE host=? AND user=? AND path>=? AND path<?", (host, user, start, end))
+        db.execute("DELETE FROM directories WHERE host=? AND user=? AND (path=? OR (path>=? AND path<?))",
+                   (host, user, path, start, end))
+
+    def note_change(self, conn, filename, size=None, deleted=False):
+        """本进程在当前目录写入或删除了文件；目录修改时间清空，下次刷新时重新列出"""
+        if not self.enabled:
+            return
+        host, user = conn.key[0], conn.key[1]
+        directory = conn.cwd
+        path = posixpath.join(directory, filename)
+        with self.lock:
+            db = self._connect()
+            with db:
+                if db.execute("SELECT 1 FROM directories WHERE host=? AND user=? AND path=?",
+                              (host, user, directory)).fetchone() is None:
+                    return
+                if deleted:
+                    db.execute("DELETE FROM entries WHERE host=? AND user=? AND path=?", (host, user, path))
+                else:
+                    db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (host, user, path, directory, filename, filename.lower(), 'file', size, None,
+                                os.path.splitext(filename)[1].lower()))
+                db.execute("UPDATE directories SET modify=NULL WHERE host=? AND user=? AND path=?",
+                           (host, user, directory))
+
+    # ---------- 爬取 ----------
+
+    def _remove_directory(self, host, user, path):
+        with self.lock:
+            db = self._connect()
+            with db:
+                self._delete_subtree(db, host, user, path)
+                db.execute("DELETE FROM entries WHERE host=? AND user=? AND path=?", (host, user, path))
+
+    def _directory_state(self, host, user, path):
+        """返回 (可信的目录修改时间或 None, 已索引的子目录)"""
+        with self.lock:
+            db = self._connect()
+            row = db.execute("SELECT modify, listed_at FROM directories WHERE host=? AND user=? AND path=?",
+                             (host, user, path)).fetchone()
+            children = [child for (child,) in db.execute(
+                "SELECT path FROM entries WHERE host=? AND user=? AND parent=? AND kind='dir'", (host, user, path))]
+        return trusted_modify(row), children
+
+    def crawl(self, host, user, password, root, full=False):
+        """爬取一个根目录；full=False 时跳过修改时间未变化的目录（仍会检查其子目录）"""
+        conn = ftp_pool.acquire(host, user, password)
+        reusable = False
+        try:
+            conn.chdir(root)
+            stack = [(conn.cwd, 0)]
+            while stack:
+                path, depth = stack.pop()
+                modify, children = self._directory_state(host, user, path)
+                if modify is not None and not full:
+                    current = listing_cache.directory_modify(conn, path)
+                    if current is not None and current == modify:
+                        self._count("directories_unchanged")
+                        if depth < self.max_depth:
+                            stack.extend((child, depth + 1) for child in children)
+                        continue
+
+                try:
+                    conn.chdir(path)
+                except error_perm:
+                    if depth == 0:
+                        raise
+                    # 索引中的子目录已被删除
+                    self._remove_directory(host, user, path)
+                    continue
+                entries, modify = listing_cache.list_details(conn)
+                if modify is None:
+                    modify = listing_cache.directory_modify(conn, path)
+                self._store_directory(host, user, path, entries, modify)
+                self._count("directories_listed")
+                if depth < self.max_depth:
+                    stack.extend((posixpath.join(path, entry['name']), depth + 1)
+                                 for entry in entries if entry['type'] == 'dir')
+            reusable = True
+        finally:
+            ftp_pool.release(conn, reusable=reusable)
+        self._count("crawls")
+
+    def refresh(self, full=False):
+        """爬取所有配置的根目录一遍"""
+        for host, user, password, root in list(self.roots):
+            try:
+                self.crawl(host, user, password, root, full)
+            except Exception as e:
+                self.last_error = f"{host}{root}: {e}"
+                self._count("errors")
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            full = self.last_full_refresh is None or now - self.last_full_refresh >= self.full_refresh_interval
+            self.refresh(full)
+            if full:
+                self.last_full_refresh = now
+            self.stop_event.wait(self.refresh_interval)
+
+    def start(self):
+        """启动后台爬取线程（已启动、未启用或没有根目录时不做任何事）"""
+        with self.lock:
+            if self.thread is not None or not self.enabled or not self.roots:
+                return
+            self.thread = Thread(target=self._run, name="ftp-index", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            if self.enabled:
+                db = self._connect()
+                entries = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                directories = db.execute("SELECT COUNT(*) FROM directories").fetchone()[0]
+            else:
+                entries = directories = 0
+        return {
+            "enabled": self.enabled,
+            "roots": [f"{host}{root}" for host, _, _, root in self.roots],
+            "entries": entries,
+            "directories": directories,
+            "running": self.thread is not None and self.thread.is_alive(),
+            "last_error": self.last_error,
+            **counters
+        }
+
+
+ftp_index = FTPIndex()
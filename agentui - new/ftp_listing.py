@@ -0,0 +1,408 @@
+import os
+import time
+from collections import OrderedDict
+from ftplib import error_perm
+from threading import Lock
+
+from ftp_trace import tracer
+
+# ========== 目录列表缓存配置 ==========
+# 解析后的目录列表缓存时间（秒）；本进程的 STOR/DELE 会立即使对应目录失效
+FTP_LISTING_TTL = float(os.environ.get("FTP_LISTING_TTL", "10"))
+FTP_LISTING_MAX_ENTRIES = int(os.environ.get("FTP_LISTING_MAX_ENTRIES", "256"))
+
+# 这些响应码表示服务器不支持该命令，之后不再尝试
+UNSUPPORTED_CODES = ('500', '502', '504')
+
+
+def is_unsupported(error):
+    return str(error)[:3] in UNSUPPORTED_CODES
+
+
+def parse_list_line(line):
+    """解析LIST命令的一行输出，返回 (名称, 是否目录)，无法解析时返回 None"""
+    parsed = parse_list_entry(line)
+    return parsed and parsed[:2]
+
+
+def parse_list_entry(line):
+    """解析LIST命令的一行输出，返回 (名称, 是否目录, 大小)，无法解析时返回 None"""
+    parts = line.split()
+    if len(parts) < 9:
+        return None
+    size = int(parts[4]) if parts[4].isdigit() else None
+    return ' '.join(parts[8:]), parts[0].startswith('d'), size
+
+
+class DirectoryListing:
+    """一个目录的解析结果"""
+
+    def __init__(self, files, dirs, expires):
+        self.files = files
+        self.dirs = dirs
+        self.names = set(files)
+        self.expires = expires
+
+
+class DirectoryListingCache:
+    """按 (主机, 用户, 目录) 缓存目录列表，并为单个文件的存在性检查提供轻量探测
+
+    - 列目录优先 MLSD（结构化输出），不支持时回退到 LIST 并按列解析
+    - 检查文件是否存在：有未过期的缓存时直接查集合；否则发送 SIZE（失败再试 MDTM），
+      只有服务器两者都不支持时才拉取完整列表
+    """
+
+    def __init__(self, ttl=FTP_LISTING_TTL, max_entries=FTP_LISTING_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (主机, 用户, 目录) -> DirectoryListing
+        self.unsupported = {}  # (主机, 用户) -> 不支持的命令集合
+        self.lock = Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "probes": 0,
+            "list_fallbacks": 0,
+            "invalidations": 0
+        }
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    @staticmethod
+    def key(conn):
+        return conn.key[0], conn.key[1], conn.cwd
+
+    def _supports(self, conn, command):
+        with self.lock:
+            return command not in self.unsupported.get(conn.key[:2], ())
+
+    def _mark_unsupported(self, conn, command):
+        with self.lock:
+            self.unsupported.setdefault(conn.key[:2], set()).add(command)
+
+    def _cached(self, conn):
+        key = self.key(conn)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+        return entry
+
+    def _fetch(self, conn):
+        """从服务器读取当前目录的文件与子目录"""
+        with tracer.span('LIST'):
+            entries, _ = self.list_details(conn)
+        files = [entry['name'] for entry in entries if entry['type'] == 'file']
+        dirs = [entry['name'] for entry in entries if entry['type'] == 'dir']
+        return files, dirs
+
+    def list_details(self, conn):
+        """读取当前目录的详细列表（不经过缓存）
+
+        返回 (条目列表, 当前目录的修改时间)；条目为 {'name', 'type': 'file'/'dir', 'size', 'modify'}，
+        服务器无法提供的字段为 None（LIST 输出不解析修改时间）
+        """
+        ftp = conn.ftp
+        if self._supports(conn, 'MLSD'):
+            try:
+                # 不指定 facts，避免发送部分服务器不接受的 OPTS MLST
+                return self._parse_mlsd(ftp.mlsd())
+            except error_perm as e:
+                if not is_unsupported(e):
+                    raise
+                self._mark_unsupported(conn, 'MLSD')
+
+        entries = []
+        ftp.retrlines('LIST', lambda line: self._collect_list_line(line, entries))
+        return entries, None
+
+    @staticmethod
+    def _parse_mlsd(rows):
+        """把 MLSD 的 (名称, facts) 转为 list_details 的返回值"""
+        entries = []
+        directory_modify = None
+        for name, facts in rows:
+            kind = facts.get('type', 'file').lower()
+            if kind == 'cdir':
+                directory_modify = facts.get('modify')
+                continue
+            if kind == 'pdir' or name in ('.', '..'):
+                continue
+            size = facts.get('size')
+            entries.append({
+                'name': name,
+                'type': 'dir' if kind == 'dir' else 'file',
+                'size': int(size) if size and size.isdigit() else None,
+                'modify': facts.get('modify')
+            })
+        return entries, directory_modify
+
+    @staticmethod
+    def _collect_list_line(line, entries):
+        parsed = parse_list_entry(line)
+        if parsed:
+            entries.append({'name': parsed[0], 'type': 'dir' if parsed[1] else 'file',
+                            'size': parsed[2], 'modify': None})
+
+    def _store(self, conn, files, dirs):
+        with self.lock:
+            self.entries[self.key(conn)] = DirectoryListing(files, dirs, time.monotonic() + self.ttl)
+            self.entries.move_to_end(self.key(conn))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def list(self, conn):
+        """返回当前目录的 (文件列表, 目录列表)，优先使用缓存"""
+        entry = self._cached(conn)
+        if entry is not None:
+            self._count("hits")
+            return list(entry.files), list(entry.dirs)
+
+        self._count("misses")
+        files, dirs = self._fetch(conn)
+        self._store(conn, files, dirs)
+        return list(files), list(dirs)
+
+    def exists(self, conn, filename):
+        """当前目录下是否存在名为 filename 的文件"""
+        entry = self._cached(conn)
+        if entry is not None:
+            self._count("hits")
+            return filename in entry.names
+
+        ftp = conn.ftp
+        for command in ('SIZE', 'MDTM'):
+            if not self._supports(conn, command):
+                continue
+            self._count("probes")
+            try:
+                with tracer.span('SIZE'):
+                    ftp.sendcmd(f'{command} {filename}')
+                return True
+            except error_perm as e:
+                if is_unsupported(e):
+                    self._mark_unsupported(conn, command)
+                # 550：不存在或不是普通文件；部分服务器在 ASCII 模式下拒绝 SIZE，继续用 MDTM 确认
+
+        if not (self._supports(conn, 'SIZE') or self._supports(conn, 'MDTM')):
+            self._count("list_fallbacks")
+            files, _ = self.list(conn)
+            return filename in files
+        return False
+
+    def stat(self, conn, filename):
+        """实时读取文件的 {'size', 'modify'}，文件不存在时返回 None
+
+        优先一条 MLST，不支持时用 SIZE + MDTM；服务器无法提供的字段为 None。
+        """
+        with tracer.span('SIZE'):
+            return self._stat(conn, filename)
+
+    def _stat(self, conn, filename):
+        ftp = conn.ftp
+        if self._supports(conn, 'MLST'):
+            try:
+                facts = self._mlst(conn, filename)
+                if facts is not None:
+                    return self._file_stat(facts)
+            except error_perm as e:
+                if not is_unsupported(e):
+                    return None
+                self._mark_unsupported(conn, 'MLST')
+
+        size = modify = None
+        if self._supports(conn, 'SIZE'):
+            self._count("probes")
+            try:
+                size = int(ftp.sendcmd(f'SIZE {filename}').split()[1])
+            except error_perm as e:
+                if is_unsupported(e):
+                    self._mark_unsupported(conn, 'SIZE')
+        if self._supports(conn, 'MDTM'):
+            self._count("probes")
+            try:
+                modify = ftp.sendcmd(f'MDTM {filename}').split()[1]
+            except error_perm as e:
+                if is_unsupported(e):
+                    self._mark_unsupported(conn, 'MDTM')
+        if size is not None or modify is not None:
+            return {'size': size, 'modify': modify}
+
+        # 两条命令都不支持时只能靠目录列表判断是否存在
+        if not (self._supports(conn, 'SIZE') or self._supports(conn, 'MDTM')) and self.exists(conn, filename):
+            return {'size': None, 'modify': None}
+        return None
+
+    def _mlst(self, conn, path):
+        """发送 MLST，返回小写键名的 facts；不支持时抛出 error_perm"""
+        self._count("probes")
+        return self._parse_mlst(conn.ftp.sendcmd(f'MLST {path}'))
+
+    @staticmethod
+    def _parse_mlst(response):
+        for line in response.splitlines()[1:-1]:
+            facts_text = line.strip().partition(' ')[0]
+            facts = dict(fact.split('=', 1) for fact in facts_text.split(';') if '=' in fact)
+            return {name.lower(): value for name, value in facts.items()}
+        return None
+
+    @staticmethod
+    def _file_stat(facts):
+        """MLST facts 转为 stat() 的返回值；不是普通文件时返回 None"""
+        if facts.get('type', 'file').lower() != 'file':
+            return None
+        size = facts.get('size')
+        return {'size': int(size) if size is not None else None, 'modify': facts.get('modify')}
+
+    def directory_modify(self, conn, path):
+        """用一条 MLST 读取目录的修改时间；服务器不支持或无法提供时返回 None"""
+        if not self._supports(conn, 'MLST'):
+            return None
+        try:
+            facts = self._mlst(conn, path)
+        except error_perm as e:
+            if is_unsupported(e):
+                self._mark_unsupported(conn, 'MLST')
+            return None
+        if facts is None or facts.get('type', '').lower() not in ('dir', 'cdir'):
+            return None
+        return facts.get('modify')
+
+    # ---------- 异步版本：conn 为 ftp_async.AsyncPooledFTP，缓存与探测规则同上 ----------
+
+    async def list_details_async(self, conn):
+        ftp = conn.ftp
+        if self._supports(conn, 'MLSD'):
+            try:
+                return self._parse_mlsd(await ftp.mlsd())
+            except error_perm as e:
+                if not is_unsupported(e):
+                    raise
+                self._mark_unsupported(conn, 'MLSD')
+
+        entries = []
+        await ftp.retrlines('LIST', lambda line: self._collect_list_line(line, entries))
+        return entries, None
+
+    async def list_async(self, conn):
+        entry = self._cached(conn)
+        if entry is not None:
+            self._count("hits")
+            return list(entry.files), list(entry.dirs)
+
+        self._count("misses")
+        with tracer.span('LIST'):
+            entries, _ = await self.list_details_async(conn)
+        files = [entry['name'] for entry in entries if entry['type'] == 'file']
+        dirs = [entry['name'] for entry in entries if entry['type'] == 'dir']
+        self._store(conn, files, dirs)
+        return list(files), list(dirs)
+
+    async def exists_async(self, conn, filename):
+        entry = self._cached(conn)
+        if entry is not None:
+            self._count("hits")
+            return filename in entry.names
+
+        for command in ('SIZE', 'MDTM'):
+            if not self._supports(conn, command):
+                continue
+            self._count("probes")
+            try:
+                with tracer.span('SIZE'):
+                    await conn.ftp.sendcmd(f'{command} {filename}')
+                return True
+            except error_perm as e:
+                if is_unsupported(e):
+                    self._mark_unsupported(conn, command)
+
+        if not (self._supports(conn, 'SIZE') or self._supports(conn, 'MDTM')):
+            self._count("list_fallbacks")
+            files, _ = await self.list_async(conn)
+            return filename in files
+        return False
+
+    async def stat_async(self, conn, filename):
+        with tracer.span('SIZE'):
+            return await self._stat_async(conn, filename)
+
+    async def directory_modify_async(self, conn, path):
+        if not self._supports(conn, 'MLST'):
+            return None
+        try:
+            self._count("probes")
+            facts = self._parse_mlst(await conn.ftp.sendcmd(f'MLST {path}'))
+        except error_perm as e:
+            if is_unsupported(e):
+                self._mark_unsupported(conn, 'MLST')
+            return None
+        if facts is None or facts.get('type', '').lower() not in ('dir', 'cdir'):
+            return None
+        return facts.get('modify')
+
+    async def _stat_async(self, conn, filename):
+        ftp = conn.ftp
+        if self._supports(conn, 'MLST'):
+            try:
+                self._count("probes")
+                facts = self._parse_mlst(await ftp.sendcmd(f'MLST {filename}'))
+                if facts is not None:
+                    return self._file_stat(facts)
+            except error_perm as e:
+                if not is_unsupported(e):
+                    return None
+                self._mark_unsupported(conn, 'MLST')
+
+        size = modify = None
+        if self._supports(conn, 'SIZE'):
+            self._count("probes")
+            try:
+                size = int((await ftp.sendcmd(f'SIZE {filename}')).split()[1])
+            except error_perm as e:
+                if is_unsupported(e):
+                    self._mark_unsupported(conn, 'SIZE')
+        if self._supports(conn, 'MDTM'):
+            self._count("probes")
+            try:
+                modify = (await ftp.sendcmd(f'MDTM {filename}')).split()[1]
+            except error_perm as e:
+                if is_unsupported(e):
+                    self._mark_unsupported(conn, 'MDTM')
+        if size is not None or modify is not None:
+            return {'size': size, 'modify': modify}
+
+        if not (self._supports(conn, 'SIZE') or self._supports(conn, 'MDTM')) and \
+                await self.exists_async(conn, filename):
+            return {'size': None, 'modify': None}
+        return None
+
+    def invalidate(self, conn):
+        """本进程修改了当前目录（STOR/DELE）后调用"""
+        with self.lock:
+            if self.entries.pop(self.key(conn), None) is not None:
+                self.counters["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.entries)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            **counters,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0
+        }
+
+
+listing_cache = DirectoryListingCache()
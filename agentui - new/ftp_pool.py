@@ -0,0 +1,257 @@
+import os
+import time
+import posixpath
+from collections import deque
+from ftplib import FTP, error_temp
+from threading import Lock
+
+from ftp_trace import tracer
+
+# ========== FTP连接池配置 ==========
+# 每个 (主机, 用户) 最多保留的空闲连接数
+FTP_POOL_MAX_SIZE = int(os.environ.get("FTP_POOL_MAX_SIZE", "4"))
+# 空闲超过该时间（秒）的连接直接丢弃；应小于服务器端的空闲断开时间
+FTP_POOL_IDLE_TIMEOUT = float(os.environ.get("FTP_POOL_IDLE_TIMEOUT", "120"))
+# 空闲超过该时间（秒）的连接在取出时先发送 NOOP 检查
+FTP_POOL_CHECK_INTERVAL = float(os.environ.get("FTP_POOL_CHECK_INTERVAL", "15"))
+FTP_TIMEOUT = 30
+
+
+def is_stale_error(e):
+    """会话已被服务器关闭：连接断开、读到 EOF，或 421 服务不可用"""
+    return isinstance(e, (OSError, EOFError)) or (isinstance(e, error_temp) and str(e).startswith('421'))
+
+
+class SessionFTP(FTP):
+    """记录从连接池取出后是否已收到过应答；第一条命令就因会话失效而失败时标记 stale"""
+
+    replies = 0
+    stale = False
+
+    def putcmd(self, line):
+        try:
+            super().putcmd(line)
+        except Exception as e:
+            self._failed(e)
+            raise
+
+    def getresp(self):
+        try:
+            resp = super().getresp()
+        except Exception as e:
+            self._failed(e)
+            raise
+        self.replies += 1
+        return resp
+
+    def _failed(self, e):
+        if not is_stale_error(e):
+            # 4xx/5xx 也是服务器的应答，会话仍然有效
+            self.replies += 1
+        elif not self.replies:
+            self.stale = True
+
+
+class PooledFTP:
+    """一个已登录的FTP会话，记录登录目录与当前目录，避免重复 cwd"""
+
+    def __init__(self, key, ftp):
+        self.key = key
+        self.ftp = ftp
+        self.home = ftp.pwd()
+        self.cwd = self.home
+        self.last_used = time.monotonic()
+        self.needs_check = False  # 提前中断过传输等情况，归还前需确认控制连接仍同步
+        self.reused = False  # 本次是否从空闲连接中取出
+
+    @property
+    def stale(self):
+        """复用的会话在第一条命令上就发现已被服务器关闭，此次操作未对服务器产生任何影响"""
+        return self.reused and self.ftp.stale
+
+    def resolve(self, path=None):
+        """目录参数对应的绝对路径；未指定时为登录目录，相对路径相对于登录目录"""
+        if not path:
+            return self.home
+        return posixpath.normpath(posixpath.join(self.home, path))
+
+    def chdir(self, path=None):
+        """切换到指定目录；未指定时回到登录目录。已在目标目录时不发送命令"""
+        target = self.resolve(path)
+        if target == self.cwd:
+            return
+        # 相对路径相对于登录目录，与新建连接时的行为保持一致
+        with tracer.span('cwd'):
+            if path and not path.startswith('/') and self.cwd != self.home:
+                self.ftp.cwd(self.home)
+                self.cwd = self.home
+            self.ftp.cwd(path or self.home)
+        self.cwd = target
+
+    def path_key(self, filename):
+        """当前目录下文件的缓存键：(主机, 用户, 绝对路径)"""
+        return self.key[0], self.key[1], f"{self.cwd.rstrip('/')}/{filename}"
+
+    def close(self):
+        try:
+            self.ftp.quit()
+        except Exception:
+            try:
+                self.ftp.close()
+            except Exception:
+                pass
+
+
+class FTPConnectionPool:
+    """按 (主机, 用户, 密码) 复用已登录的FTP会话
+
+    - 取出时丢弃空闲超时的连接，空闲较久的连接先用 NOOP 检查，失效则自动重连
+    - 未做检查的复用会话若在第一条命令上发现已被服务器关闭，调用方可用 reconnect 换新连接重试
+    - 归还时超出 max_size 的连接直接关闭
+    """
+
+    def __init__(self, max_size=FTP_POOL_MAX_SIZE, idle_timeout=FTP_POOL_IDLE_TIMEOUT,
+                 check_interval=FTP_POOL_CHECK_INTERVAL, timeout=FTP_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.idle = {}  # key -> deque(PooledFTP)，右端为最近归还
+        self.lock = Lock()
+        self.counters = {
+            "connects": 0,
+            "reuses": 0,
+            "health_checks": 0,
+            "health_failures": 0,
+            "expired": 0,
+            "discarded": 0,
+            "stale_retries": 0,
+            "in_use": 0
+        }
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def connect(self, host, user, password):
+        """新建并登录一个连接（不经过连接池）"""
+        with tracer.span('connect'):
+            ftp = SessionFTP(host, timeout=self.timeout)
+        try:
+            with tracer.span('login'):
+                ftp.login(user, password)
+                ftp.set_pasv(True)  # 使用被动模式
+                conn = PooledFTP((host, user, password), ftp)
+        except Exception:
+            ftp.close()
+            raise
+        self._count("connects")
+        return conn
+
+    def acquire(self, host, user, password):
+        """取出一个可用连接，没有空闲连接时新建"""
+        key = (host, user, password)
+        while True:
+            with self.lock:
+                idle = self.idle.get(key)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                break
+
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for > self.idle_timeout:
+                self._count("expired")
+                conn.close()
+                continue
+            if idle_for > self.check_interval:
+                self._count("health_checks")
+                try:
+                    with tracer.span('NOOP'):
+                        conn.ftp.voidcmd("NOOP")
+                except Exception:
+                    self._count("health_failures")
+                    conn.ftp.close()
+                    continue
+
+            with self.lock:
+                self.counters["reuses"] += 1
+                self.counters["in_use"] += 1
+            conn.reused = True
+            conn.ftp.replies = 0
+            conn.ftp.stale = False
+            return conn
+
+        conn = self.connect(host, user, password)
+        self._count("in_use")
+        return conn
+
+    def reconnect(self, conn):
+        """丢弃已失效的会话，新建并登录一个连接代替它（仍计为使用中）"""
+        self._count("stale_retries")
+        conn.ftp.close()
+        try:
+            return self.connect(*conn.key)
+        except Exception:
+            self._count("in_use", -1)
+            raise
+
+    def release(self, conn, reusable=True):
+        """归还连接；reusable=False 时（如操作出错）先检查连接是否仍可用"""
+        self._count("in_use", -1)
+        if not reusable or conn.needs_check:
+            try:
+                # 必须是 NOOP 自己的 200 应答，收到残留的其他应答说明控制连接已错位
+                with tracer.span('NOOP'):
+                    reply = conn.ftp.sendcmd("NOOP")
+                if not reply.startswith("200"):
+                    raise ValueError("unexpected NOOP reply")
+                conn.needs_check = False
+            except Exception:
+                self._count("discarded")
+                conn.ftp.close()
+                return
+
+        conn.last_used = time.monotonic()
+        with self.lock:
+            idle = self.idle.setdefault(conn.key, deque())
+            # 顺带清理最久未用且已超时的连接
+            expired = []
+            while idle and conn.last_used - idle[0].last_used > self.idle_timeout:
+                expired.append(idle.popleft())
+            if len(idle) < self.max_size:
+                idle.append(conn)
+                conn = None
+            self.counters["expired"] += len(expired)
+            if conn is not None:
+                self.counters["discarded"] += 1
+        for old in expired:
+            old.close()
+        if conn is not None:
+            conn.close()
+
+    def close_all(self):
+        with self.lock:
+            conns = [conn for idle in self.idle.values() for conn in idle]
+            self.idle.clear()
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            # 不输出密码
+            idle = {f"{key[1]}@{key[0]}": len(conns) for key, conns in self.idle.items() if conns}
+        acquires = counters["connects"] + counters["reuses"]
+        return {
+            **counters,
+            "idle": idle,
+            "reuse_rate": round(counters["reuses"] / acquires, 4) if acquires else 0.0,
+            "limits": {
+                "max_size": self.max_size,
+                "idle_timeout": self.idle_timeout,
+                "check_interval": self.check_interval
+            }
+        }
+
+
+ftp_pool = FTPConnectionPool()
@@ -0,0 +1,312 @@
+import os
+import codecs
+from io import BytesIO
+
+from text_encoding import encoding_detector
+from ftp_trace import tracer
+
+# ========== 大文本流式搜索配置 ==========
+# 按后缀走流式搜索的文件类型
+FTP_STREAM_EXTENSIONS = ('.log', '.txt')
+# 按纯文本处理的文件类型（与 detect_file_type 中映射为 text 的后缀一致），追加时使用 APPE
+FTP_TEXT_EXTENSIONS = ('.txt', '.log', '.csv', '.yaml', '.yml', '.html', '.htm')
+# 文件不小于该大小（字节）时流式搜索；更小的文件走普通下载（可命中内容缓存）
+FTP_STREAM_MIN_BYTES = int(os.environ.get("FTP_STREAM_MIN_BYTES", str(1024 * 1024)))
+# retrbinary 每次读取的块大小
+FTP_STREAM_BLOCK_SIZE = int(os.environ.get("FTP_STREAM_BLOCK_SIZE", str(64 * 1024)))
+# 用于判断编码的样本大小；单行超过该长度时按截断行处理，保证内存占用有上限
+FTP_STREAM_SAMPLE_BYTES = 64 * 1024
+FTP_STREAM_MAX_LINE_BYTES = 1024 * 1024
+
+
+class StreamStop(Exception):
+    """在 retrbinary 回调中抛出，提前结束下载"""
+
+
+class StreamFallback(Exception):
+    """文件编码不能按 \\n 字节切分（UTF-16），需要改走普通下载"""
+
+
+def is_streamable(filename):
+    return bool(filename) and os.path.splitext(filename)[1].lower() in FTP_STREAM_EXTENSIONS
+
+
+def is_text_file(filename):
+    return bool(filename) and os.path.splitext(filename)[1].lower() in FTP_TEXT_EXTENSIONS
+
+
+def detect_stream_encoding(sample, key=None):
+    """根据文件开头的样本判断编码，返回 (编码, BOM长度)；UTF-16/32 抛出 StreamFallback"""
+    encoding, bom_length = encoding_detector.detect(sample, key)
+    name = codecs.lookup(encoding).name
+    if name.startswith('utf-16') or name.startswith('utf-32'):
+        raise StreamFallback()
+    return encoding, bom_length
+
+
+class LineSearcher:
+    """逐块接收字节，按行匹配搜索词，只保留不完整的最后一行
+
+    只适用于 \\n 为单字节的编码（UTF-8/GBK/GB18030/Latin-1 等），
+    因此按字节切行即可得到每一行的精确字节偏移，便于用 REST 续搜。
+    """
+
+    def __init__(self, search_str, max_matches=None, offset=0, key=None):
+        self.search_str = search_str
+        self.key = key
+        self.max_matches = max_matches
+        self.offset = offset
+        self.position = offset  # 下一个待处理字节在文件中的偏移
+        self.line_number = 0
+        self.pending = b''
+        self.encoding = None
+        self.matches = []
+        self.truncated = False
+        self.bytes_read = 0
+
+    def feed(self, data):
+        self.bytes_read += len(data)
+        self.pending += data
+        if self.encoding is None:
+            if len(self.pending) < FTP_STREAM_SAMPLE_BYTES:
+                return
+            self._detect()
+        end = self.pending.rfind(b'\n')
+        if end < 0:
+            if len(self.pending) > FTP_STREAM_MAX_LINE_BYTES:
+                block, self.pending = self.pending, b''
+                self._search_block(block, final_line=True)
+            return
+        block, self.pending = self.pending[:end + 1], self.pending[end + 1:]
+        self._search_block(block)
+
+    def finish(self):
+        if self.encoding is None:
+            self._detect()
+        if self.pending:
+            block, self.pending = self.pending, b''
+            self._search_block(block, final_line=True)
+
+    def _detect(self):
+        self.encoding, bom = detect_stream_encoding(self.pending, self.key)
+        if bom:
+            self.pending = self.pending[bom:]
+            self.position += bom
+
+    def _search_block(self, block, final_line=False):
+        """处理若干完整行；整块不含搜索词时只统计行数"""
+        text = block.decode(self.encoding, errors='ignore')
+        if self.search_str not in text.lower():
+            self.line_number += block.count(b'\n') + (1 if final_line and not block.endswith(b'\n') else 0)
+            self.position += len(block)
+            return
+
+        # 与原搜索的 split('\n') 一致，只按 \n 分行
+        raw_lines = block.split(b'\n')
+        if block.endswith(b'\n'):
+            raw_lines.pop()
+        block_end = self.position + len(block)
+        for raw_line in raw_lines:
+            self.line_number += 1
+            line_start = self.position
+            self.position = min(line_start + len(raw_line) + 1, block_end)
+            line = raw_line.decode(self.encoding, errors='ignore')
+            index = line.lower().find(self.search_str)
+            if index < 0:
+                continue
+            self.matches.append({
+                'type': 'line',
+                'line_number': self.line_number,
+                'content': line.strip(),
+                'start_index': index + 1,
+                'byte_offset': line_start
+            })
+            if self.max_matches and len(self.matches) >= self.max_matches:
+                self.truncated = True
+                raise StreamStop()
+
+
+def abandon_transfer(conn):
+    """提前关闭了数据连接后，读取服务器对这次传输的应答（226 或 426），并在归还前复查会话"""
+    conn.needs_check = True
+    try:
+        conn.ftp.getresp()
+    except Exception:
+        pass
+
+
+def retrieve(conn, filename, callback, rest=None):
+    """retrbinary 包装：callback 抛出 StreamStop 时提前结束并保持会话可用，返回是否提前结束"""
+    span = tracer.span('RETR')
+
+    def receive(data):
+        span.add(len(data))
+        callback(data)
+
+    try:
+        conn.ftp.retrbinary(f'RETR {filename}', receive, blocksize=FTP_STREAM_BLOCK_SIZE, rest=rest)
+        return False
+    except StreamStop:
+        abandon_transfer(conn)
+        return True
+    except StreamFallback:
+        abandon_transfer(conn)
+        raise
+    finally:
+        span.end()
+
+
+def read_head(conn, filename, limit=FTP_STREAM_SAMPLE_BYTES):
+    """只下载文件开头约 limit 字节"""
+    chunks = []
+    received = 0
+
+    def collect(data):
+        nonlocal received
+        chunks.append(data)
+        received += len(data)
+        if received >= limit:
+            raise StreamStop()
+
+    retrieve(conn, filename, collect)
+    return b''.join(chunks)[:limit]
+
+
+def stream_search(conn, filename, search_str, max_matches=None, offset=0):
+    """流式下载并逐行搜索文本文件，内存占用与文件大小无关
+
+    参数:
+        search_str: 已转为小写的搜索词
+        max_matches: 找到这么多匹配后立即停止下载
+        offset: 从该字节偏移开始（REST），行号相对于该偏移计数
+
+    返回 (LineSearcher, 是否提前结束下载)；编码不支持按行切分时抛出 StreamFallback
+    """
+    searcher = LineSearcher(search_str, max_matches, offset, conn.path_key(filename))
+    if retrieve(conn, filename, searcher.feed, rest=offset or None):
+        return searcher, True
+
+    # 传输已完整结束，处理最后一段
+    try:
+        searcher.finish()
+    except StreamStop:
+        pass
+    return searcher, False
+
+
+def append_text(conn, filename, text):
+    """用 APPE 把文本追加到文件末尾，只传输新增内容
+
+    与原追加逻辑一致，在新内容前加一个换行；编码与换行符沿用文件开头样本检测到的格式。
+    开头样本无法确定编码时抛出 StreamFallback（改走下载后整体上传），
+    新内容无法用文件编码表示时抛出 UnicodeEncodeError。
+    返回 (追加的字节数, 编码)
+    """
+    head = read_head(conn, filename)
+    data, encoding = encode_appended(head, text, conn.path_key(filename), len(head) < FTP_STREAM_SAMPLE_BYTES)
+    with tracer.span('STOR') as span:
+        span.add(len(data))
+        conn.ftp.storbinary(f'APPE {filename}', BytesIO(data))
+    return len(data), encoding
+
+
+def encode_appended(head, text, key=None, complete=False):
+    """按文件开头样本的编码与换行符编码要追加的文本，返回 (字节, 编码)
+
+    complete: head 是否为完整文件。样本全是 ASCII 时看不出后文的编码（例如开头为英文日志的 GBK 文件），
+    此时使用该路径缓存的完整文件编码；没有缓存且新内容含非 ASCII 字符时抛出 StreamFallback。
+    样本不是合法 UTF-8 又无法识别时同样抛出 StreamFallback，由完整下载的流程判定编码或拒绝写回。
+    编码严格进行，新内容无法用文件编码表示时抛出 UnicodeEncodeError，不把字符替换为 '?'。
+    """
+    encoding, bom_length = encoding_detector.detect(head, key)
+    body = head[bom_length:]
+    if encoding == 'utf-8' and not bom_length:
+        if body.isascii():
+            if not complete and not text.isascii():
+                encoding = encoding_detector.cached(key)
+                if encoding is None:
+                    raise StreamFallback()
+        elif not is_utf8_prefix(body):
+            # detect() 对无法识别的样本回退为 UTF-8，追加内容会与原文编码不一致
+            raise StreamFallback()
+    if codecs.lookup(encoding).name == 'utf-16':
+        # 'utf-16' 编码时会再写一个 BOM，追加部分按 BOM 指示的字节序编码
+        encoding = 'utf-16-le'
+    newline = '\r\n' if '\r\n' in body.decode(encoding, errors='ignore') else '\n'
+    text = text.replace('\r\n', '\n').replace('\n', newline)
+    return (newline + text).encode(encoding), encoding
+
+
+def is_utf8_prefix(data):
+    """data 是否为合法 UTF-8（末尾允许截断在多字节字符中间）"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+# ---------- 异步版本：conn 为 ftp_async.AsyncPooledFTP，行为同上 ----------
+
+async def abandon_transfer_async(conn):
+    conn.needs_check = True
+    try:
+        await conn.ftp.getresp()
+    except Exception:
+        pass
+
+
+async def retrieve_async(conn, filename, callback, rest=None):
+    span = tracer.span('RETR')
+
+    def receive(data):
+        span.add(len(data))
+        callback(data)
+
+    try:
+        await conn.ftp.retrbinary(f'RETR {filename}', receive, blocksize=FTP_STREAM_BLOCK_SIZE, rest=rest)
+        return False
+    except StreamStop:
+        await abandon_transfer_async(conn)
+        return True
+    except StreamFallback:
+        await abandon_transfer_async(conn)
+        raise
+    finally:
+        span.end()
+
+
+async def read_head_async(conn, filename, limit=FTP_STREAM_SAMPLE_BYTES):
+    chunks = []
+    received = 0
+
+    def collect(data):
+        nonlocal received
+        chunks.append(data)
+        received += len(data)
+        if received >= limit:
+            raise StreamStop()
+
+    await retrieve_async(conn, filename, collect)
+    return b''.join(chunks)[:limit]
+
+
+async def stream_search_async(conn, filename, search_str, max_matches=None, offset=0):
+    """逐块匹配在事件循环中进行：每块只有一次解码与查找，不值得切换到线程池"""
+    searcher = LineSearcher(search_str, max_matches, offset, conn.path_key(filename))
+    if await retrieve_async(conn, filename, searcher.feed, rest=offset or None):
+        return searcher, True
+    try:
+        searcher.finish()
+    except StreamStop:
+        pass
+    return searcher, False
+
+
+async def append_text_async(conn, filename, text):
+    head = await read_head_async(conn, filename)
+    data, encoding = encode_appended(head, text, conn.path_key(filename), len(head) < FTP_STREAM_SAMPLE_BYTES)
+    with tracer.span('STOR') as span:
+        span.add(len(data))
+        await conn.ftp.storbinary(f'APPE {filename}', data)
+    return len(data), encoding
@@ -0,0 +1,320 @@
+import os
+import sys
+import time
+from contextvars import ContextVar
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+
+# ========== FTP操作计时配置 ==========
+# 输出级别（输出到 stderr，不占用 MCP stdio 通道）：
+#   off   不输出（默认）
+#   slow  总耗时超过 FTP_TRACE_SLOW_SECONDS 的调用输出一行分阶段耗时
+#   info  每次调用都输出一行分阶段耗时
+#   debug 另外输出每个阶段与原来的调试信息
+FTP_TRACE_LEVEL = os.environ.get("FTP_TRACE_LEVEL", "off").lower()
+# 是否按阶段汇总耗时直方图；与级别都关闭时计时调用直接返回空对象
+FTP_TRACE_HISTOGRAMS = os.environ.get("FTP_TRACE_HISTOGRAMS", "1") == "1"
+# 慢调用阈值（秒），慢调用的分阶段耗时保留最近 FTP_TRACE_SLOW_CALLS 条
+FTP_TRACE_SLOW_SECONDS = float(os.environ.get("FTP_TRACE_SLOW_SECONDS", "1"))
+FTP_TRACE_SLOW_CALLS = int(os.environ.get("FTP_TRACE_SLOW_CALLS", "20"))
+# 直方图各桶的上界（秒）
+FTP_TRACE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LEVEL_OFF, LEVEL_SLOW, LEVEL_INFO, LEVEL_DEBUG = 0, 1, 2, 3
+LEVELS = {'off': LEVEL_OFF, 'slow': LEVEL_SLOW, 'info': LEVEL_INFO, 'debug': LEVEL_DEBUG}
+
+
+class Histogram:
+    """一个阶段的耗时分布：按固定桶计数，另记次数、总耗时、最大耗时、字节数与出错次数"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为超过最大上界的部分
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.errors = 0
+
+    def observe(self, seconds, nbytes=0, error=False):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.bytes += nbytes
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        """按桶估计分位数，返回所在桶的上界（秒）；落在最后一个桶时返回最大值"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        cumulative = []
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            cumulative.append((bound, seen))
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'total_ms': round(self.total * 1000, 3),
+            'avg_ms': round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3),
+            'p50_ms': round(self.quantile(0.5) * 1000, 3),
+            'p95_ms': round(self.quantile(0.95) * 1000, 3),
+            'p99_ms': round(self.quantile(0.99) * 1000, 3),
+            # 累计计数：耗时不超过该上界（秒）的次数
+            'buckets': {str(bound): count for bound, count in cumulative}
+        }
+
+
+class _NullSpan:
+    """计时关闭时使用的空对象，所有方法都不做任何事"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, nbytes):
+        pass
+
+    def end(self, error=False):
+        pass
+
+    def result(self, result):
+        return result
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """一个阶段的计时，创建时开始；可用作 with 语句，也可显式调用 end()"""
+    __slots__ = ('tracer', 'phase', 'start', 'bytes', 'ended')
+
+    def __init__(self, tracer, phase):
+        self.tracer = tracer
+        self.phase = phase
+        self.bytes = 0
+        self.ended = False
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc_type is not None)
+        return False
+
+    def add(self, nbytes):
+        """累加本阶段传输或处理的字节数"""
+        self.bytes += nbytes
+
+    def end(self, error=False):
+        if self.ended:
+            return
+        self.ended = True
+        self.tracer._finish_span(self.phase, time.perf_counter() - self.start, self.bytes, error)
+
+
+class CallTrace:
+    """一次工具调用的计时，收集其间当前上下文（线程或 asyncio 任务）各阶段的耗时与字节数"""
+    __slots__ = ('tracer', 'operation', 'target', 'start', 'phases', 'error', 'token')
+
+    def __init__(self, tracer, operation, target):
+        self.tracer = tracer
+        self.operation = operation or '-'
+        self.target = target
+        self.phases = {}  # 阶段 -> [次数, 耗时, 字节数]，按首次出现的顺序
+        self.error = None
+
+    def __enter__(self):
+        self.token = self.tracer.current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.current.reset(self.token)
+        if exc_type is not None and self.error is None:
+            self.error = exc_type.__name__
+        self.tracer._finish_call(self, time.perf_counter() - self.start)
+        return False
+
+    def result(self, result):
+        """记录调用的返回值，出错时把错误码带到日志与慢调用记录中"""
+        if isinstance(result, dict) and 'error' in result:
+            self.error = result['error']
+        return result
+
+    def add_phase(self, phase, seconds, nbytes):
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [1, seconds, nbytes]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += nbytes
+
+    def breakdown(self):
+        return {phase: {'count': count, 'ms': round(seconds * 1000, 3), 'bytes': nbytes}
+                for phase, (count, seconds, nbytes) in self.phases.items()}
+
+    def describe(self, seconds):
+        parts = []
+        for phase, (count, phase_seconds, nbytes) in self.phases.items():
+            text = f"{phase} {phase_seconds * 1000:.1f}ms"
+            if count > 1:
+                text += f" x{count}"
+            if nbytes:
+                text += f" {nbytes}B"
+            parts.append(text)
+        status = f" {self.error}" if self.error else ""
+        text = f"{self.operation} {self.target or ''} {seconds * 1000:.1f}ms{status}"
+        return f"{text} | {', '.join(parts)}" if parts else text
+
+
+class FTPTracer:
+    """FTP工具调用的分阶段计时
+
+    阶段名：connect、login、NOOP、cwd、LIST、SIZE（MLST/SIZE/MDTM 元数据探测）、RETR、decode、parse、
+    operation、serialize、STOR（含 APPE）、DELE。
+    计时与日志都关闭时 span()/call() 直接返回空对象，调用处的开销只有一次属性判断。
+    """
+
+    def __init__(self, level=FTP_TRACE_LEVEL, histograms=FTP_TRACE_HISTOGRAMS, slow_seconds=FTP_TRACE_SLOW_SECONDS,
+                 slow_calls=FTP_TRACE_SLOW_CALLS, buckets=FTP_TRACE_BUCKETS, stream=None):
+        self.buckets = tuple(buckets)
+        self.slow_seconds = slow_seconds
+        self.stream = stream
+        # 正在计时的调用；用 ContextVar 而不是 threading.local，同一事件循环上并发的协程各自独立，
+        # 交给线程池执行的部分通过 contextvars.copy_context() 带上所属调用
+        self.current = ContextVar('ftp_trace_call', default=None)
+        self.lock = Lock()
+        self.phases = {}  # 阶段 -> Histogram
+        self.calls = {}  # 操作类型 -> Histogram（整次调用的耗时）
+        self.slow = deque(maxlen=slow_calls)
+        self.configure(level, histograms)
+
+    def configure(self, level=None, histograms=None):
+        """运行时调整输出级别与是否汇总直方图"""
+        if level is not None:
+            self.level = LEVELS.get(level, LEVEL_OFF) if isinstance(level, str) else int(level)
+        if histograms is not None:
+            self.histograms = bool(histograms)
+        self.enabled = self.histograms or self.level > LEVEL_OFF
+        self.debug_enabled = self.level >= LEVEL_DEBUG
+
+    def _write(self, text):
+        print(text, file=self.stream or sys.stderr)
+
+    def span(self, phase):
+        """开始一个阶段的计时"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, phase)
+
+    def call(self, operation, target=None):
+        """开始一次工具调用的计时；当前上下文已有调用在计时时（如批量操作内部）返回空对象"""
+        if not self.enabled or self.current.get() is not None:
+            return NULL_SPAN
+        return CallTrace(self, operation, target)
+
+    def debug(self, *args, **kwargs):
+        """调试信息，只在 debug 级别输出"""
+        if self.debug_enabled:
+            call = self.current.get()
+            prefix = f"[DEBUG] [{call.operation} {call.target or ''}]" if call is not None else "[DEBUG]"
+            print(prefix, *args, file=self.stream or sys.stderr, **kwargs)
+
+    def _finish_span(self, phase, seconds, nbytes, error):
+        if self.histograms:
+            with self.lock:
+                histogram = self.phases.get(phase)
+                if histogram is None:
+                    histogram = self.phases[phase] = Histogram(self.buckets)
+                histogram.observe(seconds, nbytes, error)
+        call = self.current.get()
+        if call is not None:
+            call.add_phase(phase, seconds, nbytes)
+        if self.debug_enabled:
+            self._write(f"[TRACE] {phase} {seconds * 1000:.2f}ms" + (f" {nbytes}B" if nbytes else "")
+                        + (" error" if error else ""))
+
+    def _finish_call(self, call, seconds):
+        slow = seconds >= self.slow_seconds
+        if self.histograms:
+            with self.lock:
+                histogram = self.calls.get(call.operation)
+                if histogram is None:
+                    histogram = self.calls[call.operation] = Histogram(self.buckets)
+                histogram.observe(seconds, error=call.error is not None)
+                if slow:
+                    self.slow.append({
+                        'operation': call.operation,
+                        'target': call.target,
+                        'ms': round(seconds * 1000, 3),
+                        'error': call.error,
+                        'finished_at': time.time(),
+                        'phases': call.breakdown()
+                    })
+        if self.level >= LEVEL_INFO or (slow and self.level >= LEVEL_SLOW):
+            self._write(f"[TRACE] {call.describe(seconds)}")
+
+    def reset(self):
+        with self.lock:
+            self.phases.clear()
+            self.calls.clear()
+            self.slow.clear()
+
+    def stats(self):
+        """各阶段与各操作的耗时直方图（可直接序列化为 JSON），以及最近的慢调用"""
+        with self.lock:
+            return {
+                'level': next(name for name, value in LEVELS.items() if value == self.level),
+                'histograms': self.histograms,
+                'slow_seconds': self.slow_seconds,
+                'phases': {phase: histogram.snapshot() for phase, histogram in self.phases.items()},
+                'calls': {operation: histogram.snapshot() for operation, histogram in self.calls.items()},
+                'slow_calls': list(self.slow)
+            }
+
+    def prometheus(self):
+        """以 Prometheus 文本格式导出直方图"""
+        lines = []
+        with self.lock:
+            for name, label, histograms in (('ftp_phase_seconds', 'phase', self.phases),
+                                            ('ftp_call_seconds', 'operation', self.calls)):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in histograms.items():
+                    seen = 0
+                    for bound, count in zip(self.buckets, histogram.counts):
+                        seen += count
+                        lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {seen}')
+                    lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}="{key}"}} {histogram.total:.6f}')
+                    lines.append(f'{name}_count{{{label}="{key}"}} {histogram.count}')
+            lines.append("# TYPE ftp_phase_bytes_total counter")
+            for key, histogram in self.phases.items():
+                lines.append(f'ftp_phase_bytes_total{{phase="{key}"}} {histogram.bytes}')
+            lines.append("# TYPE ftp_phase_errors_total counter")
+            for key, histogram in self.phases.items():
+                lines.append(f'ftp_phase_errors_total{{phase="{key}"}} {histogram.errors}')
+        return "\n".join(lines) + "\n"
+
+
+tracer = FTPTracer()
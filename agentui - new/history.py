@@ -0,0 +1,99 @@
+import os
+import json
+from collections import deque
+from threading import Lock
+
+# ========== 消息历史配置 ==========
+# 内存中保留的全局消息条数；设置溢出文件路径后，被淘汰的旧消息按JSON行追加写入该文件
+MESSAGE_HISTORY_CAPACITY = int(os.environ.get("MESSAGE_HISTORY_CAPACITY", "1000"))
+MESSAGE_HISTORY_SPILL_PATH = os.environ.get("MESSAGE_HISTORY_SPILL_PATH") or None
+# 溢出记录攒够一批再写盘，减少写文件次数
+MESSAGE_HISTORY_SPILL_BATCH = 64
+
+
+class HistoryRecord:
+    """一条消息记录，使用 __slots__ 减少每条记录的内存占用"""
+
+    __slots__ = ("id", "message", "timestamp", "session_id")
+
+    def __init__(self, id, message, timestamp, session_id):
+        self.id = id
+        self.message = message
+        self.timestamp = timestamp
+        self.session_id = session_id
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "message": self.message,
+            "timestamp": self.timestamp,
+            "session_id": self.session_id
+        }
+
+
+class MessageHistory:
+    """固定容量的环形消息历史：追加和淘汰均为 O(1)，不产生整表拷贝"""
+
+    def __init__(self, capacity=MESSAGE_HISTORY_CAPACITY, spill_path=MESSAGE_HISTORY_SPILL_PATH):
+        self.records = deque(maxlen=capacity)
+        self.spill_path = spill_path
+        self.spill_buffer = []
+        self.spilled = 0
+        self.lock = Lock()
+
+    def append(self, record):
+        """追加记录，容量已满时最旧的记录被淘汰（开启溢出时写入磁盘）"""
+        with self.lock:
+            if self.spill_path and len(self.records) == self.records.maxlen:
+                self.spill_buffer.append(self.records[0])
+                if len(self.spill_buffer) >= MESSAGE_HISTORY_SPILL_BATCH:
+                    self._flush_spill()
+            self.records.append(record)
+
+    def _flush_spill(self):
+        """把待溢出记录追加写入文件（调用方需持有锁）"""
+        if not self.spill_buffer:
+            return
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(r.to_dict(), ensure_ascii=False) + "\n" for r in self.spill_buffer)
+            self.spilled += len(self.spill_buffer)
+        except OSError as e:
+            print(f"❌ 消息历史写盘失败: {e}")
+        self.spill_buffer = []
+
+    def flush(self):
+        with self.lock:
+            self._flush_spill()
+
+    def recent(self, limit=None):
+        """最近的记录（按时间顺序）"""
+        with self.lock:
+            records = list(self.records)
+        return records[-limit:] if limit else records
+
+    def iter_spilled(self):
+        """逐行读取已溢出到磁盘的历史记录"""
+        self.flush()
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def clear(self):
+        """清空内存中的记录（已溢出的文件保留）"""
+        with self.lock:
+            self._flush_spill()
+            self.records.clear()
+
+    def __len__(self):
+        return len(self.records)
+
+    def stats(self):
+        return {
+            "size": len(self.records),
+            "capacity": self.records.maxlen,
+            "spill_path": self.spill_path,
+            "spilled": self.spilled + len(self.spill_buffer)
+        }
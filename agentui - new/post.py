@@ -1,462 +1,1249 @@
 import os
 import re
+import queue
+import fnmatch
+import threading
+import posixpath
 import json
-import chardet
 import configparser
-from ftplib import FTP
 from xml.etree import ElementTree as ET
 from io import StringIO, BytesIO
 import tempfile
 import warnings
 from typing import Dict, List, Any, Optional, Union, Tuple
+from ftplib import error_perm
+from concurrent.futures import ThreadPoolExecutor
+from ftp_pool import ftp_pool, FTP_POOL_MAX_SIZE
+from ftp_listing import listing_cache, is_unsupported
+from ftp_index import ftp_index, match_name
+from content_cache import content_cache
+from ftp_stream import (is_streamable, is_text_file, stream_search, append_text, StreamFallback,
+                        FTP_STREAM_MIN_BYTES)
+from text_encoding import encoding_detector
+from structured_patch import patch_document
+from structured_update import update_json, update_xml
+from search_index import build_search_index, FTP_SEARCH_INDEX_MIN_SEARCHES
+from ftp_trace import tracer
 
 # 忽略chardet警告
 warnings.filterwarnings('ignore', module='chardet')
 
-# 全局打印函数，用于监测执行过程
-def debug_print(*args, **kwargs):
-    """打印调试信息"""
-    print("[DEBUG]", *args, **kwargs)
+# 全局打印函数，用于监测执行过程：只在 FTP_TRACE_LEVEL=debug 时输出到 stderr，并带上所属调用
+# 各阶段耗时由 tracer 记录，见 ftp_trace
+debug_print = tracer.debug
+
+# 批量操作时同时使用的FTP会话数，默认与连接池每个主机保留的连接数一致
+FTP_BATCH_MAX_WORKERS = int(os.environ.get("FTP_BATCH_MAX_WORKERS", str(FTP_POOL_MAX_SIZE)))
+
+# 目录树内容搜索同时使用的FTP会话数；超出连接池空闲上限的会话用完即关闭
+FTP_TREE_SEARCH_MAX_WORKERS = int(os.environ.get("FTP_TREE_SEARCH_MAX_WORKERS", "8"))
+# 目录树内容搜索递归的最大深度（防止符号链接造成循环）
+FTP_TREE_MAX_DEPTH = int(os.environ.get("FTP_TREE_MAX_DEPTH", "16"))
+
+VALID_OPERATIONS = ['append', 'update', 'read', 'search', 'list', 'delete', 'search_files', 'search_tree']
+READ_ONLY_OPERATIONS = ['read', 'search', 'list', 'search_files', 'search_tree']
+# append/update 上传失败时返回的错误码与说明
+WRITE_ERRORS = {'append': ('APPEND_ERROR', '追加内容失败'), 'update': ('UPDATE_ERROR', '更新文件失败')}
+
+
+def _trace_target(file_path, filename):
+    """计时日志中标识一次调用的路径"""
+    return posixpath.join(file_path, filename) if file_path and filename else file_path or filename
+
+
+def validate_operation(operation):
+    """校验操作类型，合法时返回 None，否则返回错误字典"""
+    if not operation:
+        return {'error': 'MISSING_OPERATION', 'message': '请指定操作类型'}
+
+    if operation not in VALID_OPERATIONS:
+        return {'error': 'INVALID_OPERATION',
+                'message': f'操作类型无效。支持的操作: {", ".join(VALID_OPERATIONS)}'}
+    return None
+
 
 #@mcp.tool()
 def process_ftp_file(ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Auks$1234",
-                     file_path=None, filename=None, content=None, operation=None):
+                     file_path=None, filename=None, content=None, operation=None, use_pool=True,
+                     max_matches=None, offset=0):
     """
-    多功能FTP文件处理工具（优化版）
-    修复bug并扩展功能，支持：XML/JSON/TXT/INI等多种格式，自动处理BOM，完善错误处理
-    
-    新增功能：
-    1. INI格式支持：解析content以&ini&为分隔符，追加至多个栏位
-    2. UPDATE功能增强：先检索再替换，content以&update&作为分隔符
-    3. 执行过程监测：增加debug_print输出
-    4. INI文件强制使用configparser解析
-    
+    多功能FTP文件处理工具（连接池版）
+    复用同一 (主机, 用户) 的已登录会话，重复调用时省去连接、登录、PASV 的往返；
+    参数与返回值同 run_ftp_operation。use_pool=False 时等同于 process_ftp_file_once。
+    """
+    error = validate_operation(operation)
+    if error:
+        return error
+
+    if operation == 'search_tree':
+        # 目录树搜索：file_path 为起始目录，filename 为可选的文件名通配符，max_matches 为匹配总数上限
+        with tracer.call(operation, file_path) as call:
+            return call.result(process_ftp_tree_search(content, file_path, filename, max_matches,
+                                                       ftp_host, ftp_user, ftp_pass))
+
+    if not use_pool:
+        return process_ftp_file_once(ftp_host, ftp_user, ftp_pass, file_path, filename, content, operation,
+                                     max_matches, offset)
+
+    with tracer.call(operation, _trace_target(file_path, filename)) as call:
+        try:
+            debug_print("从连接池获取FTP连接...")
+            conn = ftp_pool.acquire(ftp_host, ftp_user, ftp_pass)
+        except Exception as e:
+            debug_print(f"FTP连接失败: {e}")
+            return call.result({'error': 'FTP_CONNECTION_FAILED', 'message': f'FTP连接失败: {str(e)}'})
+
+        result = None
+        try:
+            result = run_ftp_operation(conn, file_path, filename, content, operation, max_matches, offset)
+            if conn.stale:
+                # 复用的会话已被服务器关闭（如空闲断开后的 421），第一条命令即失败，重新登录后重试一次
+                debug_print("复用的FTP会话已失效，重新登录后重试")
+                try:
+                    conn = ftp_pool.reconnect(conn)
+                except Exception as e:
+                    conn = None
+                    debug_print(f"FTP连接失败: {e}")
+                    return call.result({'error': 'FTP_CONNECTION_FAILED', 'message': f'FTP连接失败: {str(e)}'})
+                result = run_ftp_operation(conn, file_path, filename, content, operation, max_matches, offset)
+            return call.result(result)
+        finally:
+            # 出错的连接归还前会先检查是否仍可用
+            if conn is not None:
+                ftp_pool.release(conn, reusable=isinstance(result, dict) and 'error' not in result)
+
+
+def process_ftp_file_once(ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Auks$1234",
+                          file_path=None, filename=None, content=None, operation=None,
+                          max_matches=None, offset=0):
+    """一次性调用：新建连接、执行操作后立即退出，不使用连接池"""
+    error = validate_operation(operation)
+    if error:
+        return error
+
+    with tracer.call(operation, _trace_target(file_path, filename)) as call:
+        try:
+            debug_print("正在连接FTP...")
+            conn = ftp_pool.connect(ftp_host, ftp_user, ftp_pass)
+            debug_print("FTP连接成功")
+        except Exception as e:
+            debug_print(f"FTP连接失败: {e}")
+            return call.result({'error': 'FTP_CONNECTION_FAILED', 'message': f'FTP连接失败: {str(e)}'})
+
+        try:
+            return call.result(run_ftp_operation(conn, file_path, filename, content, operation, max_matches, offset))
+        finally:
+            debug_print("关闭FTP连接")
+            conn.close()
+
+
+def process_ftp_batch(operations, ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Auks$1234",
+                      max_workers=FTP_BATCH_MAX_WORKERS):
+    """
+    批量FTP操作：一次调用处理多个文件 / 多个操作
+
     参数:
-        ftp_host: FTP服务器地址
-        ftp_user: FTP用户名
-        ftp_pass: FTP密码
-        file_path: FTP文件路径
-        filename: 目标文件名
-        content: 要操作的内容
-        operation: 操作类型（append/update/read/search/search_files/delete/list）
+        operations: 操作列表，每项为 dict，键同 process_ftp_file
+                    （file_path/filename/content/operation，可单独指定 ftp_host/ftp_user/ftp_pass）
+        max_workers: 同时使用的FTP会话数上限
+
+    按 (主机, 用户, 目录) 分组：同组操作在同一个会话上按提交顺序依次执行，只需一次 CWD；
+    不同组并行执行，各自从连接池取会话；全部为只读操作的组再拆分到多个会话。
+    只保证同一目录内的执行顺序。
+
+    返回:
+        {'status', 'total', 'succeeded', 'failed', 'results'}，results 与 operations 一一对应，
+        每项为该操作单独调用 process_ftp_file 时的返回值
+    """
+    if not isinstance(operations, (list, tuple)):
+        return {'error': 'INVALID_OPERATIONS', 'message': 'operations 必须是操作列表'}
+
+    max_workers = max(1, int(max_workers or 1))
+    results = [None] * len(operations)
+    groups = {}  # (主机, 用户, 密码, 目录) -> [(序号, 操作)]
+    for index, item in enumerate(operations):
+        if not isinstance(item, dict):
+            results[index] = {'error': 'INVALID_OPERATIONS', 'message': '每个操作必须是字典'}
+            continue
+        error = validate_operation(item.get('operation'))
+        if not error and item.get('operation') == 'search_tree':
+            error = {'error': 'INVALID_OPERATIONS', 'message': 'search_tree 本身并行执行，不能放在批量操作中'}
+        if error:
+            results[index] = error
+            continue
+        file_path = item.get('file_path')
+        directory = posixpath.normpath(file_path) if file_path else ''
+        key = (item.get('ftp_host', ftp_host), item.get('ftp_user', ftp_user),
+               item.get('ftp_pass', ftp_pass), directory)
+        groups.setdefault(key, []).append((index, item))
+
+    def run_group(key, items):
+        host, user, password, _ = key
+        conn = None
+        for position, (index, item) in enumerate(items):
+            if conn is None:
+                try:
+                    conn = ftp_pool.acquire(host, user, password)
+                except Exception as e:
+                    # 连接失败时同组剩余操作不再逐个重试
+                    debug_print(f"FTP连接失败: {e}")
+                    for rest_index, _ in items[position:]:
+                        results[rest_index] = {'error': 'FTP_CONNECTION_FAILED',
+                                               'message': f'FTP连接失败: {str(e)}'}
+                    return
+            with tracer.call(item.get('operation'), _trace_target(item.get('file_path'), item.get('filename'))) as call:
+                result = call.result(run_ftp_operation(conn, item.get('file_path'), item.get('filename'),
+                                                       item.get('content'), item.get('operation'),
+                                                       item.get('max_matches'), item.get('offset', 0)))
+            results[index] = result
+            if isinstance(result, dict) and 'error' in result:
+                # 出错后确认会话仍可用，不可用则丢弃，下一项重新取连接
+                try:
+                    conn.ftp.voidcmd("NOOP")
+                except Exception:
+                    ftp_pool.release(conn, reusable=False)
+                    conn = None
+        if conn is not None:
+            ftp_pool.release(conn)
+
+    # 只读的组没有顺序要求，拆成多段分给多个会话并行执行
+    tasks = []
+    for key, items in groups.items():
+        if len(items) > 1 and all(item['operation'] in READ_ONLY_OPERATIONS for _, item in items):
+            chunks = min(max_workers, len(items))
+            size = -(-len(items) // chunks)
+            tasks.extend((key, items[i:i + size]) for i in range(0, len(items), size))
+        else:
+            tasks.append((key, items))
+
+    debug_print(f"批量执行 {len(operations)} 个操作，共 {len(groups)} 组 {len(tasks)} 段")
+    workers = max(1, min(max_workers, len(tasks)))
+    if workers == 1:
+        for key, items in tasks:
+            run_group(key, items)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(run_group, key, items) for key, items in tasks]:
+                future.result()
+
+    failed = sum(1 for result in results if not isinstance(result, dict) or 'error' in result)
+    return {
+        'status': 'success',
+        'total': len(results),
+        'succeeded': len(results) - failed,
+        'failed': failed,
+        'results': results
+    }
+
+
+_WORKER_DONE = object()
+
+
+def iter_ftp_tree_search(search_term, root=None, name_pattern=None, max_results=None,
+                         ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Auks$1234",
+                         max_workers=FTP_TREE_SEARCH_MAX_WORKERS, max_depth=FTP_TREE_MAX_DEPTH):
     """
+    在FTP目录树中并行搜索文件内容，边找边返回
+
+    参数:
+        search_term: 搜索词（与 search 操作相同，不区分大小写）
+        root: 起始目录，默认登录目录；相对路径相对于登录目录
+        name_pattern: 文件名通配符（如 *.ini），不区分大小写；为空时搜索所有文件
+        max_results: 匹配总数上限，达到后停止派发并丢弃多余的匹配
+        max_workers: 同时使用的FTP会话数上限
+
+    每个工作线程从连接池取一个会话，共享同一个任务队列：列目录任务产生子目录与文件任务，
+    文件任务调用 run_ftp_operation 的 search（各类型的匹配逻辑、内容缓存、大日志流式搜索均沿用）。
+
+    逐个生成事件 dict:
+        {'type': 'file', 'path', 'file_path', 'filename', 'file_type', 'matches_found', 'matches', 'truncated'}
+            有匹配的文件，按完成顺序返回
+        {'type': 'error', 'path', 'error', 'message'}  某个目录或文件处理失败
+        {'type': 'done', 'files_searched', 'directories_listed', 'matches_found', 'truncated', 'errors'}
+            最后一个事件
+    提前关闭生成器时，工作线程会尽快停止并归还会话。
+    """
+    search_term = str(search_term or '')
+    max_results = int(max_results) if max_results else None
+    pattern = name_pattern.lower() if name_pattern else None
+    workers = max(1, int(max_workers or 1))
+    root = posixpath.normpath(root) if root else ''
+
+    tasks = queue.Queue()
+    events = queue.Queue()
+    stop = threading.Event()
+    lock = threading.Lock()
+    state = {'pending': 1, 'matches': 0, 'files': 0, 'directories': 0, 'skipped': 0}
+
+    def add_task(task):
+        with lock:
+            state['pending'] += 1
+        tasks.put(task)
+
+    def finish_task():
+        with lock:
+            state['pending'] -= 1
+            finished = state['pending'] == 0
+        if finished:
+            # 所有任务处理完毕，通知工作线程退出
+            for _ in range(workers):
+                tasks.put(None)
+
+    def list_directory(conn, directory, depth):
+        conn.chdir(directory)
+        files, dirs = listing_cache.list(conn)
+        with lock:
+            state['directories'] += 1
+        if depth < max_depth:
+            for name in dirs:
+                add_task(('dir', posixpath.join(directory, name), depth + 1))
+        for name in files:
+            if pattern is None or fnmatch.fnmatchcase(name.lower(), pattern):
+                add_task(('file', directory, name))
+
+    def search_file(conn, directory, name):
+        with lock:
+            remaining = max_results - state['matches'] if max_results else None
+        if remaining is not None and remaining <= 0:
+            with lock:
+                state['skipped'] += 1
+            return None
+        with tracer.call('search', posixpath.join(directory, name)) as call:
+            result = call.result(run_ftp_operation(conn, directory or None, name, search_term, 'search', remaining))
+        with lock:
+            state['files'] += 1
+            if isinstance(result, dict) and 'error' not in result:
+                state['matches'] += result.get('matches_found', 0)
+                if max_results and state['matches'] >= max_results:
+                    stop.set()
+        return result
+
+    def worker():
+        conn = None
+        try:
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                path = posixpath.join(task[1], task[2]) if task[0] == 'file' else task[1]
+                try:
+                    if stop.is_set():
+                        with lock:
+                            state['skipped'] += 1
+                        continue
+                    if conn is None:
+                        conn = ftp_pool.acquire(ftp_host, ftp_user, ftp_pass)
+                    if task[0] == 'dir':
+                        list_directory(conn, task[1], task[2])
+                        continue
+                    result = search_file(conn, task[1], task[2])
+                    if not isinstance(result, dict):
+                        continue
+                    if 'error' in result:
+                        events.put({'type': 'error', 'path': path, 'error': result['error'],
+                                    'message': result.get('message')})
+                        # 出错后确认会话仍可用，不可用则丢弃，下个任务重新取连接
+                        try:
+                            conn.ftp.voidcmd("NOOP")
+                        except Exception:
+                            ftp_pool.release(conn, reusable=False)
+                            conn = None
+                    elif result.get('matches_found'):
+                        events.put({
+                            'type': 'file',
+                            'path': path,
+                            'file_path': task[1],
+                            'filename': task[2],
+                            'file_type': result.get('file_type'),
+                            'matches_found': result['matches_found'],
+                            'matches': result.get('matches', []),
+                            'truncated': bool(result.get('truncated'))
+                        })
+                except Exception as e:
+                    debug_print(f"目录树搜索处理 {path} 失败: {e}")
+                    events.put({'type': 'error', 'path': path, 'error': 'TREE_SEARCH_ERROR', 'message': str(e)})
+                    if conn is None:
+                        # 无法取得会话时其余任务也会失败，直接结束
+                        stop.set()
+                    else:
+                        ftp_pool.release(conn, reusable=False)
+                        conn = None
+                finally:
+                    finish_task()
+        finally:
+            if conn is not None:
+                ftp_pool.release(conn)
+            events.put(_WORKER_DONE)
+
+    debug_print(f"目录树搜索: 起始目录 {root or '(登录目录)'}, 文件名 {name_pattern or '*'}, 搜索词 {search_term}")
+    tasks.put(('dir', root, 0))
+    for _ in range(workers):
+        threading.Thread(target=worker, daemon=True).start()
+
+    found = 0
+    errors = 0
+    truncated = False
+    running = workers
+    try:
+        while running:
+            event = events.get()
+            if event is _WORKER_DONE:
+                running -= 1
+                continue
+            if event['type'] == 'error':
+                errors += 1
+                yield event
+                continue
+            if max_results:
+                # 并发的文件可能同时返回，超出上限的部分在这里截掉
+                remaining = max_results - found
+                if remaining <= 0:
+                    truncated = True
+                    continue
+                if event['matches_found'] > remaining:
+                    event['matches'] = event['matches'][:remaining]
+                    event['matches_found'] = remaining
+                    event['truncated'] = True
+            truncated = truncated or event['truncated']
+            found += event['matches_found']
+            yield event
+    finally:
+        # 调用方提前结束时停止派发新任务
+        stop.set()
+
+    with lock:
+        files, directories, skipped = state['files'], state['directories'], state['skipped']
+    yield {
+        'type': 'done',
+        'files_searched': files,
+        'directories_listed': directories,
+        'matches_found': found,
+        # 达到上限后仍有未处理的目录或文件
+        'truncated': truncated or skipped > 0,
+        'errors': errors
+    }
+
+
+def process_ftp_tree_search(search_term, root=None, name_pattern=None, max_results=None,
+                            ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Auks$1234",
+                            max_workers=FTP_TREE_SEARCH_MAX_WORKERS):
+    """目录树内容搜索的汇总版本：收集 iter_ftp_tree_search 的全部事件后一次返回"""
+    if not search_term:
+        return {'error': 'MISSING_SEARCH_TERM', 'message': '搜索操作需要搜索词'}
+
+    results = []
+    errors = []
+    summary = {}
+    for event in iter_ftp_tree_search(search_term, root, name_pattern, max_results,
+                                      ftp_host, ftp_user, ftp_pass, max_workers):
+        kind = event.pop('type')
+        if kind == 'file':
+            results.append(event)
+        elif kind == 'error':
+            errors.append(event)
+        else:
+            summary = event
+    return {
+        'status': 'success',
+        'search_term': str(search_term).lower(),
+        'root': root or '',
+        'files_matched': len(results),
+        'files_searched': summary.get('files_searched', 0),
+        'directories_listed': summary.get('directories_listed', 0),
+        'matches_found': summary.get('matches_found', 0),
+        'truncated': summary.get('truncated', False),
+        'results': results,
+        'errors': errors
+    }
+
+
+# ========== 文件内容处理（同步与异步版本共用，不涉及网络） ==========
+
+# --- 改进的类型检测 ---
+def detect_file_type(filename, raw_content):
+    """通过后缀和内容自动判断文件类型"""
+    if not filename:
+        return 'unknown'
+        
+    ext = os.path.splitext(filename)[1].lower()
     
-    # --- 改进的类型检测 ---
-    def detect_file_type(filename, raw_content):
-        """通过后缀和内容自动判断文件类型"""
-        if not filename:
-            return 'unknown'
+    # 通过后缀判断 - INI文件优先
+    type_map = {
+        '.json': 'json',
+        '.xml': 'xml',
+        '.txt': 'text',
+        '.log': 'text',
+        '.ini': 'ini',
+        '.conf': 'ini',
+        '.cfg': 'ini',
+        '.properties': 'ini',
+        '.csv': 'text',
+        '.yaml': 'text',
+        '.yml': 'text',
+        '.html': 'text',
+        '.htm': 'text'
+    }
+    
+    if ext in type_map:
+        file_type = type_map[ext]
+        debug_print(f"通过文件后缀检测到类型: {file_type}")
+        
+        # 如果是INI后缀，直接返回ini类型
+        if file_type == 'ini':
+            debug_print("INI文件后缀，使用INI解析器")
+            return 'ini'
             
-        ext = os.path.splitext(filename)[1].lower()
+        return file_type
         
-        # 通过后缀判断 - INI文件优先
-        type_map = {
-            '.json': 'json',
-            '.xml': 'xml',
-            '.txt': 'text',
-            '.log': 'text',
-            '.ini': 'ini',
-            '.conf': 'ini',
-            '.cfg': 'ini',
-            '.properties': 'ini',
-            '.csv': 'text',
-            '.yaml': 'text',
-            '.yml': 'text',
-            '.html': 'text',
-            '.htm': 'text'
-        }
+    # 无法通过后缀判断时，分析内容
+    if not raw_content or len(raw_content.strip()) == 0:
+        debug_print("空文件，默认为文本类型")
+        return 'text'  # 空文件视为文本
         
-        if ext in type_map:
-            file_type = type_map[ext]
-            debug_print(f"通过文件后缀检测到类型: {file_type}")
-            
-            # 如果是INI后缀，直接返回ini类型
-            if file_type == 'ini':
-                debug_print("INI文件后缀，使用INI解析器")
-                return 'ini'
-                
-            return file_type
-            
-        # 无法通过后缀判断时，分析内容
-        if not raw_content or len(raw_content.strip()) == 0:
-            debug_print("空文件，默认为文本类型")
-            return 'text'  # 空文件视为文本
-            
-        # 尝试解析JSON
-        try:
-            json.loads(raw_content)
-            debug_print("通过内容检测到JSON类型")
-            return 'json'
-        except:
-            pass
-            
-        # 尝试解析XML
-        try:
-            # 移除BOM和空白字符
-            content_clean = raw_content.strip()
-            if content_clean.startswith('\ufeff'):
-                content_clean = content_clean[1:]
-            if content_clean.startswith('<?xml') or content_clean.startswith('<'):
-                ET.fromstring(content_clean)
-                debug_print("通过内容检测到XML类型")
-                return 'xml'
-        except:
-            pass
-            
-        # 尝试解析INI格式（仅针对非INI后缀的文件）
-        try:
-            content_clean = raw_content.strip()
-            if any(line.strip().startswith('[') and line.strip().endswith(']') for line in content_clean.split('\n')):
-                debug_print("通过内容检测到INI类型（包含section）")
-                return 'ini'
-            elif '=' in content_clean and not content_clean.startswith('{') and not content_clean.startswith('<'):
-                debug_print("通过内容检测到INI类型（包含等号）")
-                return 'ini'
-        except:
-            pass
-            
-        # 默认为文本
-        debug_print("默认为文本类型")
-        return 'text'
-
-    # --- 改进的自动解码 ---
-    def auto_decode(byte_content):
-        """自动检测编码并解码，处理BOM"""
-        if not byte_content:
+    # 尝试解析JSON
+    try:
+        json.loads(raw_content)
+        debug_print("通过内容检测到JSON类型")
+        return 'json'
+    except:
+        pass
+        
+    # 尝试解析XML
+    try:
+        # 移除BOM和空白字符
+        content_clean = raw_content.strip()
+        if content_clean.startswith('\ufeff'):
+            content_clean = content_clean[1:]
+        if content_clean.startswith('<?xml') or content_clean.startswith('<'):
+            ET.fromstring(content_clean)
+            debug_print("通过内容检测到XML类型")
+            return 'xml'
+    except:
+        pass
+        
+    # 尝试解析INI格式（仅针对非INI后缀的文件）
+    try:
+        content_clean = raw_content.strip()
+        if any(line.strip().startswith('[') and line.strip().endswith(']') for line in content_clean.split('\n')):
+            debug_print("通过内容检测到INI类型（包含section）")
+            return 'ini'
+        elif '=' in content_clean and not content_clean.startswith('{') and not content_clean.startswith('<'):
+            debug_print("通过内容检测到INI类型（包含等号）")
+            return 'ini'
+    except:
+        pass
+        
+    # 默认为文本
+    debug_print("默认为文本类型")
+    return 'text'
+
+
+# --- 改进的自动解码 ---
+def auto_decode(byte_content, key=None):
+    """自动检测编码并解码，处理BOM；key 为文件路径标识，用于缓存非UTF-8文件的检测结果
+
+    返回 (文本, 编码, BOM字节)，写回时用于保持原文件的编码
+    """
+    if not byte_content:
+        return "", 'utf-8', b''
+        
+    debug_print(f"解码字节内容，长度: {len(byte_content)}")
+    # BOM -> 严格UTF-8 -> 路径缓存 -> 采样chardet -> UTF-8（忽略错误）
+    with tracer.span('decode') as span:
+        span.add(len(byte_content))
+        return encoding_detector.decode_detail(byte_content, key)
+
+
+# --- 改进的内容加载 ---
+def load_content(filename, raw_content, file_type=None):
+    """根据类型加载结构化内容"""
+    if not file_type:
+        file_type = detect_file_type(filename, raw_content)
+        
+    debug_print(f"加载内容，类型: {file_type}, 长度: {len(raw_content) if raw_content else 0}")
+        
+    if not raw_content:
+        if file_type == 'json':
+            return {}
+        elif file_type == 'xml':
+            return ET.Element('root')
+        elif file_type == 'ini':
+            config = configparser.ConfigParser()
+            # 保留大小写
+            config.optionxform = str
+            return config
+        else:
             return ""
             
-        debug_print(f"解码字节内容，长度: {len(byte_content)}")
-        
-        # 先尝试UTF-8 BOM
-        if byte_content.startswith(b'\xef\xbb\xbf'):
-            debug_print("检测到UTF-8 BOM")
-            try:
-                return byte_content.decode('utf-8-sig')
-            except:
-                debug_print("UTF-8 BOM解码失败")
-                pass
-        # 尝试UTF-16 BOM
-        elif byte_content.startswith(b'\xff\xfe'):
-            debug_print("检测到UTF-16 LE BOM")
-            try:
-                return byte_content.decode('utf-16')
-            except:
-                debug_print("UTF-16 LE BOM解码失败")
-                pass
-        elif byte_content.startswith(b'\xfe\xff'):
-            debug_print("检测到UTF-16 BE BOM")
+    try:
+        if file_type == 'json':
+            # 移除可能的BOM
+            if raw_content.startswith('\ufeff'):
+                raw_content = raw_content[1:]
+            result = json.loads(raw_content)
+            debug_print("JSON解析成功")
+            return result
+        elif file_type == 'xml':
+            # 移除BOM
+            if raw_content.startswith('\ufeff'):
+                raw_content = raw_content[1:]
+            # 如果内容没有根标签，添加一个临时的
+            if not raw_content.strip().startswith('<?xml') and not raw_content.strip().startswith('<'):
+                raw_content = f'<root>{raw_content}</root>'
+            result = ET.fromstring(raw_content)
+            debug_print("XML解析成功")
+            return result
+        elif file_type == 'ini':
+            config = configparser.ConfigParser()
+            # 保留大小写
+            config.optionxform = str
             try:
-                return byte_content.decode('utf-16-be')
-            except:
-                debug_print("UTF-16 BE BOM解码失败")
-                pass
-                
-        # 使用chardet检测
+                config.read_string(raw_content)
+                debug_print("INI解析成功")
+            except configparser.MissingSectionHeaderError:
+                # 如果没有section，添加默认section
+                config.read_string(f'[DEFAULT]\n{raw_content}')
+                debug_print("INI解析成功（添加了DEFAULT section）")
+            return config
+        else:
+            # 对于其他后缀（非ini），使用原有逻辑
+            debug_print(f"使用文本模式处理 {file_type} 文件")
+            return raw_content
+    except Exception as e:
+        debug_print(f"解析失败，返回原始内容: {e}")
+        # 如果解析失败，返回原始内容
+        return raw_content
+
+
+# --- 改进的内容保存 ---
+def save_content(content, file_type, original_filename=None):
+    """根据类型序列化内容"""
+    debug_print(f"保存内容，类型: {file_type}")
+    try:
+        if file_type == 'json':
+            if isinstance(content, (dict, list)):
+                result = json.dumps(content, ensure_ascii=False, indent=2)
+                debug_print("JSON序列化成功")
+                return result
+            else:
+                # 如果不是JSON结构，转换为字符串
+                debug_print("内容不是JSON结构，转换为字符串")
+                return str(content)
+        elif file_type == 'xml':
+            if isinstance(content, ET.Element):
+                # 美化XML输出
+                try:
+                    from xml.dom import minidom
+                    rough_string = ET.tostring(content, 'unicode')
+                    reparsed = minidom.parseString(rough_string)
+                    result = reparsed.toprettyxml(indent="  ")
+                    debug_print("XML美化输出成功")
+                    return result
+                except:
+                    result = ET.tostring(content, encoding='unicode', method='xml')
+                    debug_print("XML普通输出成功")
+                    return result
+            else:
+                debug_print("内容不是XML元素，转换为字符串")
+                return str(content)
+        elif file_type == 'ini':
+            if isinstance(content, configparser.ConfigParser):
+                # 使用StringIO保存INI格式
+                string_io = StringIO()
+                content.write(string_io)
+                result = string_io.getvalue()
+                debug_print("INI序列化成功")
+                return result
+            else:
+                debug_print("内容不是ConfigParser，转换为字符串")
+                return str(content)
+        else:
+            debug_print("使用文本模式保存")
+            return str(content)
+    except Exception as e:
+        debug_print(f"保存失败，返回原始内容: {e}")
+        # 保存失败时返回原始内容
+        return str(content)
+
+
+# --- 局部修补写回 ---
+def render_content(content, file_type, raw_content, original_filename=None):
+    """生成写回的文本：结构化文件优先在原文上只改写变化的片段，无法局部修补时整体序列化"""
+    if file_type in ('json', 'xml', 'ini') and raw_content:
         try:
-            detect_result = chardet.detect(byte_content)
-            debug_print(f"chardet检测结果: {detect_result}")
-            if detect_result['confidence'] > 0.7 and detect_result['encoding']:
-                return byte_content.decode(detect_result['encoding'], errors='ignore')
+            patched = patch_document(raw_content, content, file_type)
+            if patched is not None:
+                debug_print("已在原文上局部修补，未变化的部分保持原样")
+                return patched
+            debug_print("改动无法局部修补，整体序列化")
         except Exception as e:
-            debug_print(f"chardet检测失败: {e}")
-            pass
-            
-        # 最终尝试UTF-8和回退方案
-        for encoding in ['utf-8', 'latin-1', 'cp1252', 'gbk', 'gb2312', 'gb18030']:
-            try:
-                result = byte_content.decode(encoding, errors='ignore')
-                debug_print(f"使用{encoding}编码成功解码")
-                return result
-            except Exception as e:
-                debug_print(f"{encoding}编码解码失败: {e}")
-                continue
-                
-        # 如果都失败，使用替换错误处理
-        debug_print("所有解码尝试失败，使用utf-8 with replace")
-        return byte_content.decode('utf-8', errors='replace')
-
-    # --- 改进的内容加载 ---
-    def load_content(filename, raw_content, file_type=None):
-        """根据类型加载结构化内容"""
-        if not file_type:
-            file_type = detect_file_type(filename, raw_content)
-            
-        debug_print(f"加载内容，类型: {file_type}, 长度: {len(raw_content) if raw_content else 0}")
+            debug_print(f"局部修补失败，整体序列化: {e}")
+    return save_content(content, file_type, original_filename)
+
+
+def encode_content(text, encoding, bom):
+    """按原文件的编码与BOM编码写回内容；新内容无法用原编码表示时使用UTF-8"""
+    try:
+        return bom + text.encode(encoding)
+    except (UnicodeEncodeError, LookupError):
+        return text.encode('utf-8')
+
+
+# --- INI格式特殊处理 ---
+def handle_ini_content(filename, file_content, new_content_str, operation_type='append'):
+    """处理INI格式的内容追加/更新"""
+    debug_print(f"处理INI内容，操作类型: {operation_type}")
+    
+    if not isinstance(file_content, configparser.ConfigParser):
+        debug_print("文件内容不是ConfigParser对象，重新解析")
+        file_content = load_content(filename, file_content, 'ini')
+    
+    # 解析传入的内容，使用&ini&作为分隔符
+    content_parts = new_content_str.split('&ini&')
+    debug_print(f"解析到 {len(content_parts)} 个栏位内容")
+    
+    for i, part in enumerate(content_parts):
+        debug_print(f"栏位 {i+1}: {part}")
+        
+        # 如果是None或空字符串，跳过
+        if part.strip().upper() == 'NONE' or not part.strip():
+            debug_print(f"栏位 {i+1} 为None或空，跳过")
+            continue
             
-        if not raw_content:
-            if file_type == 'json':
-                return {}
-            elif file_type == 'xml':
-                return ET.Element('root')
-            elif file_type == 'ini':
-                config = configparser.ConfigParser()
-                # 保留大小写
-                config.optionxform = str
-                return config
-            else:
-                return ""
-                
+        # 尝试解析栏位内容
         try:
-            if file_type == 'json':
-                # 移除可能的BOM
-                if raw_content.startswith('\ufeff'):
-                    raw_content = raw_content[1:]
-                result = json.loads(raw_content)
-                debug_print("JSON解析成功")
-                return result
-            elif file_type == 'xml':
-                # 移除BOM
-                if raw_content.startswith('\ufeff'):
-                    raw_content = raw_content[1:]
-                # 如果内容没有根标签，添加一个临时的
-                if not raw_content.strip().startswith('<?xml') and not raw_content.strip().startswith('<'):
-                    raw_content = f'<root>{raw_content}</root>'
-                result = ET.fromstring(raw_content)
-                debug_print("XML解析成功")
-                return result
-            elif file_type == 'ini':
-                config = configparser.ConfigParser()
-                # 保留大小写
-                config.optionxform = str
-                try:
-                    config.read_string(raw_content)
-                    debug_print("INI解析成功")
-                except configparser.MissingSectionHeaderError:
-                    # 如果没有section，添加默认section
-                    config.read_string(f'[DEFAULT]\n{raw_content}')
-                    debug_print("INI解析成功（添加了DEFAULT section）")
-                return config
+            # 尝试解析为键值对
+            if '=' in part:
+                lines = part.strip().split('\n')
+                for line in lines:
+                    line = line.strip()
+                    if not line or line.startswith('#') or line.startswith(';'):
+                        continue
+                        
+                    if '=' in line:
+                        key, value = line.split('=', 1)
+                        key = key.strip()
+                        value = value.strip()
+                        
+                        # 检查是否有section标记
+                        if key.startswith('[') and key.endswith(']'):
+                            section = key[1:-1]
+                            debug_print(f"检测到section: {section}")
+                            if not file_content.has_section(section):
+                                file_content.add_section(section)
+                        elif '[' in key and ']' in key:
+                            # 格式: section[key]=value
+                            section_start = key.find('[')
+                            section_end = key.find(']')
+                            section = key[:section_start]
+                            option = key[section_start+1:section_end]
+                            if not file_content.has_section(section):
+                                file_content.add_section(section)
+                            file_content.set(section, option, value)
+                            debug_print(f"设置 {section}[{option}] = {value}")
+                        else:
+                            # 使用DEFAULT section
+                            if not file_content.has_section('DEFAULT'):
+                                file_content.add_section('DEFAULT')
+                            file_content.set('DEFAULT', key, value)
+                            debug_print(f"设置 DEFAULT[{key}] = {value}")
             else:
-                # 对于其他后缀（非ini），使用原有逻辑
-                debug_print(f"使用文本模式处理 {file_type} 文件")
-                return raw_content
+                # 如果不是键值对格式，作为注释或section处理
+                if part.startswith('[') and part.endswith(']'):
+                    section = part[1:-1].strip()
+                    if not file_content.has_section(section):
+                        file_content.add_section(section)
+                        debug_print(f"添加section: {section}")
         except Exception as e:
-            debug_print(f"解析失败，返回原始内容: {e}")
-            # 如果解析失败，返回原始内容
-            return raw_content
+            debug_print(f"处理栏位 {i+1} 时出错: {e}")
+            continue
+    
+    return file_content
+
 
-    # --- 改进的内容保存 ---
-    def save_content(content, file_type, original_filename=None):
-        """根据类型序列化内容"""
-        debug_print(f"保存内容，类型: {file_type}")
+# --- UPDATE功能增强 ---
+def handle_update_content(filename, file_content, new_content_str, file_type):
+    """处理更新操作，先检索再替换，返回 (更新后的内容, 替换次数)
+
+    检索内容默认按值匹配；带前缀时按路径定位：JSON 用 jsonpath:$.a.b[0]，XML 用 xpath:/root/a/b 或
+    xpath:.//b[@id='x']（以 /@属性名 结尾时更新属性），路径不存在时替换 0 次。
+    按值检索时只匹配值，不会改动键名、标签名与属性名。
+    """
+    debug_print(f"处理UPDATE操作，文件类型: {file_type}")
+    
+    # 解析传入的内容，使用&update&作为分隔符
+    parts = new_content_str.split('&update&')
+    debug_print(f"解析到 {len(parts)} 个更新部分")
+    
+    if len(parts) != 2:
+        debug_print("UPDATE格式错误，需要: 检索内容&update&新内容")
+        return file_content, 0
+        
+    search_content = parts[0].strip()
+    replace_content = parts[1].strip()
+    replacements = 0
+    
+    debug_print(f"检索内容: {search_content}")
+    debug_print(f"新内容: {replace_content}")
+    
+    if file_type == 'ini':
+        # INI文件的更新逻辑
+        if isinstance(file_content, configparser.ConfigParser):
+            debug_print("在INI文件中搜索内容")
+            
+            # 遍历所有section和option（只遍历节内自身写出的选项，与 structured_patch 相同读取 _sections；
+            # items() 会混入继承自DEFAULT的选项，DEFAULT中的选项单独处理）
+            defaults = file_content.defaults()
+            for section in file_content.sections():
+                for option, value in list(file_content._sections[section].items()):
+                    # 如果找到匹配的内容
+                    if search_content in (value or '') or search_content == option or search_content == section:
+                        debug_print(f"找到匹配: {section}[{option}] = {value}")
+                        file_content.set(section, option, replace_content)
+                        replacements += 1
+                        debug_print(f"更新为: {replace_content}")
+            
+            # 检查DEFAULT section
+            for option, value in list(defaults.items()):
+                if search_content in (value or '') or search_content == option:
+                    debug_print(f"在DEFAULT中找到匹配: {option} = {value}")
+                    file_content.set('DEFAULT', option, replace_content)
+                    replacements += 1
+            
+            if not replacements:
+                debug_print(f"未找到匹配 '{search_content}' 的内容")
+                # 如果没有找到，作为新内容添加到DEFAULT
+                file_content.set('DEFAULT', 'new_' + str(len(defaults) + 1), replace_content)
+                debug_print(f"作为新内容添加到DEFAULT")
+        
+    elif file_type == 'json':
+        # JSON文件的更新逻辑：遍历一次解析结果，不再序列化后做字符串替换
+        debug_print("在JSON文件中搜索内容")
+        file_content, replacements = update_json(file_content, search_content, replace_content)
+        debug_print(f"JSON更新完成，替换 {replacements} 处")
+    
+    elif file_type == 'xml':
+        # XML文件的更新逻辑：原地更新元素树
+        debug_print("在XML文件中搜索内容")
+        replacements = update_xml(file_content, search_content, replace_content)
+        debug_print(f"XML更新完成，替换 {replacements} 处")
+    
+    else:
+        # 文本文件的更新逻辑
+        debug_print("在文本文件中搜索内容")
+        if search_content in file_content:
+            debug_print(f"在文本中找到匹配")
+            replacements = file_content.count(search_content)
+            file_content = file_content.replace(search_content, replace_content)
+            debug_print("文本更新成功")
+        else:
+            debug_print(f"未找到匹配 '{search_content}' 的内容")
+    
+    return file_content, replacements
+
+
+def apply_operation(operation, filename, content, file_type, file_content, raw_content, byte_content=b"",
+                    byte_size=0, source_encoding='utf-8', source_bom=b'', max_matches=None, cache_entry=None):
+    """对已加载的文件内容执行 read/append/update/search，不涉及网络
+
+    返回 (结果, 需要上传的字节)；append/update 内容有变化时第二项为新文件内容，由调用方 STOR 上传，
+    上传成功后结果即为第一项，失败时按 WRITE_ERRORS 返回错误。异步版本在线程池中调用。
+    """
+    result = None
+    updated_bytes = None
+    
+    if operation in WRITE_ERRORS and byte_content and source_encoding is None:
+        # 没有编码能无损解码原文件，按解码结果写回会丢掉无法识别的字节
+        debug_print("文件内容无法无损解码，拒绝写回")
+        return {'error': 'ENCODING_ERROR',
+                'message': f'无法识别 {filename} 的编码（解码有损），为避免损坏文件已拒绝{operation}操作'}, None
+
+    if operation == 'read':
+        debug_print("执行READ操作")
+        result = {
+            'status': 'success',
+            'filename': filename,
+            'type': file_type,
+            'size': byte_size,
+            'content': file_content,
+            'raw_content': raw_content if file_type == 'text' else None
+        }
+        debug_print(f"读取成功，文件类型: {file_type}")
+
+    elif operation == 'append':
+        if not content:
+            return {'error': 'MISSING_CONTENT', 'message': '追加操作需要内容参数'}, None
+        
+        debug_print("执行APPEND操作")
+        span = tracer.span('operation')
         try:
+            new_content_str = str(content)
+            debug_print(f"追加内容: {new_content_str[:100]}...")
+            new_content_parsed = load_content(filename, new_content_str, file_type)
+            
+            # 根据文件类型处理追加逻辑
             if file_type == 'json':
-                if isinstance(content, (dict, list)):
-                    result = json.dumps(content, ensure_ascii=False, indent=2)
-                    debug_print("JSON序列化成功")
-                    return result
+                debug_print("处理JSON追加")
+                if isinstance(file_content, dict) and isinstance(new_content_parsed, dict):
+                    # 合并字典
+                    file_content.update(new_content_parsed)
+                    debug_print("JSON字典合并成功")
+                elif isinstance(file_content, list):
+                    # 追加到列表
+                    file_content.append(new_content_parsed)
+                    debug_print("JSON列表追加成功")
                 else:
-                    # 如果不是JSON结构，转换为字符串
-                    debug_print("内容不是JSON结构，转换为字符串")
-                    return str(content)
+                    # 其他情况，转换为字符串追加
+                    file_content = str(file_content) + '\n' + new_content_str
+                    debug_print("JSON转换为字符串追加")
+                    
             elif file_type == 'xml':
-                if isinstance(content, ET.Element):
-                    # 美化XML输出
-                    try:
-                        from xml.dom import minidom
-                        rough_string = ET.tostring(content, 'unicode')
-                        reparsed = minidom.parseString(rough_string)
-                        result = reparsed.toprettyxml(indent="  ")
-                        debug_print("XML美化输出成功")
-                        return result
-                    except:
-                        result = ET.tostring(content, encoding='unicode', method='xml')
-                        debug_print("XML普通输出成功")
-                        return result
+                debug_print("处理XML追加")
+                if isinstance(new_content_parsed, ET.Element):
+                    file_content.append(new_content_parsed)
+                    debug_print("XML元素追加成功")
                 else:
-                    debug_print("内容不是XML元素，转换为字符串")
-                    return str(content)
+                    # 如果是字符串，创建一个新的文本元素
+                    new_elem = ET.Element('addition')
+                    new_elem.text = new_content_str
+                    file_content.append(new_elem)
+                    debug_print("XML字符串追加成功")
+                    
             elif file_type == 'ini':
-                if isinstance(content, configparser.ConfigParser):
-                    # 使用StringIO保存INI格式
-                    string_io = StringIO()
-                    content.write(string_io)
-                    result = string_io.getvalue()
-                    debug_print("INI序列化成功")
-                    return result
-                else:
-                    debug_print("内容不是ConfigParser，转换为字符串")
-                    return str(content)
+                debug_print("处理INI追加")
+                file_content = handle_ini_content(filename, file_content, new_content_str, 'append')
+                
             else:
-                debug_print("使用文本模式保存")
-                return str(content)
+                # 文本文件直接追加
+                debug_print("处理文本追加")
+                file_content = raw_content + '\n' + new_content_str
+            span.end()
+
+            # 生成更新后的文件内容
+            with tracer.span('serialize') as span:
+                updated_content = render_content(file_content, file_type, raw_content, filename)
+                updated_bytes = encode_content(updated_content, source_encoding, source_bom)
+                span.add(len(updated_bytes))
+            if updated_bytes == byte_content:
+                debug_print("内容未变化，跳过上传")
+                result = {'status': 'success', 'message': f'{filename} 内容未变化，无需上传', 'unchanged': True}
+                updated_bytes = None
+            else:
+                result = {'status': 'success', 'message': f'已成功追加内容到 {filename}'}
+            
         except Exception as e:
-            debug_print(f"保存失败，返回原始内容: {e}")
-            # 保存失败时返回原始内容
-            return str(content)
+            span.end(error=True)
+            debug_print(f"追加内容失败: {e}")
+            return {'error': 'APPEND_ERROR', 'message': f'追加内容失败: {str(e)}'}, None
 
-    # --- INI格式特殊处理 ---
-    def handle_ini_content(filename, file_content, new_content_str, operation_type='append'):
-        """处理INI格式的内容追加/更新"""
-        debug_print(f"处理INI内容，操作类型: {operation_type}")
-        
-        if not isinstance(file_content, configparser.ConfigParser):
-            debug_print("文件内容不是ConfigParser对象，重新解析")
-            file_content = load_content(filename, file_content, 'ini')
+    elif operation == 'update':
+        if not content:
+            return {'error': 'MISSING_CONTENT', 'message': '更新操作需要内容参数'}, None
         
-        # 解析传入的内容，使用&ini&作为分隔符
-        content_parts = new_content_str.split('&ini&')
-        debug_print(f"解析到 {len(content_parts)} 个栏位内容")
-        
-        for i, part in enumerate(content_parts):
-            debug_print(f"栏位 {i+1}: {part}")
+        debug_print("执行UPDATE操作")
+        span = tracer.span('operation')
+        try:
+            new_content_str = str(content)
+            debug_print(f"更新内容: {new_content_str[:100]}...")
             
-            # 如果是None或空字符串，跳过
-            if part.strip().upper() == 'NONE' or not part.strip():
-                debug_print(f"栏位 {i+1} 为None或空，跳过")
-                continue
-                
-            # 尝试解析栏位内容
-            try:
-                # 尝试解析为键值对
-                if '=' in part:
-                    lines = part.strip().split('\n')
-                    for line in lines:
-                        line = line.strip()
-                        if not line or line.startswith('#') or line.startswith(';'):
-                            continue
-                            
-                        if '=' in line:
-                            key, value = line.split('=', 1)
-                            key = key.strip()
-                            value = value.strip()
-                            
-                            # 检查是否有section标记
-                            if key.startswith('[') and key.endswith(']'):
-                                section = key[1:-1]
-                                debug_print(f"检测到section: {section}")
-                                if not file_content.has_section(section):
-                                    file_content.add_section(section)
-                            elif '[' in key and ']' in key:
-                                # 格式: section[key]=value
-                                section_start = key.find('[')
-                                section_end = key.find(']')
-                                section = key[:section_start]
-                                option = key[section_start+1:section_end]
-                                if not file_content.has_section(section):
-                                    file_content.add_section(section)
-                                file_content.set(section, option, value)
-                                debug_print(f"设置 {section}[{option}] = {value}")
-                            else:
-                                # 使用DEFAULT section
-                                if not file_content.has_section('DEFAULT'):
-                                    file_content.add_section('DEFAULT')
-                                file_content.set('DEFAULT', key, value)
-                                debug_print(f"设置 DEFAULT[{key}] = {value}")
-                else:
-                    # 如果不是键值对格式，作为注释或section处理
-                    if part.startswith('[') and part.endswith(']'):
-                        section = part[1:-1].strip()
-                        if not file_content.has_section(section):
-                            file_content.add_section(section)
-                            debug_print(f"添加section: {section}")
-            except Exception as e:
-                debug_print(f"处理栏位 {i+1} 时出错: {e}")
-                continue
-        
-        return file_content
+            # 检查是否使用新的UPDATE格式
+            replacements = None
+            if '&update&' in new_content_str:
+                debug_print("检测到新的UPDATE格式，使用检索替换模式")
+                file_content, replacements = handle_update_content(filename, file_content, new_content_str, file_type)
+            else:
+                debug_print("使用旧的UPDATE格式，直接替换")
+                new_content_parsed = load_content(filename, new_content_str, file_type)
+                file_content = new_content_parsed
+            span.end()
 
-    # --- UPDATE功能增强 ---
-    def handle_update_content(filename, file_content, new_content_str, file_type):
-        """处理更新操作，先检索再替换"""
-        debug_print(f"处理UPDATE操作，文件类型: {file_type}")
-        
-        # 解析传入的内容，使用&update&作为分隔符
-        parts = new_content_str.split('&update&')
-        debug_print(f"解析到 {len(parts)} 个更新部分")
-        
-        if len(parts) != 2:
-            debug_print("UPDATE格式错误，需要: 检索内容&update&新内容")
-            return file_content
+            # 生成更新后的文件内容
+            with tracer.span('serialize') as span:
+                updated_content = render_content(file_content, file_type, raw_content, filename)
+                updated_bytes = encode_content(updated_content, source_encoding, source_bom)
+                span.add(len(updated_bytes))
+            if updated_bytes == byte_content:
+                debug_print("内容未变化，跳过上传")
+                result = {'status': 'success', 'message': f'{filename} 内容未变化，无需上传', 'unchanged': True}
+                updated_bytes = None
+            else:
+                result = {'status': 'success', 'message': f'已成功更新 {filename}'}
+            if replacements is not None:
+                result['replacements'] = replacements
             
-        search_content = parts[0].strip()
-        replace_content = parts[1].strip()
-        
-        debug_print(f"检索内容: {search_content}")
-        debug_print(f"新内容: {replace_content}")
+        except Exception as e:
+            span.end(error=True)
+            debug_print(f"更新文件失败: {e}")
+            return {'error': 'UPDATE_ERROR', 'message': f'更新文件失败: {str(e)}'}, None
+
+    elif operation == 'search':
+        if not content:
+            return {'error': 'MISSING_SEARCH_TERM', 'message': '搜索操作需要搜索词'}, None
         
-        if file_type == 'ini':
-            # INI文件的更新逻辑
-            if isinstance(file_content, configparser.ConfigParser):
-                debug_print("在INI文件中搜索内容")
-                found = False
+        debug_print("执行SEARCH操作")
+        span = tracer.span('operation')
+        try:
+            matches = []
+            search_str = str(content).lower()
+            debug_print(f"搜索词: {search_str}")
+
+            # 已缓存的文件再次被搜索时才建立索引（建索引比一次遍历更慢），之后的搜索直接查索引
+            search_index = None
+            if cache_entry is not None:
+                search_index = cache_entry.index
+                if (search_index is None and
+                        content_cache.count_search(cache_entry) >= FTP_SEARCH_INDEX_MIN_SEARCHES):
+                    search_index = build_search_index(file_type, file_content, raw_content)
+                    content_cache.attach_index(cache_entry, search_index)
+
+            if search_index is not None:
+                # 多取一条，用于判断是否截断
+                matches = search_index.search(search_str, max_matches + 1 if max_matches else None)
+                debug_print(f"从搜索索引找到 {len(matches)} 个匹配")
+
+            elif file_type == 'json':
+                debug_print("在JSON中搜索")
+                def _search_json(data, path=""):
+                    if isinstance(data, dict):
+                        for k, v in data.items():
+                            new_path = f"{path}.{k}" if path else k
+                            if search_str in str(k).lower():
+                                matches.append({
+                                    'type': 'key',
+                                    'path': new_path,
+                                    'key': k,
+                                    'value': v
+                                })
+                            _search_json(v, new_path)
+                    elif isinstance(data, list):
+                        for i, v in enumerate(data):
+                            new_path = f"{path}[{i}]"
+                            _search_json(v, new_path)
+                    elif isinstance(data, (str, int, float, bool)) and search_str in str(data).lower():
+                        matches.append({
+                            'type': 'value',
+                            'path': path,
+                            'value': data
+                        })
                 
-                # 遍历所有section和option
-                for section in file_content.sections():
-                    for option in file_content.options(section):
-                        value = file_content.get(section, option)
-                        
-                        # 如果找到匹配的内容
-                        if search_content in value or search_content == option or search_content == section:
-                            debug_print(f"找到匹配: {section}[{option}] = {value}")
-                            file_content.set(section, option, replace_content)
-                            found = True
-                            debug_print(f"更新为: {replace_content}")
+                _search_json(file_content)
+                debug_print(f"在JSON中找到 {len(matches)} 个匹配")
                 
-                # 检查DEFAULT section
-                if 'DEFAULT' in file_content:
-                    for option in file_content.options('DEFAULT'):
-                        value = file_content.get('DEFAULT', option)
-                        if search_content in value or search_content == option:
-                            debug_print(f"在DEFAULT中找到匹配: {option} = {value}")
-                            file_content.set('DEFAULT', option, replace_content)
-                            found = True
+            elif file_type == 'xml':
+                debug_print("在XML中搜索")
+                def _search_xml(elem, path=""):
+                    current_path = f"{path}/{elem.tag}" if path else elem.tag
+                    
+                    # 搜索元素文本
+                    if elem.text and search_str in elem.text.lower():
+                        matches.append({
+                            'type': 'text',
+                            'path': current_path,
+                            'text': elem.text.strip()
+                        })
+                    
+                    # 搜索属性
+                    for attr_name, attr_value in elem.attrib.items():
+                        if search_str in attr_value.lower():
+                            matches.append({
+                                'type': 'attribute',
+                                'path': f"{current_path}@{attr_name}",
+                                'attribute': attr_name,
+                                'value': attr_value
+                            })
+                        if search_str in attr_name.lower():
+                            matches.append({
+                                'type': 'attribute_name',
+                                'path': f"{current_path}@{attr_name}",
+                                'attribute': attr_name,
+                                'value': attr_value
+                            })
+                    
+                    # 递归搜索子元素
+                    for child in elem:
+                        _search_xml(child, current_path)
+                
+                _search_xml(file_content)
+                debug_print(f"在XML中找到 {len(matches)} 个匹配")
+                
+            elif file_type == 'ini':
+                debug_print("在INI中搜索")
+                if isinstance(file_content, configparser.ConfigParser):
+                    for section in file_content.sections():
+                        if search_str in section.lower():
+                            matches.append({
+                                'type': 'section',
+                                'section': section,
+                                'path': f"[{section}]"
+                            })
+                        for option in file_content.options(section):
+                            value = file_content.get(section, option)
+                            if search_str in option.lower():
+                                matches.append({
+                                    'type': 'option',
+                                    'section': section,
+                                    'option': option,
+                                    'value': value,
+                                    'path': f"[{section}].{option}"
+                                })
+                            if search_str in value.lower():
+                                matches.append({
+                                    'type': 'value',
+                                    'section': section,
+                                    'option': option,
+                                    'value': value,
+                                    'path': f"[{section}].{option}"
+                                })
+                    
+                    # 检查DEFAULT section（options('DEFAULT') 会抛出 NoSectionError）
+                    for option, value in file_content.defaults().items():
+                        if search_str in option.lower() or search_str in value.lower():
+                            matches.append({
+                                'type': 'default',
+                                'option': option,
+                                'value': value,
+                                'path': f"[DEFAULT].{option}"
+                            })
+                debug_print(f"在INI中找到 {len(matches)} 个匹配")
                 
-                if not found:
-                    debug_print(f"未找到匹配 '{search_content}' 的内容")
-                    # 如果没有找到，作为新内容添加到DEFAULT
-                    if not file_content.has_section('DEFAULT'):
-                        file_content.add_section('DEFAULT')
-                    file_content.set('DEFAULT', 'new_' + str(len(file_content.options('DEFAULT')) + 1), replace_content)
-                    debug_print(f"作为新内容添加到DEFAULT")
-            
-        elif file_type == 'json':
-            # JSON文件的更新逻辑
-            debug_print("在JSON文件中搜索内容")
-            json_str = json.dumps(file_content)
-            if search_content in json_str:
-                debug_print(f"在JSON中找到匹配")
-                # 简单替换字符串中的内容
-                updated_str = json_str.replace(search_content, replace_content)
-                try:
-                    file_content = json.loads(updated_str)
-                    debug_print("JSON更新成功")
-                except:
-                    debug_print("JSON解析失败，保持原内容")
-        
-        elif file_type == 'xml':
-            # XML文件的更新逻辑
-            debug_print("在XML文件中搜索内容")
-            xml_str = ET.tostring(file_content, encoding='unicode')
-            if search_content in xml_str:
-                debug_print(f"在XML中找到匹配")
-                # 简单替换字符串中的内容
-                updated_str = xml_str.replace(search_content, replace_content)
-                try:
-                    file_content = ET.fromstring(updated_str)
-                    debug_print("XML更新成功")
-                except:
-                    debug_print("XML解析失败，保持原内容")
-        
-        else:
-            # 文本文件的更新逻辑
-            debug_print("在文本文件中搜索内容")
-            if search_content in file_content:
-                debug_print(f"在文本中找到匹配")
-                file_content = file_content.replace(search_content, replace_content)
-                debug_print("文本更新成功")
             else:
-                debug_print(f"未找到匹配 '{search_content}' 的内容")
-        
-        return file_content
+                # 文本文件搜索
+                debug_print("在文本中搜索")
+                lines = raw_content.split('\n')
+                for i, line in enumerate(lines):
+                    if search_str in line.lower():
+                        matches.append({
+                            'type': 'line',
+                            'line_number': i + 1,
+                            'content': line.strip(),
+                            'start_index': line.lower().find(search_str) + 1
+                        })
+                debug_print(f"在文本中找到 {len(matches)} 个匹配")
+            span.end()
+            
+            result = {
+                'status': 'success',
+                'filename': filename,
+                'search_term': search_str,
+                'matches_found': len(matches),
+                'matches': matches,
+                'file_type': file_type
+            }
+            if max_matches and len(matches) > max_matches:
+                result['matches'] = matches[:max_matches]
+                result['matches_found'] = max_matches
+                result['truncated'] = True
+            
+        except Exception as e:
+            span.end(error=True)
+            debug_print(f"搜索失败: {e}")
+            return {'error': 'SEARCH_ERROR', 'message': f'搜索失败: {str(e)}'}, None
+
+    return result, updated_bytes
+
+
+def filter_listing(files, dirs, search_pattern):
+    """search_files：含 * ? [ 时按通配符匹配（abc* 为前缀），否则按子串"""
+    debug_print(f"搜索文件模式: {search_pattern}")
+    files = [f for f in files if match_name(f, search_pattern)]
+    dirs = [d for d in dirs if match_name(d, search_pattern)]
+    debug_print(f"筛选后: {len(files)} 个文件, {len(dirs)} 个目录")
+    return files, dirs
+
+
+def build_list_result(files, dirs, indexed=False, tree_matches=None, max_matches=None):
+    """list/search_files 的返回值"""
+    result = {
+        'status': 'success',
+        'files': files,
+        'directories': dirs,
+        'total_files': len(files),
+        'total_directories': len(dirs)
+    }
+    if indexed:
+        result['indexed'] = True
+    if tree_matches is not None:
+        if max_matches and len(tree_matches) > max_matches:
+            tree_matches = tree_matches[:max_matches]
+            result['truncated'] = True
+        result['tree_matches'] = tree_matches
+        # 只有当前目录用 MLST 校验过；子目录中的增删要到下次后台爬取才会反映
+        listed = [match['listed_at'] for match in tree_matches if match.get('listed_at')]
+        result['tree_matches_possibly_stale'] = True
+        result['tree_matches_listed_at'] = min(listed) if listed else None
+        result['tree_matches_note'] = '子目录中的匹配来自后台索引，可能滞后于服务器，以各项 listed_at 时的目录状态为准'
+    return result
+
+
+def build_stream_result(filename, search_str, searcher, offset):
+    """流式搜索的返回值"""
+    debug_print(f"流式搜索完成，读取 {searcher.bytes_read} bytes，找到 {len(searcher.matches)} 个匹配")
+    return {
+        'status': 'success',
+        'filename': filename,
+        'search_term': search_str,
+        'matches_found': len(searcher.matches),
+        'matches': searcher.matches,
+        'file_type': 'text',
+        'streamed': True,
+        'encoding': searcher.encoding,
+        'offset': offset,
+        'next_offset': searcher.position,
+        'bytes_read': searcher.bytes_read,
+        'truncated': searcher.truncated
+    }
+
 
+def decode_content(filename, byte_content, key=None):
+    """解码并解析下载的文件内容，返回 (文本, 编码, BOM字节, 文件类型, 解析结果)"""
+    raw_content, source_encoding, source_bom = auto_decode(byte_content, key)
+    with tracer.span('parse') as span:
+        span.add(len(byte_content))
+        file_type = detect_file_type(filename, raw_content)
+        file_content = load_content(filename, raw_content, file_type)
+    debug_print(f"文件类型: {file_type}, 内容加载成功")
+    return raw_content, source_encoding, source_bom, file_type, file_content
+
+
+def load_cached_content(cached, filename, operation):
+    """取内容缓存条目的解析结果：search 复用缓存中的解析结果（首次使用时解析），
+    其余操作交给调用方的对象由文本重新解析，避免外部修改污染缓存（比深拷贝更快）"""
+    if operation == 'search':
+        if cached.parsed is None:
+            with tracer.span('parse'):
+                cached.parsed = load_content(filename, cached.text, cached.file_type)
+        return cached.parsed
+    with tracer.span('parse'):
+        return load_content(filename, cached.text, cached.file_type)
+
+
+def run_ftp_operation(conn, file_path=None, filename=None, content=None, operation=None,
+                      max_matches=None, offset=0):
+    """
+    多功能FTP文件处理工具（优化版）
+    修复bug并扩展功能，支持：XML/JSON/TXT/INI等多种格式，自动处理BOM，完善错误处理
+    
+    新增功能：
+    1. INI格式支持：解析content以&ini&为分隔符，追加至多个栏位
+    2. UPDATE功能增强：先检索再替换，content以&update&作为分隔符
+    3. 执行过程监测：增加debug_print输出
+    4. INI文件强制使用configparser解析
+    
+    参数:
+        conn: 已登录的FTP会话（ftp_pool.PooledFTP）
+        file_path: FTP文件路径
+        filename: 目标文件名
+        content: 要操作的内容
+        operation: 操作类型（append/update/read/search/search_files/delete/list）
+        max_matches: search 最多返回的匹配数，达到后停止（.log/.txt 大文件同时停止下载）
+        offset: .log/.txt 文件 search 的起始字节偏移（REST），可传入上次结果的 next_offset 续搜
+    """
+    
     # --- 新增功能：文件检查 ---
-    def check_file_exists(ftp, filename):
-        """检查文件是否存在"""
+    def check_file_exists(conn, filename):
+        """检查文件是否存在：命中目录缓存时不发命令，否则只发送一条 SIZE/MDTM 探测"""
         try:
-            files = []
-            ftp.retrlines('LIST', lambda x: files.append(x.split()[-1]))
-            exists = filename in files
+            exists = listing_cache.exists(conn, filename)
             debug_print(f"检查文件 {filename} 是否存在: {exists}")
             return exists
         except Exception as e:
@@ -467,9 +1254,9 @@ def process_ftp_file(ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Au
     def get_file_size(ftp, filename):
         """获取文件大小"""
         try:
-            ftp.sendcmd(f"SIZE {filename}")
-            response = ftp.getmultiline().split()[1]
-            size = int(response)
+            # sendcmd 已读取响应；再调用 getmultiline 会一直等到超时，并使复用的会话错位
+            with tracer.span('SIZE'):
+                size = ftp.size(filename) or 0
             debug_print(f"文件 {filename} 大小: {size} bytes")
             return size
         except Exception as e:
@@ -479,389 +1266,215 @@ def process_ftp_file(ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Au
     # --- 主逻辑 ---
     try:
         # 参数验证
-        if not operation:
-            return {'error': 'MISSING_OPERATION', 'message': '请指定操作类型'}
-            
-        valid_operations = ['append', 'update', 'read', 'search', 'list', 'delete', 'search_files']
-        if operation not in valid_operations:
-            return {'error': 'INVALID_OPERATION', 
-                   'message': f'操作类型无效。支持的操作: {", ".join(valid_operations)}'}
+        error = validate_operation(operation)
+        if error:
+            return error
         
         debug_print(f"开始执行 {operation} 操作")
-        debug_print(f"FTP主机: {ftp_host}, 用户: {ftp_user}")
+        debug_print(f"FTP主机: {conn.key[0]}, 用户: {conn.key[1]}")
         debug_print(f"文件路径: {file_path}, 文件名: {filename}")
         
-        # 连接FTP（增加重试机制）
-        ftp = None
-        try:
-            debug_print("正在连接FTP...")
-            ftp = FTP(ftp_host, timeout=30)
-            ftp.login(ftp_user, ftp_pass)
-            ftp.set_pasv(True)  # 使用被动模式
-            debug_print("FTP连接成功")
-        except Exception as e:
-            debug_print(f"FTP连接失败: {e}")
-            return {'error': 'FTP_CONNECTION_FAILED', 'message': f'FTP连接失败: {str(e)}'}
+        ftp = conn.ftp
         
-        # 切换目录（如果指定）
-        if file_path:
-            try:
+        # 切换目录：指定目录或登录目录（复用的连接可能停留在上次的目录）
+        try:
+            if file_path:
                 debug_print(f"切换到目录: {file_path}")
-                ftp.cwd(file_path)
+            conn.chdir(file_path)
+            if file_path:
                 debug_print("目录切换成功")
-            except Exception as e:
-                debug_print(f"目录切换失败: {e}")
-                return {'error': 'DIRECTORY_ERROR', 'message': f'无法切换到目录 {file_path}: {str(e)}'}
+        except Exception as e:
+            debug_print(f"目录切换失败: {e}")
+            return {'error': 'DIRECTORY_ERROR', 'message': f'无法切换到目录 {file_path}: {str(e)}'}
 
         # 处理list操作
         if operation == 'list' or operation == 'search_files':
             try:
                 debug_print("执行LIST操作")
-                files = []
-                dirs = []
-                
-                def parse_list_line(line):
-                    """解析LIST命令的输出"""
-                    parts = line.split()
-                    if len(parts) < 9:
-                        return None
-                    
-                    # 检查是否为目录
-                    is_dir = parts[0].startswith('d')
-                    name = ' '.join(parts[8:])
-                    
-                    if is_dir:
-                        dirs.append(name)
-                    else:
-                        files.append(name)
-                
-                ftp.retrlines('LIST', parse_list_line)
+                # 已被后台索引覆盖且 MLST 修改时间与索引一致的目录直接查询本地索引，不再列目录
+                ftp_index.start()
+                host, user = conn.key[0], conn.key[1]
+                indexed = None
+                if ftp_index.directory_modify(host, user, conn.cwd) is not None:
+                    indexed = ftp_index.list_directory(host, user, conn.cwd,
+                                                       listing_cache.directory_modify(conn, conn.cwd))
+                if indexed is not None:
+                    debug_print("使用目录索引")
+                    files, dirs = indexed
+                else:
+                    files, dirs = listing_cache.list(conn)
                 debug_print(f"找到 {len(files)} 个文件, {len(dirs)} 个目录")
                 
-                # 如果是文件搜索
+                # 如果是文件搜索，按文件名筛选
+                tree_matches = None
                 if operation == 'search_files' and content:
                     search_pattern = str(content).lower()
-                    debug_print(f"搜索文件模式: {search_pattern}")
-                    filtered_files = [f for f in files if search_pattern in f.lower()]
-                    filtered_dirs = [d for d in dirs if search_pattern in d.lower()]
-                    debug_print(f"筛选后: {len(filtered_files)} 个文件, {len(filtered_dirs)} 个目录")
-                    files = filtered_files
-                    dirs = filtered_dirs
+                    files, dirs = filter_listing(files, dirs, search_pattern)
+                    if indexed is not None:
+                        # 索引中还可以查到整棵子树的匹配
+                        tree_matches = ftp_index.search(host, user, conn.cwd, search_pattern)
+                        debug_print(f"索引中子树匹配: {len(tree_matches or [])} 项")
                 
-                return {
-                    'status': 'success',
-                    'files': files,
-                    'directories': dirs,
-                    'total_files': len(files),
-                    'total_directories': len(dirs)
-                }
+                return build_list_result(files, dirs, indexed is not None, tree_matches, max_matches)
             except Exception as e:
                 debug_print(f"LIST操作失败: {e}")
                 return {'error': 'LIST_ERROR', 'message': f'列出文件失败: {str(e)}'}
 
         # 验证filename（除list/search_files操作外都需要）
+        file_stat = None
         if operation not in ['list', 'search_files']:
             if not filename:
                 return {'error': 'MISSING_FILENAME', 'message': '需要指定文件名'}
             
             # 检查文件是否存在（对于读取、追加、搜索、更新操作）
-            if operation in ['read', 'append', 'search', 'update']:
-                if not check_file_exists(ftp, filename):
+            if operation in ['read', 'search'] and content_cache.enabled:
+                # 一次元数据查询同时确认文件存在并取得内容缓存的校验值（SIZE + MDTM）
+                file_stat = listing_cache.stat(conn, filename)
+                debug_print(f"文件 {filename} 元数据: {file_stat}")
+                if file_stat is None:
+                    return {'error': 'FILE_NOT_FOUND', 'message': f'文件 {filename} 不存在'}
+            elif operation in ['read', 'append', 'search', 'update']:
+                if not check_file_exists(conn, filename):
                     return {'error': 'FILE_NOT_FOUND', 'message': f'文件 {filename} 不存在'}
 
         # 处理delete操作
         if operation == 'delete':
             try:
                 debug_print(f"删除文件: {filename}")
-                ftp.delete(filename)
+                with tracer.span('DELE'):
+                    ftp.delete(filename)
+                listing_cache.invalidate(conn)
+                content_cache.invalidate(conn, filename)
+                ftp_index.note_change(conn, filename, deleted=True)
                 debug_print("文件删除成功")
                 return {'status': 'success', 'message': f'文件 {filename} 已删除'}
             except Exception as e:
                 debug_print(f"删除文件失败: {e}")
                 return {'error': 'DELETE_ERROR', 'message': f'删除文件失败: {str(e)}'}
 
+        # 纯文本文件追加：用 APPE 只上传新增内容，不下载、不重传整个文件
+        if operation == 'append' and is_text_file(filename):
+            if not content:
+                return {'error': 'MISSING_CONTENT', 'message': '追加操作需要内容参数'}
+            debug_print("执行APPEND操作（APPE）")
+            try:
+                appended_bytes, encoding = append_text(conn, filename, str(content))
+                listing_cache.invalidate(conn)
+                content_cache.invalidate(conn, filename)
+                ftp_index.note_change(conn, filename)
+                debug_print(f"APPE追加成功，{appended_bytes} bytes，编码: {encoding}")
+                return {
+                    'status': 'success',
+                    'message': f'已成功追加内容到 {filename}',
+                    'appended_bytes': appended_bytes,
+                    'encoding': encoding
+                }
+            except error_perm as e:
+                if not is_unsupported(e):
+                    debug_print(f"追加内容失败: {e}")
+                    return {'error': 'APPEND_ERROR', 'message': f'追加内容失败: {str(e)}'}
+                # 服务器不支持 APPE，改用下载后整体上传
+                debug_print("服务器不支持APPE，改为下载后整体上传")
+            except StreamFallback:
+                # 开头样本看不出文件编码，下载完整文件判定后整体上传
+                debug_print("无法从文件开头确定编码，改为下载后整体上传")
+            except UnicodeEncodeError as e:
+                debug_print(f"追加内容无法用 {e.encoding} 编码: {e}")
+                return {'error': 'ENCODING_ERROR',
+                        'message': f'追加内容包含 {e.encoding} 编码无法表示的字符，为避免文件编码混杂已拒绝追加'}
+            except Exception as e:
+                debug_print(f"追加内容失败: {e}")
+                return {'error': 'APPEND_ERROR', 'message': f'追加内容失败: {str(e)}'}
+
+        # 大日志/文本文件的搜索：流式下载并逐行匹配，不在内存中保留整个文件
+        if operation == 'search' and content and is_streamable(filename):
+            if file_stat and file_stat['size'] is not None:
+                file_size = file_stat['size']
+            else:
+                file_size = get_file_size(ftp, filename)
+            if offset or not file_size or file_size >= FTP_STREAM_MIN_BYTES:
+                search_str = str(content).lower()
+                debug_print(f"流式搜索: {filename}, 大小: {file_size}, 起始偏移: {offset}, 最多匹配: {max_matches}")
+                try:
+                    searcher, stopped = stream_search(conn, filename, search_str, max_matches, int(offset or 0))
+                    return build_stream_result(filename, search_str, searcher, int(offset or 0))
+                except StreamFallback:
+                    # UTF-16 等编码不能按字节切行，改走完整下载（忽略 offset）
+                    debug_print("编码不支持流式搜索，改为完整下载")
+                except Exception as e:
+                    debug_print(f"搜索失败: {e}")
+                    return {'error': 'SEARCH_ERROR', 'message': f'搜索失败: {str(e)}'}
+
         # 对于需要文件内容的操作，下载文件
         byte_content = b""
+        byte_size = 0
         raw_content = ""
+        source_encoding, source_bom = 'utf-8', b''
         file_type = "unknown"
         file_content = None
+        cached = content_cache.get(conn, filename, file_stat) if file_stat else None
+        cache_entry = cached
         
-        if operation in ['read', 'append', 'update', 'search']:
+        if cached is not None:
+            # 文件未变化：跳过下载、解码与解析
+            debug_print(f"文件未变化，使用缓存内容: {filename}")
+            byte_size = cached.byte_size
+            raw_content = cached.text
+            file_type = cached.file_type
+            file_content = load_cached_content(cached, filename, operation)
+
+        elif operation in ['read', 'append', 'update', 'search']:
             try:
                 debug_print(f"下载文件: {filename}")
                 
-                # 获取文件大小
-                file_size = get_file_size(ftp, filename)
+                # 获取文件大小（已取得元数据时不再单独发送 SIZE）
+                if file_stat and file_stat['size'] is not None:
+                    file_size = file_stat['size']
+                else:
+                    file_size = get_file_size(ftp, filename)
                 debug_print(f"文件大小: {file_size} bytes")
                 
                 # 下载文件内容
                 byte_content = BytesIO()
-                ftp.retrbinary(f'RETR {filename}', byte_content.write)
+                with tracer.span('RETR') as span:
+                    ftp.retrbinary(f'RETR {filename}', byte_content.write)
+                    span.add(byte_content.tell())
                 byte_content = byte_content.getvalue()
-                debug_print(f"下载完成，实际大小: {len(byte_content)} bytes")
+                byte_size = len(byte_content)
+                debug_print(f"下载完成，实际大小: {byte_size} bytes")
                 
                 if len(byte_content) != file_size and file_size > 0:
                     debug_print("警告: 文件下载不完整")
                     return {'error': 'DOWNLOAD_ERROR', 'message': '文件下载不完整'}
                     
-                raw_content = auto_decode(byte_content)
-                file_type = detect_file_type(filename, raw_content)
-                file_content = load_content(filename, raw_content, file_type)
-                debug_print(f"文件类型: {file_type}, 内容加载成功")
+                raw_content, source_encoding, source_bom, file_type, file_content = decode_content(
+                    filename, byte_content, conn.path_key(filename))
+                if file_stat:
+                    # read 的解析结果会交给调用方，不放入缓存，下次按需解析
+                    cache_entry = content_cache.put(conn, filename, file_stat, byte_size, raw_content, file_type,
+                                                    file_content if operation == 'search' else None)
                 
             except Exception as e:
                 debug_print(f"下载文件失败: {e}")
                 return {'error': 'DOWNLOAD_ERROR', 'message': f'下载文件失败: {str(e)}'}
 
-        # 执行具体操作
-        result = None
-        
-        if operation == 'read':
-            debug_print("执行READ操作")
-            result = {
-                'status': 'success',
-                'filename': filename,
-                'type': file_type,
-                'size': len(byte_content),
-                'content': file_content,
-                'raw_content': raw_content if file_type == 'text' else None
-            }
-            debug_print(f"读取成功，文件类型: {file_type}")
-
-        elif operation == 'append':
-            if not content:
-                return {'error': 'MISSING_CONTENT', 'message': '追加操作需要内容参数'}
-            
-            debug_print("执行APPEND操作")
+        result, updated_bytes = apply_operation(operation, filename, content, file_type, file_content, raw_content,
+                                                byte_content, byte_size, source_encoding, source_bom,
+                                                max_matches, cache_entry)
+        if updated_bytes is not None:
             try:
-                new_content_str = str(content)
-                debug_print(f"追加内容: {new_content_str[:100]}...")
-                new_content_parsed = load_content(filename, new_content_str, file_type)
-                
-                # 根据文件类型处理追加逻辑
-                if file_type == 'json':
-                    debug_print("处理JSON追加")
-                    if isinstance(file_content, dict) and isinstance(new_content_parsed, dict):
-                        # 合并字典
-                        file_content.update(new_content_parsed)
-                        debug_print("JSON字典合并成功")
-                    elif isinstance(file_content, list):
-                        # 追加到列表
-                        file_content.append(new_content_parsed)
-                        debug_print("JSON列表追加成功")
-                    else:
-                        # 其他情况，转换为字符串追加
-                        file_content = str(file_content) + '\n' + new_content_str
-                        debug_print("JSON转换为字符串追加")
-                        
-                elif file_type == 'xml':
-                    debug_print("处理XML追加")
-                    if isinstance(new_content_parsed, ET.Element):
-                        file_content.append(new_content_parsed)
-                        debug_print("XML元素追加成功")
-                    else:
-                        # 如果是字符串，创建一个新的文本元素
-                        new_elem = ET.Element('addition')
-                        new_elem.text = new_content_str
-                        file_content.append(new_elem)
-                        debug_print("XML字符串追加成功")
-                        
-                elif file_type == 'ini':
-                    debug_print("处理INI追加")
-                    file_content = handle_ini_content(filename, file_content, new_content_str, 'append')
-                    
-                else:
-                    # 文本文件直接追加
-                    debug_print("处理文本追加")
-                    file_content = raw_content + '\n' + new_content_str
-
-                # 上传更新后的内容
-                updated_content = save_content(file_content, file_type, filename)
-                debug_print(f"上传更新内容，大小: {len(updated_content)} 字符")
-                
-                ftp.storbinary(f'STOR {filename}', BytesIO(updated_content.encode('utf-8')))
+                debug_print(f"上传更新内容，大小: {len(updated_bytes)} bytes")
+                with tracer.span('STOR') as span:
+                    span.add(len(updated_bytes))
+                    ftp.storbinary(f'STOR {filename}', BytesIO(updated_bytes))
+                listing_cache.invalidate(conn)
+                content_cache.invalidate(conn, filename)
+                ftp_index.note_change(conn, filename, len(updated_bytes))
                 debug_print("文件上传成功")
-                
-                result = {'status': 'success', 'message': f'已成功追加内容到 {filename}'}
-                
             except Exception as e:
-                debug_print(f"追加内容失败: {e}")
-                return {'error': 'APPEND_ERROR', 'message': f'追加内容失败: {str(e)}'}
-
-        elif operation == 'update':
-            if not content:
-                return {'error': 'MISSING_CONTENT', 'message': '更新操作需要内容参数'}
-            
-            debug_print("执行UPDATE操作")
-            try:
-                new_content_str = str(content)
-                debug_print(f"更新内容: {new_content_str[:100]}...")
-                
-                # 检查是否使用新的UPDATE格式
-                if '&update&' in new_content_str:
-                    debug_print("检测到新的UPDATE格式，使用检索替换模式")
-                    file_content = handle_update_content(filename, file_content, new_content_str, file_type)
-                else:
-                    debug_print("使用旧的UPDATE格式，直接替换")
-                    new_content_parsed = load_content(filename, new_content_str, file_type)
-                    file_content = new_content_parsed
-                
-                # 上传新内容
-                updated_content = save_content(file_content, file_type, filename)
-                debug_print(f"上传更新内容，大小: {len(updated_content)} 字符")
-                
-                ftp.storbinary(f'STOR {filename}', BytesIO(updated_content.encode('utf-8')))
-                debug_print("文件上传成功")
-                
-                result = {'status': 'success', 'message': f'已成功更新 {filename}'}
-                
-            except Exception as e:
-                debug_print(f"更新文件失败: {e}")
-                return {'error': 'UPDATE_ERROR', 'message': f'更新文件失败: {str(e)}'}
-
-        elif operation == 'search':
-            if not content:
-                return {'error': 'MISSING_SEARCH_TERM', 'message': '搜索操作需要搜索词'}
-            
-            debug_print("执行SEARCH操作")
-            try:
-                matches = []
-                search_str = str(content).lower()
-                debug_print(f"搜索词: {search_str}")
-                
-                if file_type == 'json':
-                    debug_print("在JSON中搜索")
-                    def _search_json(data, path=""):
-                        if isinstance(data, dict):
-                            for k, v in data.items():
-                                new_path = f"{path}.{k}" if path else k
-                                if search_str in str(k).lower():
-                                    matches.append({
-                                        'type': 'key',
-                                        'path': new_path,
-                                        'key': k,
-                                        'value': v
-                                    })
-                                _search_json(v, new_path)
-                        elif isinstance(data, list):
-                            for i, v in enumerate(data):
-                                new_path = f"{path}[{i}]"
-                                _search_json(v, new_path)
-                        elif isinstance(data, (str, int, float, bool)) and search_str in str(data).lower():
-                            matches.append({
-                                'type': 'value',
-                                'path': path,
-                                'value': data
-                            })
-                    
-                    _search_json(file_content)
-                    debug_print(f"在JSON中找到 {len(matches)} 个匹配")
-                    
-                elif file_type == 'xml':
-                    debug_print("在XML中搜索")
-                    def _search_xml(elem, path=""):
-                        current_path = f"{path}/{elem.tag}" if path else elem.tag
-                        
-                        # 搜索元素文本
-                        if elem.text and search_str in elem.text.lower():
-                            matches.append({
-                                'type': 'text',
-                                'path': current_path,
-                                'text': elem.text.strip()
-                            })
-                        
-                        # 搜索属性
-                        for attr_name, attr_value in elem.attrib.items():
-                            if search_str in attr_value.lower():
-                                matches.append({
-                                    'type': 'attribute',
-                                    'path': f"{current_path}@{attr_name}",
-                                    'attribute': attr_name,
-                                    'value': attr_value
-                                })
-                            if search_str in attr_name.lower():
-                                matches.append({
-                                    'type': 'attribute_name',
-                                    'path': f"{current_path}@{attr_name}",
-                                    'attribute': attr_name,
-                                    'value': attr_value
-                                })
-                        
-                        # 递归搜索子元素
-                        for child in elem:
-                            _search_xml(child, current_path)
-                    
-                    _search_xml(file_content)
-                    debug_print(f"在XML中找到 {len(matches)} 个匹配")
-                    
-                elif file_type == 'ini':
-                    debug_print("在INI中搜索")
-                    if isinstance(file_content, configparser.ConfigParser):
-                        for section in file_content.sections():
-                            if search_str in section.lower():
-                                matches.append({
-                                    'type': 'section',
-                                    'section': section,
-                                    'path': f"[{section}]"
-                                })
-                            for option in file_content.options(section):
-                                value = file_content.get(section, option)
-                                if search_str in option.lower():
-                                    matches.append({
-                                        'type': 'option',
-                                        'section': section,
-                                        'option': option,
-                                        'value': value,
-                                        'path': f"[{section}].{option}"
-                                    })
-                                if search_str in value.lower():
-                                    matches.append({
-                                        'type': 'value',
-                                        'section': section,
-                                        'option': option,
-                                        'value': value,
-                                        'path': f"[{section}].{option}"
-                                    })
-                        
-                        # 检查DEFAULT section
-                        if 'DEFAULT' in file_content:
-                            for option in file_content.options('DEFAULT'):
-                                value = file_content.get('DEFAULT', option)
-                                if search_str in option.lower() or search_str in value.lower():
-                                    matches.append({
-                                        'type': 'default',
-                                        'option': option,
-                                        'value': value,
-                                        'path': f"[DEFAULT].{option}"
-                                    })
-                    debug_print(f"在INI中找到 {len(matches)} 个匹配")
-                    
-                else:
-                    # 文本文件搜索
-                    debug_print("在文本中搜索")
-                    lines = raw_content.split('\n')
-                    for i, line in enumerate(lines):
-                        if search_str in line.lower():
-                            matches.append({
-                                'type': 'line',
-                                'line_number': i + 1,
-                                'content': line.strip(),
-                                'start_index': line.lower().find(search_str) + 1
-                            })
-                    debug_print(f"在文本中找到 {len(matches)} 个匹配")
-                
-                result = {
-                    'status': 'success',
-                    'filename': filename,
-                    'search_term': search_str,
-                    'matches_found': len(matches),
-                    'matches': matches,
-                    'file_type': file_type
-                }
-                
-            except Exception as e:
-                debug_print(f"搜索失败: {e}")
-                return {'error': 'SEARCH_ERROR', 'message': f'搜索失败: {str(e)}'}
+                error, action = WRITE_ERRORS[operation]
+                debug_print(f"{action}: {e}")
+                return {'error': error, 'message': f'{action}: {str(e)}'}
 
         debug_print("操作执行完成")
         return result or {'status': 'success', 'message': '操作完成'}
@@ -877,19 +1490,6 @@ def process_ftp_file(ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Au
             'detail': error_detail
         }
 
-    finally:
-        if 'ftp' in locals() and ftp:
-            try:
-                debug_print("关闭FTP连接")
-                ftp.quit()
-                debug_print("FTP连接关闭成功")
-            except:
-                try:
-                    ftp.close()
-                    debug_print("FTP连接强制关闭")
-                except:
-                    debug_print("FTP连接关闭失败")
-
 
 # 测试代码
 if __name__ == '__main__':
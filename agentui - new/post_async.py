@@ -0,0 +1,330 @@
+"""
+process_ftp_file 的 asyncio 版本
+
+FTP 控制连接与数据连接都是 asyncio 流（ftp_async），等待服务器时只挂起协程，
+大量并发的工具调用可以在同一个事件循环上交替进行；解码（编码检测）、解析、搜索、生成新内容
+等 CPU 密集的步骤交给线程池。操作、参数与返回值与 process_ftp_file 相同，
+目录缓存、内容缓存、目录索引与计时统计也与同步版本共用。
+
+用法: result = await async_process_ftp_file(ftp_host, ftp_user, ftp_pass, file_path, filename, content, operation)
+"""
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from ftplib import error_perm
+
+from ftp_async import async_ftp_pool
+from ftp_listing import listing_cache, is_unsupported
+from ftp_index import ftp_index
+from content_cache import content_cache
+from ftp_stream import (is_streamable, is_text_file, stream_search_async, append_text_async, StreamFallback,
+                        FTP_STREAM_MIN_BYTES)
+from ftp_trace import tracer
+from post import (validate_operation, apply_operation, decode_content, load_cached_content, filter_listing,
+                  build_list_result, build_stream_result, process_ftp_tree_search, debug_print, _trace_target,
+                  WRITE_ERRORS)
+
+# ========== 异步FTP工具配置 ==========
+# 处理解码、解析与内容操作的线程数
+FTP_ASYNC_CPU_WORKERS = int(os.environ.get("FTP_ASYNC_CPU_WORKERS", str(min(8, os.cpu_count() or 1))))
+# 小于该大小（字节）的文件直接在事件循环中处理，切换到线程池的开销比处理本身还大
+FTP_ASYNC_INLINE_BYTES = int(os.environ.get("FTP_ASYNC_INLINE_BYTES", str(16 * 1024)))
+
+_executor = ThreadPoolExecutor(max_workers=FTP_ASYNC_CPU_WORKERS, thread_name_prefix="ftp-cpu")
+
+
+async def run_in_thread(func, *args, executor=_executor):
+    """在线程池中执行，并带上当前协程的上下文（计时归到所属调用）"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, func, *args))
+
+
+async def offload(nbytes, func, *args):
+    """按处理的数据量决定在事件循环中直接执行还是交给线程池"""
+    if nbytes < FTP_ASYNC_INLINE_BYTES:
+        return func(*args)
+    return await run_in_thread(func, *args)
+
+
+async def async_process_ftp_file(ftp_host="10.12.128.102", ftp_user="PTMS_L6K", ftp_pass="Auks$1234",
+                                 file_path=None, filename=None, content=None, operation=None, use_pool=True,
+                                 max_matches=None, offset=0):
+    """
+    多功能FTP文件处理工具（异步版）
+    参数与返回值同 process_ftp_file；use_pool=True 时使用 async_ftp_pool 复用会话，
+    同一 (主机, 用户) 同时使用的连接数受 FTP_ASYNC_MAX_CONNECTIONS 限制，超出的调用排队等待。
+    """
+    error = validate_operation(operation)
+    if error:
+        return error
+
+    if operation == 'search_tree':
+        # 目录树搜索本身已用多个会话并行，整体交给默认线程池执行，不占用事件循环
+        with tracer.call(operation, file_path) as call:
+            return call.result(await run_in_thread(process_ftp_tree_search, content, file_path, filename,
+                                                   max_matches, ftp_host, ftp_user, ftp_pass, executor=None))
+
+    with tracer.call(operation, _trace_target(file_path, filename)) as call:
+        try:
+            debug_print("获取FTP连接..." if use_pool else "正在连接FTP...")
+            if use_pool:
+                conn = await async_ftp_pool.acquire(ftp_host, ftp_user, ftp_pass)
+            else:
+                conn = await async_ftp_pool.connect(ftp_host, ftp_user, ftp_pass)
+        except Exception as e:
+            debug_print(f"FTP连接失败: {e}")
+            return call.result({'error': 'FTP_CONNECTION_FAILED', 'message': f'FTP连接失败: {str(e)}'})
+
+        result = None
+        try:
+            result = await run_ftp_operation_async(conn, file_path, filename, content, operation,
+                                                   max_matches, offset)
+            return call.result(result)
+        finally:
+            if use_pool:
+                await async_ftp_pool.release(conn, reusable=isinstance(result, dict) and 'error' not in result)
+            else:
+                debug_print("关闭FTP连接")
+                await conn.close()
+
+
+async def run_ftp_operation_async(conn, file_path=None, filename=None, content=None, operation=None,
+                                  max_matches=None, offset=0):
+    """run_ftp_operation 的异步版本，conn 为 ftp_async.AsyncPooledFTP，各步骤与同步版本一一对应"""
+
+    async def check_file_exists(conn, filename):
+        try:
+            exists = await listing_cache.exists_async(conn, filename)
+            debug_print(f"检查文件 {filename} 是否存在: {exists}")
+            return exists
+        except Exception as e:
+            debug_print(f"检查文件存在性时出错: {e}")
+            return False
+
+    async def get_file_size(ftp, filename):
+        try:
+            with tracer.span('SIZE'):
+                size = await ftp.size(filename) or 0
+            debug_print(f"文件 {filename} 大小: {size} bytes")
+            return size
+        except Exception as e:
+            debug_print(f"获取文件大小时出错: {e}")
+            return 0
+
+    try:
+        error = validate_operation(operation)
+        if error:
+            return error
+
+        debug_print(f"开始执行 {operation} 操作")
+        debug_print(f"FTP主机: {conn.key[0]}, 用户: {conn.key[1]}")
+        debug_print(f"文件路径: {file_path}, 文件名: {filename}")
+
+        ftp = conn.ftp
+
+        try:
+            await conn.chdir(file_path)
+        except Exception as e:
+            debug_print(f"目录切换失败: {e}")
+            return {'error': 'DIRECTORY_ERROR', 'message': f'无法切换到目录 {file_path}: {str(e)}'}
+
+        if operation == 'list' or operation == 'search_files':
+            try:
+                # 目录索引是 SQLite 查询，可能与后台爬取争用锁，放到线程池
+                indexed = None
+                host, user = conn.key[0], conn.key[1]
+                if ftp_index.enabled:
+                    ftp_index.start()
+                    # 目录修改时间与索引一致时才使用索引
+                    if await run_in_thread(ftp_index.directory_modify, host, user, conn.cwd) is not None:
+                        indexed = await run_in_thread(ftp_index.list_directory, host, user, conn.cwd,
+                                                      await listing_cache.directory_modify_async(conn, conn.cwd))
+                if indexed is not None:
+                    debug_print("使用目录索引")
+                    files, dirs = indexed
+                else:
+                    files, dirs = await listing_cache.list_async(conn)
+                debug_print(f"找到 {len(files)} 个文件, {len(dirs)} 个目录")
+
+                tree_matches = None
+                if operation == 'search_files' and content:
+                    search_pattern = str(content).lower()
+                    files, dirs = filter_listing(files, dirs, search_pattern)
+                    if indexed is not None:
+                        tree_matches = await run_in_thread(ftp_index.search, host, user, conn.cwd, search_pattern)
+                        debug_print(f"索引中子树匹配: {len(tree_matches or [])} 项")
+
+                return build_list_result(files, dirs, indexed is not None, tree_matches, max_matches)
+            except Exception as e:
+                debug_print(f"LIST操作失败: {e}")
+                return {'error': 'LIST_ERROR', 'message': f'列出文件失败: {str(e)}'}
+
+        if not filename:
+            return {'error': 'MISSING_FILENAME', 'message': '需要指定文件名'}
+
+        file_stat = None
+        if operation in ['read', 'search'] and content_cache.enabled:
+            file_stat = await listing_cache.stat_async(conn, filename)
+            debug_print(f"文件 {filename} 元数据: {file_stat}")
+            if file_stat is None:
+                return {'error': 'FILE_NOT_FOUND', 'message': f'文件 {filename} 不存在'}
+        elif operation in ['read', 'append', 'search', 'update']:
+            if not await check_file_exists(conn, filename):
+                return {'error': 'FILE_NOT_FOUND', 'message': f'文件 {filename} 不存在'}
+
+        if operation == 'delete':
+            try:
+                debug_print(f"删除文件: {filename}")
+                with tracer.span('DELE'):
+                    await ftp.delete(filename)
+                listing_cache.invalidate(conn)
+                content_cache.invalidate(conn, filename)
+                if ftp_index.enabled:
+                    await run_in_thread(ftp_index.note_change, conn, filename, None, True)
+                debug_print("文件删除成功")
+                return {'status': 'success', 'message': f'文件 {filename} 已删除'}
+            except Exception as e:
+                debug_print(f"删除文件失败: {e}")
+                return {'error': 'DELETE_ERROR', 'message': f'删除文件失败: {str(e)}'}
+
+        if operation == 'append' and is_text_file(filename):
+            if not content:
+                return {'error': 'MISSING_CONTENT', 'message': '追加操作需要内容参数'}
+            debug_print("执行APPEND操作（APPE）")
+            try:
+                appended_bytes, encoding = await append_text_async(conn, filename, str(content))
+                listing_cache.invalidate(conn)
+                content_cache.invalidate(conn, filename)
+                if ftp_index.enabled:
+                    await run_in_thread(ftp_index.note_change, conn, filename)
+                debug_print(f"APPE追加成功，{appended_bytes} bytes，编码: {encoding}")
+                return {
+                    'status': 'success',
+                    'message': f'已成功追加内容到 {filename}',
+                    'appended_bytes': appended_bytes,
+                    'encoding': encoding
+                }
+            except error_perm as e:
+                if not is_unsupported(e):
+                    debug_print(f"追加内容失败: {e}")
+                    return {'error': 'APPEND_ERROR', 'message': f'追加内容失败: {str(e)}'}
+                debug_print("服务器不支持APPE，改为下载后整体上传")
+            except StreamFallback:
+                # 开头样本看不出文件编码，下载完整文件判定后整体上传
+                debug_print("无法从文件开头确定编码，改为下载后整体上传")
+            except UnicodeEncodeError as e:
+                debug_print(f"追加内容无法用 {e.encoding} 编码: {e}")
+                return {'error': 'ENCODING_ERROR',
+                        'message': f'追加内容包含 {e.encoding} 编码无法表示的字符，为避免文件编码混杂已拒绝追加'}
+            except Exception as e:
+                debug_print(f"追加内容失败: {e}")
+                return {'error': 'APPEND_ERROR', 'message': f'追加内容失败: {str(e)}'}
+
+        if operation == 'search' and content and is_streamable(filename):
+            if file_stat and file_stat['size'] is not None:
+                file_size = file_stat['size']
+            else:
+                file_size = await get_file_size(ftp, filename)
+            if offset or not file_size or file_size >= FTP_STREAM_MIN_BYTES:
+                search_str = str(content).lower()
+                debug_print(f"流式搜索: {filename}, 大小: {file_size}, 起始偏移: {offset}, 最多匹配: {max_matches}")
+                try:
+                    searcher, _ = await stream_search_async(conn, filename, search_str, max_matches,
+                                                            int(offset or 0))
+                    return build_stream_result(filename, search_str, searcher, int(offset or 0))
+                except StreamFallback:
+                    debug_print("编码不支持流式搜索，改为完整下载")
+                except Exception as e:
+                    debug_print(f"搜索失败: {e}")
+                    return {'error': 'SEARCH_ERROR', 'message': f'搜索失败: {str(e)}'}
+
+        byte_content = b""
+        byte_size = 0
+        raw_content = ""
+        source_encoding, source_bom = 'utf-8', b''
+        file_type = "unknown"
+        file_content = None
+        cached = None
+        if file_stat:
+            # 磁盘层读取文件，放到线程池
+            if content_cache.cache_dir:
+                cached = await run_in_thread(content_cache.get, conn, filename, file_stat)
+            else:
+                cached = content_cache.get(conn, filename, file_stat)
+        cache_entry = cached
+
+        if cached is not None:
+            debug_print(f"文件未变化，使用缓存内容: {filename}")
+            byte_size = cached.byte_size
+            raw_content = cached.text
+            file_type = cached.file_type
+            if operation == 'search' and cached.parsed is not None:
+                file_content = cached.parsed
+            else:
+                file_content = await offload(byte_size, load_cached_content, cached, filename, operation)
+
+        else:
+            try:
+                debug_print(f"下载文件: {filename}")
+                if file_stat and file_stat['size'] is not None:
+                    file_size = file_stat['size']
+                else:
+                    file_size = await get_file_size(ftp, filename)
+
+                chunks = []
+                with tracer.span('RETR') as span:
+                    await ftp.retrbinary(f'RETR {filename}', chunks.append)
+                    byte_content = b''.join(chunks)
+                    span.add(len(byte_content))
+                byte_size = len(byte_content)
+                debug_print(f"下载完成，实际大小: {byte_size} bytes")
+
+                if byte_size != file_size and file_size > 0:
+                    debug_print("警告: 文件下载不完整")
+                    return {'error': 'DOWNLOAD_ERROR', 'message': '文件下载不完整'}
+
+                raw_content, source_encoding, source_bom, file_type, file_content = await offload(
+                    byte_size, decode_content, filename, byte_content, conn.path_key(filename))
+                if file_stat:
+                    put = functools.partial(content_cache.put, conn, filename, file_stat, byte_size, raw_content,
+                                            file_type, file_content if operation == 'search' else None)
+                    cache_entry = await run_in_thread(put) if content_cache.cache_dir else put()
+
+            except Exception as e:
+                debug_print(f"下载文件失败: {e}")
+                return {'error': 'DOWNLOAD_ERROR', 'message': f'下载文件失败: {str(e)}'}
+
+        result, updated_bytes = await offload(byte_size, apply_operation, operation, filename, content, file_type,
+                                              file_content, raw_content, byte_content, byte_size,
+                                              source_encoding, source_bom, max_matches, cache_entry)
+        if updated_bytes is not None:
+            try:
+                debug_print(f"上传更新内容，大小: {len(updated_bytes)} bytes")
+                with tracer.span('STOR') as span:
+                    span.add(len(updated_bytes))
+                    await ftp.storbinary(f'STOR {filename}', updated_bytes)
+                listing_cache.invalidate(conn)
+                content_cache.invalidate(conn, filename)
+                if ftp_index.enabled:
+                    await run_in_thread(ftp_index.note_change, conn, filename, len(updated_bytes))
+                debug_print("文件上传成功")
+            except Exception as e:
+                error, action = WRITE_ERRORS[operation]
+                debug_print(f"{action}: {e}")
+                return {'error': error, 'message': f'{action}: {str(e)}'}
+
+        debug_print("操作执行完成")
+        return result or {'status': 'success', 'message': '操作完成'}
+
+    except Exception as e:
+        import traceback
+        error_detail = traceback.format_exc()
+        debug_print(f"发生未预期错误: {e}")
+        debug_print(f"错误详情: {error_detail}")
+        return {
+            'error': 'UNEXPECTED_ERROR',
+            'message': f'处理过程中发生错误: {str(e)}',
+            'detail': error_detail
+        }
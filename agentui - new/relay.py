@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import select
+import socket
+import asyncio
+from threading import Lock
+
+# ========== SSE转发配置 ==========
+# 连续的 chunk 帧合并后再写出：攒够 N 字节或距第一块超过 M 毫秒即刷新；N 设为 0 关闭合并
+RELAY_COALESCE_BYTES = int(os.environ.get("RELAY_COALESCE_BYTES", "1024"))
+RELAY_COALESCE_MS = int(os.environ.get("RELAY_COALESCE_MS", "50"))
+# 异步模式上游读取与客户端写出之间的缓冲帧数；写满后暂停读取上游（背压）
+RELAY_QUEUE_SIZE = int(os.environ.get("RELAY_QUEUE_SIZE", "64"))
+# 检查客户端是否已断开的间隔（秒）
+RELAY_DISCONNECT_POLL = float(os.environ.get("RELAY_DISCONNECT_POLL", "1"))
+
+_END = object()
+
+
+class StreamCancelled(Exception):
+    """客户端已断开，转发终止"""
+
+
+def socket_disconnected(sock):
+    """非阻塞检查客户端socket是否已被对端关闭"""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        # TLS socket 不支持 MSG_PEEK 等情况：无法判断，按未断开处理
+        return False
+
+
+def sse_event(payload):
+    """序列化为一条SSE data帧"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+class RelayTimer:
+    """同步模式下转发层与上游读取共享的等待时限
+
+    转发层在读取下一帧前写入 timeout（秒，None 表示一直等待）；上游读取在这段时间内没有新数据时产出 None，
+    WSGI 生成器因此能在上游停顿期间按时刷新合并内容、检查客户端是否断开，不需要另起线程
+    """
+
+    def __init__(self):
+        self.timeout = None
+
+
+class ChunkCoalescer:
+    """合并单个流中连续的 chunk 帧；其他类型的帧先刷新已缓冲内容再原样输出"""
+
+    def __init__(self, max_bytes, max_delay, on_flush):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self.parts = []
+        self.size = 0
+        self.deadline = None
+
+    def push(self, payload, now):
+        """加入一帧，返回需要立即写出的帧列表"""
+        if payload.get("type") != "chunk":
+            return self.flush("event") + [payload]
+
+        chunk = payload.get("chunk", "")
+        if not self.parts:
+            self.deadline = now + self.max_delay
+        self.parts.append(chunk)
+        self.size += len(chunk.encode("utf-8"))
+        if self.size >= self.max_bytes:
+            return self.flush("size")
+        return []
+
+    def timeout(self, now):
+        """距离定时刷新的剩余秒数，没有缓冲内容时返回 None"""
+        if not self.parts:
+            return None
+        return max(0.0, self.deadline - now)
+
+    def flush(self, reason):
+        if not self.parts:
+            return []
+        payload = {"type": "chunk", "chunk": "".join(self.parts)}
+        self.parts = []
+        self.size = 0
+        self.deadline = None
+        self.on_flush(reason)
+        return [payload]
+
+
+class SSERelay:
+    """上游事件到客户端SSE帧的转发层：合并小帧、有界缓冲、慢客户端背压
+
+    同步模式在 WSGI 生成器内逐帧读取上游，不占用额外线程；异步模式由泵任务写入有界的 asyncio.Queue。
+    客户端写得慢时（同步模式生成器不被推进、异步模式队列写满）停止读取上游，由TCP窗口把压力传回上游。
+    """
+
+    def __init__(self, max_bytes=RELAY_COALESCE_BYTES, max_delay_ms=RELAY_COALESCE_MS,
+                 queue_size=RELAY_QUEUE_SIZE, disconnect_poll=RELAY_DISCONNECT_POLL):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay_ms / 1000.0
+        self.queue_size = queue_size
+        self.disconnect_poll = disconnect_poll
+
+        self.lock = Lock()
+        self.counters = {
+            "streams": 0,
+            "frames_in": 0,
+            "frames_out": 0,
+            "bytes_out": 0,
+            "flush_size": 0,
+            "flush_time": 0,
+            "flush_event": 0,
+            "backpressure_waits": 0,
+            "max_queue_depth": 0,
+            "disconnects": 0
+        }
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def _count_flush(self, reason):
+        self._count("flush_" + reason)
+
+    def _track_depth(self, depth):
+        with self.lock:
+            if depth > self.counters["max_queue_depth"]:
+                self.counters["max_queue_depth"] = depth
+
+    def _emit(self, payloads):
+        frames = [sse_event(payload) for payload in payloads]
+        with self.lock:
+            self.counters["frames_out"] += len(frames)
+            self.counters["bytes_out"] += sum(len(frame) for frame in frames)
+        return frames
+
+    def _coalescer(self):
+        return ChunkCoalescer(self.max_bytes, self.max_delay, self._count_flush)
+
+    def _wait_timeout(self, coalescer, should_stop):
+        """等待下一帧的超时：合并刷新时间点与断线检查间隔中较早者"""
+        timeout = coalescer.timeout(time.monotonic())
+        if should_stop is not None and (timeout is None or timeout > self.disconnect_poll):
+            return self.disconnect_poll
+        return timeout
+
+    def _cancelled(self):
+        self._count("disconnects")
+        return StreamCancelled("客户端已断开")
+
+    # ---------- 同步模式 ----------
+    def relay(self, events, should_stop=None, timer=None):
+        """消费上游事件（dict）迭代器，产出合并后的SSE帧；上游异常在写出已缓冲内容后重新抛出
+
+        直接在 WSGI 生成器中读取上游，不另起线程：客户端读得慢时生成器不被推进，上游读取随之暂停。
+        timer: 与上游读取共享的 RelayTimer；events 在等待超时后产出 None，到期的合并内容随即刷新
+        should_stop: 可选的断线检查函数，每隔 disconnect_poll 秒调用一次（传入 timer 时上游停顿期间同样检查），
+        返回 True 时抛出 StreamCancelled
+        """
+        self._count("streams")
+        if not self.enabled and should_stop is None:
+            for payload in events:
+                if payload is None:
+                    continue
+                self._count("frames_in")
+                yield from self._emit([payload])
+            return
+
+        coalescer = self._coalescer()
+        next_check = time.monotonic() + self.disconnect_poll
+        cancelled = False
+        if timer is not None:
+            timer.timeout = self._wait_timeout(coalescer, should_stop)
+        try:
+            for payload in events:
+                now = time.monotonic()
+                if payload is None:
+                    # 上游在等待时限内没有新帧：只处理定时刷新与断线检查
+                    payloads = []
+                else:
+                    self._count("frames_in")
+                    payloads = coalescer.push(payload, now)
+                if not payloads and coalescer.timeout(now) == 0:
+                    payloads = coalescer.flush("time")
+                yield from self._emit(payloads)
+                if should_stop is not None and now >= next_check:
+                    next_check = now + self.disconnect_poll
+                    if should_stop():
+                        cancelled = True
+                        break
+                if timer is not None:
+                    timer.timeout = self._wait_timeout(coalescer, should_stop)
+        except Exception:
+            yield from self._emit(coalescer.flush("event"))
+            raise
+        finally:
+            close = getattr(events, "close", None)
+            if close is not None:
+                close()
+        if cancelled:
+            raise self._cancelled()
+        yield from self._emit(coalescer.flush("event"))
+
+    # ---------- 异步模式 ----------
+    async def relay_async(self, events, should_stop=None):
+        """relay 的 asyncio 版本，events 为异步迭代器，should_stop 为协程函数"""
+        self._count("streams")
+        if not self.enabled and should_stop is None:
+            async for payload in events:
+                self._count("frames_in")
+                for frame in self._emit([payload]):
+                    yield frame
+            return
+
+        buffer = asyncio.Queue(self.queue_size)
+        pump = asyncio.create_task(self._pump_async(events, buffer))
+        coalescer = self._coalescer()
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(buffer.get(), self._wait_timeout(coalescer, should_stop))
+                except asyncio.TimeoutError:
+                    if coalescer.timeout(time.monotonic()) == 0:
+                        for frame in self._emit(coalescer.flush("time")):
+                            yield frame
+                    if should_stop is not None and await should_stop():
+                        raise self._cancelled()
+                    continue
+
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    for frame in self._emit(coalescer.flush("event")):
+                        yield frame
+                    raise item
+
+                self._count("frames_in")
+                for frame in self._emit(coalescer.push(item, time.monotonic())):
+                    yield frame
+
+            for frame in self._emit(coalescer.flush("event")):
+                yield frame
+        finally:
+            pump.cancel()
+
+    async def _pump_async(self, events, buffer):
+        try:
+            async for payload in events:
+                await self._put_async(buffer, payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._put_async(buffer, e)
+            return
+        finally:
+            await events.aclose()
+        await self._put_async(buffer, _END)
+
+    async def _put_async(self, buffer, item):
+        try:
+            buffer.put_nowait(item)
+        except asyncio.QueueFull:
+            self._count("backpressure_waits")
+            await buffer.put(item)
+        self._track_depth(buffer.qsize())
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        frames_out = counters["frames_out"]
+        return {
+            **counters,
+            "coalesce_ratio": round(counters["frames_in"] / frames_out, 2) if frames_out else 0.0,
+            "limits": {
+                "coalesce_bytes": self.max_bytes,
+                "coalesce_ms": int(self.max_delay * 1000),
+                "queue_size": self.queue_size
+            }
+        }
+
+
+sse_relay = SSERelay()
@@ -0,0 +1,109 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from singleflight import payload_key
+
+# ========== 无状态问答缓存配置 ==========
+# 开启后，conversationId 为空的请求按规范化请求体缓存上游完整响应，命中时原样重放
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+
+COMPLETE_MARKER = b'"workflow_finished"'
+
+
+class ResponseCache:
+    """上游SSE响应缓存：保存完整的原始行序列，TTL 过期 + LRU 淘汰
+
+    命中时把缓存的行重新交给 handle_upstream_line，前端收到与实时请求相同的
+    start/chunk/complete 事件序列，历史记录也照常按会话保存。
+    """
+
+    def __init__(self, enabled=RESPONSE_CACHE_ENABLED, ttl=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (过期时间, 行元组)
+        self.lock = Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "expired": 0,
+            "evictions": 0
+        }
+
+    def key(self, payload):
+        return payload_key(payload) if self.enabled else None
+
+    def get(self, key):
+        """返回缓存的行元组，未命中或已过期返回 None"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                self.counters["expired"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, lines):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, tuple(lines))
+            self.entries.move_to_end(key)
+            self.counters["stores"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def record(self, key, lines):
+        """透传上游行，完整结束（收到 workflow_finished 且未出错）后写入缓存"""
+        received = []
+        for line in lines:
+            # None 为等待超时的空闲标记，不写入缓存
+            if line is not None:
+                received.append(line)
+            yield line
+        if any(COMPLETE_MARKER in line for line in received if isinstance(line, bytes)):
+            self.put(key, received)
+
+    async def record_async(self, key, lines):
+        """record 的异步版本"""
+        received = []
+        async for line in lines:
+            received.append(line)
+            yield line
+        if any(COMPLETE_MARKER in line for line in received if isinstance(line, bytes)):
+            self.put(key, received)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.entries)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "enabled": self.enabled,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            **counters,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0
+        }
+
+
+async def replay_async(lines):
+    """把缓存的行序列包装为异步迭代器"""
+    for line in lines:
+        yield line
@@ -0,0 +1,180 @@
+import os
+import configparser
+from bisect import bisect_right
+from xml.etree import ElementTree as ET
+
+# ========== 内容搜索索引配置 ==========
+# 对内容缓存中的文件建立搜索索引，重复的 search 直接查索引，不再遍历解析树
+# 索引挂在内容缓存条目上，计入内容缓存容量，随条目按 SIZE + MDTM 失效、随 LRU 淘汰
+FTP_SEARCH_INDEX_ENABLED = os.environ.get("FTP_SEARCH_INDEX_ENABLED", "1") == "1"
+# 同一缓存条目第几次被搜索时建立索引；只搜索一次的文件直接遍历，不建索引
+FTP_SEARCH_INDEX_MIN_SEARCHES = int(os.environ.get("FTP_SEARCH_INDEX_MIN_SEARCHES", "2"))
+# 超过该记录数（JSON键/值、XML文本/属性、INI选项、文本行）的文件不建索引，按原方式遍历
+FTP_SEARCH_INDEX_MAX_RECORDS = int(os.environ.get("FTP_SEARCH_INDEX_MAX_RECORDS", "200000"))
+# 分隔各检索文本；搜索词不含该字符时，命中位置不会跨越两段文本
+_SEPARATOR = '\0'
+# 各类匹配记录的字段；记录以元组保存，命中时才组装成 dict
+_RECORD_FIELDS = {
+    'key': ('type', 'path', 'key', 'value'),
+    'value': ('type', 'path', 'value'),
+    'text': ('type', 'path', 'text'),
+    'attribute': ('type', 'path', 'attribute', 'value'),
+    'attribute_name': ('type', 'path', 'attribute', 'value'),
+    'section': ('type', 'section', 'path'),
+    'option': ('type', 'section', 'option', 'value', 'path'),
+    'ini_value': ('type', 'section', 'option', 'value', 'path'),
+    'default': ('type', 'option', 'value', 'path'),
+    'line': ('type', 'line_number', 'content'),
+}
+
+
+class SearchIndex:
+    """一个文件的内容搜索索引
+
+    records 按原搜索的遍历顺序保存 (小写检索文本元组, 记录字段元组)，任一检索文本包含搜索词即命中。
+    所有检索文本用分隔符拼成一个字符串，查询时用 str.find 在整段文本上定位，
+    再按偏移二分找到所属记录，结果与逐个遍历完全一致。
+    （n-gram 倒排表在 CPython 中建立一次要花遍历解析树的数倍时间，首次搜索得不偿失）
+    """
+
+    def __init__(self, records):
+        self.records = records
+        texts = []
+        owners = []  # 每段检索文本所属的记录序号
+        for number, (record_texts, _) in enumerate(records):
+            for text in record_texts:
+                texts.append(text)
+                owners.append(number)
+        self.owners = owners
+        self.starts = [0]  # 每段检索文本在 corpus 中的起始偏移
+        position = 0
+        for text in texts:
+            position += len(text) + 1
+            self.starts.append(position)
+        self.corpus = _SEPARATOR.join(texts)
+        # 计入内容缓存容量的字符数：检索文本加上记录中保存的原文（与检索文本长度相当）
+        self.chars = 2 * len(self.corpus)
+
+    def _candidates(self, search_str):
+        """按遍历顺序生成包含搜索词的记录序号"""
+        if _SEPARATOR in search_str:
+            for number, (texts, _) in enumerate(self.records):
+                if any(search_str in text for text in texts):
+                    yield number
+            return
+        corpus, starts, owners = self.corpus, self.starts, self.owners
+        last = -1
+        position = corpus.find(search_str)
+        while position >= 0:
+            segment = bisect_right(starts, position) - 1
+            number = owners[segment]
+            if number != last:
+                last = number
+                yield number
+            # 同一段文本只记一次，从下一段继续
+            position = corpus.find(search_str, starts[segment + 1])
+
+    def search(self, search_str, limit=None):
+        """返回与原 search 相同结构的匹配列表；search_str 已转为小写，limit 为最多返回的条数"""
+        matches = []
+        records = self.records
+        for number in self._candidates(search_str):
+            texts, record = records[number]
+            kind = record[0]
+            match = dict(zip(_RECORD_FIELDS[kind], record))
+            if kind == 'line':
+                match['content'] = match['content'].strip()
+                match['start_index'] = texts[0].find(search_str) + 1
+            elif kind == 'ini_value':
+                match['type'] = 'value'
+            matches.append(match)
+            if limit and len(matches) >= limit:
+                break
+        return matches
+
+
+class TooManyRecords(Exception):
+    """记录数超过 FTP_SEARCH_INDEX_MAX_RECORDS"""
+
+
+def _json_records(data, records):
+    def walk(node, path):
+        if len(records) > FTP_SEARCH_INDEX_MAX_RECORDS:
+            raise TooManyRecords()
+        if isinstance(node, dict):
+            for k, v in node.items():
+                new_path = f"{path}.{k}" if path else k
+                records.append(((k.lower(),), ('key', new_path, k, v)))
+                walk(v, new_path)
+        elif isinstance(node, list):
+            for i, v in enumerate(node):
+                walk(v, f"{path}[{i}]")
+        elif isinstance(node, (str, int, float, bool)):
+            records.append(((str(node).lower(),), ('value', path, node)))
+
+    walk(data, "")
+
+
+def _xml_records(root, records):
+    def walk(elem, path):
+        if len(records) > FTP_SEARCH_INDEX_MAX_RECORDS:
+            raise TooManyRecords()
+        current_path = f"{path}/{elem.tag}" if path else elem.tag
+        if elem.text:
+            records.append(((elem.text.lower(),), ('text', current_path, elem.text.strip())))
+        for attr_name, attr_value in elem.attrib.items():
+            attr_path = f"{current_path}@{attr_name}"
+            records.append(((attr_value.lower(),), ('attribute', attr_path, attr_name, attr_value)))
+            records.append(((attr_name.lower(),), ('attribute_name', attr_path, attr_name, attr_value)))
+        for child in elem:
+            walk(child, current_path)
+
+    walk(root, "")
+
+
+def _ini_records(config, records):
+    for section in config.sections():
+        records.append(((section.lower(),), ('section', section, f"[{section}]")))
+        for option in config.options(section):
+            value = config.get(section, option)
+            path = f"[{section}].{option}"
+            records.append(((option.lower(),), ('option', section, option, value, path)))
+            records.append(((value.lower(),), ('ini_value', section, option, value, path)))
+        if len(records) > FTP_SEARCH_INDEX_MAX_RECORDS:
+            raise TooManyRecords()
+    for option, value in config.defaults().items():
+        records.append(((option.lower(), value.lower()), ('default', option, value, f"[DEFAULT].{option}")))
+
+
+def _text_records(text, records):
+    for i, line in enumerate(text.split('\n')):
+        lowered = line.lower()
+        if lowered:
+            records.append(((lowered,), ('line', i + 1, line)))
+    if len(records) > FTP_SEARCH_INDEX_MAX_RECORDS:
+        raise TooManyRecords()
+
+
+def build_search_index(file_type, parsed, raw_content):
+    """按 search 操作的遍历规则为已解析的文件建立索引
+
+    记录数超过上限或解析结果无法遍历时返回 None，调用方改用原来的逐个遍历。
+    """
+    if not FTP_SEARCH_INDEX_ENABLED:
+        return None
+    records = []
+    try:
+        if file_type == 'json':
+            _json_records(parsed, records)
+        elif file_type == 'xml':
+            if not isinstance(parsed, ET.Element):
+                return None
+            _xml_records(parsed, records)
+        elif file_type == 'ini':
+            if isinstance(parsed, configparser.ConfigParser):
+                _ini_records(parsed, records)
+        else:
+            _text_records(raw_content or "", records)
+    except (TooManyRecords, RecursionError, configparser.Error):
+        return None
+    return SearchIndex(records)
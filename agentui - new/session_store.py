@@ -0,0 +1,661 @@
+import os
+import json
+import time
+import sqlite3
+import itertools
+from datetime import datetime
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from threading import Lock, RLock, Condition, Thread, local
+
+# ========== 会话存储配置 ==========
+# 存储后端：memory（进程内，默认）/ sqlite（WAL文件，多进程、多worker共享）
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "sessions.db")
+
+# 分片数、空闲过期时间（秒）、最大会话数（超出按LRU淘汰）、后台清理间隔（秒）
+SESSION_SHARDS = int(os.environ.get("SESSION_SHARDS", "16"))
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", "7200"))
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", "10000"))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", "60"))
+
+# 会话内保留的消息条数
+SESSION_MESSAGE_LIMIT = 100
+
+
+def new_session_data():
+    """新会话的初始数据"""
+    return {
+        "conversationId": "",
+        "lastMessageId": 0,
+        "messages": [],
+        "created_at": datetime.now().isoformat(),
+        "last_activity": datetime.now().isoformat()
+    }
+
+
+class BaseSessionManager:
+    """会话存储接口：会话数据（conversationId、消息历史）与待处理表单
+
+    forms_poll_interval 为 None 表示表单变更可由本进程内回调即时感知；
+    跨进程共享的后端需要等待方按该间隔轮询版本号。
+    """
+
+    forms_poll_interval = None
+
+    def __init__(self):
+        self.form_listeners = []  # 表单变更回调 (session_id, version)，供ASGI模式唤醒协程
+        self.sweeper = None
+
+    # --- 会话 ---
+    def get_or_create_session(self, session_id):
+        raise NotImplementedError
+
+    def update_session(self, session_id, updates):
+        raise NotImplementedError
+
+    def get_sessions(self, session_ids):
+        """批量读取会话，返回 {session_id: session_data}，不存在的会话不返回"""
+        raise NotImplementedError
+
+    def update_sessions(self, updates_by_session):
+        """批量更新会话 {session_id: updates}"""
+        raise NotImplementedError
+
+    def append_message(self, session_id, record):
+        """追加消息记录（HistoryRecord）到会话历史，只保留最近 SESSION_MESSAGE_LIMIT 条"""
+        raise NotImplementedError
+
+    def get_next_message_id(self):
+        raise NotImplementedError
+
+    def clear_sessions(self):
+        raise NotImplementedError
+
+    def session_count(self):
+        raise NotImplementedError
+
+    # --- 表单 ---
+    def add_pending_form(self, session_id, form_data):
+        raise NotImplementedError
+
+    def get_pending_forms(self, session_id):
+        return self.get_forms_snapshot(session_id)[1]
+
+    def remove_form(self, session_id, form_id):
+        raise NotImplementedError
+
+    def clear_all_forms(self, session_id):
+        raise NotImplementedError
+
+    def get_forms_snapshot(self, session_id):
+        """获取表单版本号及表单列表"""
+        raise NotImplementedError
+
+    def wait_forms_changed(self, session_id, since_version, timeout):
+        """阻塞等待表单版本号与 since_version 不同，超时返回当前快照"""
+        raise NotImplementedError
+
+    def add_form_listener(self, listener):
+        """注册表单变更回调（启动阶段调用）"""
+        self.form_listeners = self.form_listeners + [listener]
+
+    def _call_form_listeners(self, session_id, version):
+        for listener in self.form_listeners:
+            listener(session_id, version)
+
+    # --- 清理与统计 ---
+    def sweep_expired(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def start_sweeper(self, interval=SESSION_SWEEP_INTERVAL):
+        """启动后台清理线程"""
+        if self.sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep_expired()
+                except Exception as e:
+                    print(f"❌ 会话清理失败: {e}")
+
+        self.sweeper = Thread(target=run, name="session_sweeper", daemon=True)
+        self.sweeper.start()
+
+
+# ========== 进程内存储 ==========
+class SessionShard:
+    """会话分片：独立的锁、LRU顺序及竞争计数"""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.form_changed = Condition(self.lock)
+        self.entries = OrderedDict()  # session_id -> 最后访问时间（monotonic），按访问顺序排列
+        self.sessions = {}  # session_id -> session_data
+        self.pending_forms = {}  # 存储待处理的表单
+        self.form_versions = {}  # session_id -> 表单版本号，每次变更更新
+        self.acquisitions = 0
+        self.contended = 0
+        self.evictions = 0
+
+    def __enter__(self):
+        # 先尝试非阻塞获取，失败则记为一次竞争
+        if not self.lock.acquire(blocking=False):
+            self.lock.acquire()
+            self.contended += 1
+        self.acquisitions += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+    def touch(self, session_id):
+        """记录访问并移动到LRU尾部（调用方需持有锁）"""
+        self.entries[session_id] = time.monotonic()
+        self.entries.move_to_end(session_id)
+
+    def evict(self, session_id):
+        """移除会话的全部状态（调用方需持有锁）"""
+        self.entries.pop(session_id, None)
+        self.sessions.pop(session_id, None)
+        self.pending_forms.pop(session_id, None)
+        self.form_versions.pop(session_id, None)
+        self.evictions += 1
+
+
+class SessionManager(BaseSessionManager):
+    """进程内会话存储：分片锁 + TTL/LRU 淘汰"""
+
+    def __init__(self, shards=SESSION_SHARDS, ttl=SESSION_TTL_SECONDS, max_entries=SESSION_MAX_ENTRIES):
+        super().__init__()
+        self.shards = [SessionShard() for _ in range(shards)]
+        self.ttl = ttl
+        self.max_entries_per_shard = max(1, max_entries // shards)
+        self.message_ids = itertools.count(1)  # next() 在GIL下是原子操作，无需加锁
+        self.form_version_ids = itertools.count(1)
+
+    def _shard(self, session_id):
+        return self.shards[hash(session_id) % len(self.shards)]
+
+    def _group_by_shard(self, session_ids):
+        groups = {}
+        for session_id in session_ids:
+            shard = self._shard(session_id)
+            groups.setdefault(id(shard), (shard, []))[1].append(session_id)
+        return groups.values()
+
+    def _touch(self, shard, session_id):
+        """记录访问，超出分片容量时淘汰最久未访问的会话（调用方需持有锁）"""
+        shard.touch(session_id)
+        while len(shard.entries) > self.max_entries_per_shard:
+            shard.evict(next(iter(shard.entries)))
+
+    def get_or_create_session(self, session_id):
+        """获取或创建会话"""
+        shard = self._shard(session_id)
+        with shard:
+            self._touch(shard, session_id)
+            if session_id not in shard.sessions:
+                session_data = new_session_data()
+                # 定长队列：超出上限时自动丢弃最旧消息，无需切片拷贝
+                session_data["messages"] = deque(maxlen=SESSION_MESSAGE_LIMIT)
+                shard.sessions[session_id] = session_data
+            else:
+                shard.sessions[session_id]["last_activity"] = datetime.now().isoformat()
+            return shard.sessions[session_id]
+
+    def update_session(self, session_id, updates):
+        """更新会话数据"""
+        self.update_sessions({session_id: updates})
+
+    def get_sessions(self, session_ids):
+        """批量读取会话，每个分片只加锁一次"""
+        result = {}
+        for shard, ids in self._group_by_shard(session_ids):
+            with shard:
+                for session_id in ids:
+                    if session_id in shard.sessions:
+                        result[session_id] = shard.sessions[session_id]
+        return result
+
+    def update_sessions(self, updates_by_session):
+        """批量更新会话，每个分片只加锁一次"""
+        for shard, ids in self._group_by_shard(updates_by_session):
+            with shard:
+                for session_id in ids:
+                    if session_id in shard.sessions:
+                        self._touch(shard, session_id)
+                        shard.sessions[session_id].update(updates_by_session[session_id])
+                        shard.sessions[session_id]["last_activity"] = datetime.now().isoformat()
+
+    def append_message(self, session_id, record):
+        """追加消息记录到会话历史"""
+        shard = self._shard(session_id)
+        with shard:
+            session_data = shard.sessions.get(session_id)
+            if session_data is not None:
+                session_data["messages"].append(record)
+
+    def get_next_message_id(self):
+        """获取下一个消息ID"""
+        return next(self.message_ids)
+
+    def add_pending_form(self, session_id, form_data):
+        """添加待处理表单"""
+        shard = self._shard(session_id)
+        with shard:
+            self._touch(shard, session_id)
+            if session_id not in shard.pending_forms:
+                shard.pending_forms[session_id] = []
+
+            form_id = f"form_{int(time.time())}_{len(shard.pending_forms[session_id])}"
+            form_data['form_id'] = form_id
+            shard.pending_forms[session_id].append(form_data)
+            self._notify_forms_changed(shard, session_id)
+            print(f"✅ 添加表单: {form_id}, 类型: {form_data.get('type')}, 问题: {form_data.get('question', '')[:50]}")
+            return form_id
+
+    def get_pending_forms(self, session_id):
+        """获取所有待处理表单"""
+        shard = self._shard(session_id)
+        with shard:
+            return shard.pending_forms.get(session_id, [])
+
+    def remove_form(self, session_id, form_id):
+        """移除已处理的表单"""
+        shard = self._shard(session_id)
+        with shard:
+            if session_id in shard.pending_forms:
+                original_count = len(shard.pending_forms[session_id])
+                shard.pending_forms[session_id] = [
+                    f for f in shard.pending_forms[session_id]
+                    if f['form_id'] != form_id
+                ]
+                if len(shard.pending_forms[session_id]) < original_count:
+                    self._notify_forms_changed(shard, session_id)
+                    print(f"🗑️ 移除表单: {form_id}")
+
+    def clear_all_forms(self, session_id):
+        """清空所有表单"""
+        shard = self._shard(session_id)
+        with shard:
+            if session_id in shard.pending_forms:
+                count = len(shard.pending_forms[session_id])
+                shard.pending_forms[session_id] = []
+                if count:
+                    self._notify_forms_changed(shard, session_id)
+                print(f"🧹 清空 {count} 个表单")
+                return count
+            return 0
+
+    def clear_sessions(self):
+        """清空所有会话数据（保留表单及其版本号）"""
+        for shard in self.shards:
+            with shard:
+                shard.sessions.clear()
+                # 仍有表单状态的会话保留访问记录，之后照常按TTL清理；其余的一并移除
+                for session_id in list(shard.entries):
+                    if session_id not in shard.pending_forms and session_id not in shard.form_versions:
+                        del shard.entries[session_id]
+
+    def session_count(self):
+        """当前会话数"""
+        return sum(len(shard.sessions) for shard in self.shards)
+
+    def _notify_forms_changed(self, shard, session_id):
+        """表单变更：更新版本号并唤醒等待者（调用方需持有分片锁）"""
+        # 版本号全局递增，会话被淘汰重建后也不会与旧版本号重复
+        version = next(self.form_version_ids)
+        shard.form_versions[session_id] = version
+        shard.form_changed.notify_all()
+        self._call_form_listeners(session_id, version)
+
+    def get_forms_snapshot(self, session_id):
+        """获取表单版本号及表单列表"""
+        shard = self._shard(session_id)
+        with shard:
+            return shard.form_versions.get(session_id, 0), list(shard.pending_forms.get(session_id, []))
+
+    def wait_forms_changed(self, session_id, since_version, timeout):
+        """阻塞等待表单版本号与 since_version 不同，超时返回当前快照"""
+        shard = self._shard(session_id)
+        with shard:
+            shard.form_changed.wait_for(
+                lambda: shard.form_versions.get(session_id, 0) != since_version, timeout
+            )
+            return shard.form_versions.get(session_id, 0), list(shard.pending_forms.get(session_id, []))
+
+    def sweep_expired(self):
+        """清理空闲超过TTL的会话，返回清理数量"""
+        deadline = time.monotonic() - self.ttl
+        removed = 0
+        for shard in self.shards:
+            with shard:
+                # entries 按访问顺序排列，遇到未过期的即可停止
+                while shard.entries:
+                    session_id, last_access = next(iter(shard.entries.items()))
+                    if last_access > deadline:
+                        break
+                    shard.evict(session_id)
+                    removed += 1
+        if removed:
+            print(f"🧹 清理过期会话: {removed} 个")
+        return removed
+
+    def stats(self):
+        """会话存储统计：容量、淘汰数及各分片锁竞争情况"""
+        shards = [{
+            "sessions": len(shard.entries),
+            "acquisitions": shard.acquisitions,
+            "contended": shard.contended,
+            "evictions": shard.evictions
+        } for shard in self.shards]
+        acquisitions = sum(s["acquisitions"] for s in shards)
+        contended = sum(s["contended"] for s in shards)
+        return {
+            "backend": "memory",
+            "shards": len(self.shards),
+            "entries": sum(s["sessions"] for s in shards),
+            "max_entries": self.max_entries_per_shard * len(self.shards),
+            "ttl_seconds": self.ttl,
+            "evictions": sum(s["evictions"] for s in shards),
+            "lock_acquisitions": acquisitions,
+            "lock_contended": contended,
+            "contention_rate": round(contended / acquisitions, 4) if acquisitions else 0.0,
+            "per_shard": shards
+        }
+
+
+# ========== SQLite 共享存储 ==========
+class SqliteSessionManager(BaseSessionManager):
+    """基于 SQLite WAL 的共享会话存储，多个worker进程可同时读写同一个库文件
+
+    每个线程持有独立连接；写操作使用 BEGIN IMMEDIATE 事务，批量接口在单个事务内完成。
+    表单变更在本进程内即时回调，其他进程的变更由等待方按 forms_poll_interval 轮询版本号感知。
+    """
+
+    forms_poll_interval = 0.5
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access);
+        CREATE TABLE IF NOT EXISTS forms (
+            session_id TEXT NOT NULL,
+            form_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (session_id, form_id)
+        );
+        CREATE TABLE IF NOT EXISTS form_versions (
+            session_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL_SECONDS, max_entries=SESSION_MAX_ENTRIES):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local = local()
+        self.lock = Lock()
+        self.counters = {"reads": 0, "writes": 0, "evictions": 0}
+        self._conn().executescript(self.SCHEMA)
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """写事务：BEGIN IMMEDIATE 立即获取写锁，避免并发升级死锁"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes")
+
+    @contextmanager
+    def _read(self):
+        """读事务：保证多条查询读到同一快照"""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+        self._count("reads")
+
+    def _next_counter(self, conn, name):
+        return conn.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1 RETURNING value",
+            (name,)
+        ).fetchone()[0]
+
+    # --- 会话 ---
+    def get_or_create_session(self, session_id):
+        """获取或创建会话（返回副本，修改需通过 update_session / append_message 写回）"""
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                session_data = new_session_data()
+            else:
+                session_data = json.loads(row[0])
+                session_data["last_activity"] = datetime.now().isoformat()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions(session_id, data, last_access) VALUES (?, ?, ?)",
+                (session_id, json.dumps(session_data, ensure_ascii=False), now)
+            )
+        if row is None:
+            self._evict_over_capacity()
+        return session_data
+
+    def update_session(self, session_id, updates):
+        """更新会话数据"""
+        self.update_sessions({session_id: updates})
+
+    def get_sessions(self, session_ids):
+        """批量读取会话，一次查询完成"""
+        session_ids = list(session_ids)
+        if not session_ids:
+            return {}
+        placeholders = ",".join("?" * len(session_ids))
+        with self._read() as conn:
+            rows = conn.execute(
+                f"SELECT session_id, data FROM sessions WHERE session_id IN ({placeholders})",
+                session_ids
+            ).fetchall()
+        return {session_id: json.loads(data) for session_id, data in rows}
+
+    def update_sessions(self, updates_by_session):
+        """批量更新会话，单个事务内完成"""
+        if not updates_by_session:
+            return
+        now = time.time()
+        with self._write() as conn:
+            placeholders = ",".join("?" * len(updates_by_session))
+            rows = conn.execute(
+                f"SELECT session_id, data FROM sessions WHERE session_id IN ({placeholders})",
+                list(updates_by_session)
+            ).fetchall()
+            changed = []
+            for session_id, data in rows:
+                session_data = json.loads(data)
+                session_data.update(updates_by_session[session_id])
+                session_data["last_activity"] = datetime.now().isoformat()
+                changed.append((json.dumps(session_data, ensure_ascii=False), now, session_id))
+            conn.executemany("UPDATE sessions SET data = ?, last_access = ? WHERE session_id = ?", changed)
+
+    def append_message(self, session_id, record):
+        """追加消息记录到会话历史"""
+        with self._write() as conn:
+            row = conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return
+            session_data = json.loads(row[0])
+            session_data["messages"] = (session_data["messages"] + [record.to_dict()])[-SESSION_MESSAGE_LIMIT:]
+            conn.execute("UPDATE sessions SET data = ? WHERE session_id = ?",
+                         (json.dumps(session_data, ensure_ascii=False), session_id))
+
+    def get_next_message_id(self):
+        """获取下一个消息ID（跨进程唯一）"""
+        with self._write() as conn:
+            return self._next_counter(conn, "message_id")
+
+    def clear_sessions(self):
+        """清空所有会话数据（保留表单及其版本号）"""
+        with self._write() as conn:
+            conn.execute("DELETE FROM sessions")
+
+    def session_count(self):
+        """当前会话数"""
+        with self._read() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    # --- 表单 ---
+    def _bump_form_version(self, conn, session_id):
+        version = self._next_counter(conn, "form_version")
+        conn.execute(
+            "INSERT OR REPLACE INTO form_versions(session_id, version, last_access) VALUES (?, ?, ?)",
+            (session_id, version, time.time())
+        )
+        return version
+
+    def add_pending_form(self, session_id, form_data):
+        """添加待处理表单"""
+        with self._write() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM forms WHERE session_id = ?", (session_id,)).fetchone()[0]
+            form_id = f"form_{int(time.time())}_{count}"
+            form_data['form_id'] = form_id
+            conn.execute(
+                "INSERT OR REPLACE INTO forms(session_id, form_id, seq, data) VALUES (?, ?, ?, ?)",
+                (session_id, form_id, self._next_counter(conn, "form_seq"),
+                 json.dumps(form_data, ensure_ascii=False))
+            )
+            version = self._bump_form_version(conn, session_id)
+        self._call_form_listeners(session_id, version)
+        print(f"✅ 添加表单: {form_id}, 类型: {form_data.get('type')}, 问题: {form_data.get('question', '')[:50]}")
+        return form_id
+
+    def remove_form(self, session_id, form_id):
+        """移除已处理的表单"""
+        with self._write() as conn:
+            removed = conn.execute("DELETE FROM forms WHERE session_id = ? AND form_id = ?",
+                                   (session_id, form_id)).rowcount
+            version = self._bump_form_version(conn, session_id) if removed else None
+        if removed:
+            self._call_form_listeners(session_id, version)
+            print(f"🗑️ 移除表单: {form_id}")
+
+    def clear_all_forms(self, session_id):
+        """清空所有表单"""
+        with self._write() as conn:
+            count = conn.execute("DELETE FROM forms WHERE session_id = ?", (session_id,)).rowcount
+            version = self._bump_form_version(conn, session_id) if count else None
+        if count:
+            self._call_form_listeners(session_id, version)
+        print(f"🧹 清空 {count} 个表单")
+        return count
+
+    def get_forms_snapshot(self, session_id):
+        """获取表单版本号及表单列表"""
+        with self._read() as conn:
+            row = conn.execute("SELECT version FROM form_versions WHERE session_id = ?", (session_id,)).fetchone()
+            rows = conn.execute("SELECT data FROM forms WHERE session_id = ? ORDER BY seq", (session_id,)).fetchall()
+        return (row[0] if row else 0), [json.loads(data) for (data,) in rows]
+
+    def _get_form_version(self, session_id):
+        row = self._conn().execute("SELECT version FROM form_versions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+    def wait_forms_changed(self, session_id, since_version, timeout):
+        """按 forms_poll_interval 轮询版本号，变化或超时后返回当前快照"""
+        deadline = time.monotonic() + timeout
+        while self._get_form_version(session_id) == since_version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.forms_poll_interval, remaining))
+        return self.get_forms_snapshot(session_id)
+
+    # --- 清理与统计 ---
+    def _evict_over_capacity(self):
+        """会话数超过上限时淘汰最久未访问的会话"""
+        with self._write() as conn:
+            removed = conn.execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                "SELECT session_id FROM sessions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        self._count("evictions", removed)
+
+    def sweep_expired(self):
+        """清理空闲超过TTL的会话及表单，返回清理的会话数量
+
+        表单随所属会话的最后访问时间过期；会话记录已不存在（被淘汰或清空）的表单按其最后变更时间过期
+        """
+        deadline = time.time() - self.ttl
+        expired_forms = (
+            "SELECT session_id FROM sessions WHERE last_access < :deadline "
+            "UNION SELECT session_id FROM form_versions WHERE last_access < :deadline "
+            "AND session_id NOT IN (SELECT session_id FROM sessions)"
+        )
+        with self._write() as conn:
+            conn.execute(f"DELETE FROM forms WHERE session_id IN ({expired_forms})", {"deadline": deadline})
+            conn.execute(f"DELETE FROM form_versions WHERE session_id IN ({expired_forms})", {"deadline": deadline})
+            removed = conn.execute("DELETE FROM sessions WHERE last_access < ?", (deadline,)).rowcount
+        self._count("evictions", removed)
+        if removed:
+            print(f"🧹 清理过期会话: {removed} 个")
+        return removed
+
+    def stats(self):
+        """会话存储统计"""
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": self.session_count(),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "forms_poll_interval": self.forms_poll_interval,
+            **counters
+        }
+
+
+def create_session_manager(backend=SESSION_BACKEND):
+    """按配置创建会话存储后端"""
+    if backend == "sqlite":
+        print(f"🗄️ 会话存储: SQLite ({SESSION_DB_PATH})")
+        return SqliteSessionManager()
+    return SessionManager()
@@ -0,0 +1,231 @@
+import os
+import json
+import asyncio
+import hashlib
+from threading import Lock, Thread, Condition
+
+# ========== 相同请求合并（single-flight）配置 ==========
+# 开启后，不带会话上下文（conversationId 为空）且内容相同的并发请求共享同一个上游流
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "0") == "1"
+
+
+def payload_key(payload):
+    """根据请求体生成合并键；带会话上下文的请求各自独立，返回 None"""
+    if payload.get("conversationId"):
+        return None
+    normalized = dict(payload, query=" ".join(str(payload.get("query", "")).split()))
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """一次共享的上游请求：保存已收到的所有行，每个订阅者按自己的进度从头读取"""
+
+    def __init__(self, key):
+        self.key = key
+        self.lines = []
+        self.done = False
+        self.error = None
+        self.response = None
+        self.subscribers = 1
+        self.cancelled = False
+        # 线程模式的条件变量；在加入 flights 之前创建，并发加入者拿到的 Flight 总是完整的
+        self.cond = Condition()
+
+
+class BaseSingleFlight:
+    """同步/异步两种实现共用的合并键与统计"""
+
+    def __init__(self, client, enabled=SINGLEFLIGHT_ENABLED):
+        self.client = client
+        self.enabled = enabled
+        self.flights = {}  # key -> Flight（仅进行中的请求）
+        self.lock = Lock()
+        self.counters = {
+            "flights": 0,
+            "followers": 0,
+            "cancelled": 0
+        }
+
+    def key(self, payload):
+        return payload_key(payload) if self.enabled else None
+
+    def _join_existing(self, key):
+        """调用方需持有 self.lock"""
+        flight = self.flights.get(key)
+        if flight is not None:
+            flight.subscribers += 1
+            self.counters["followers"] += 1
+        return flight
+
+    def _new_flight(self, key):
+        """调用方需持有 self.lock"""
+        flight = Flight(key)
+        self.flights[key] = flight
+        self.counters["flights"] += 1
+        return flight
+
+    def _detach(self, flight):
+        """订阅者离开；最后一个订阅者离开且上游未结束时返回 True，表示应取消上游"""
+        with self.lock:
+            flight.subscribers -= 1
+            if flight.subscribers > 0 or flight.done:
+                return False
+            # 不再让新请求加入一个即将被取消的流
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            flight.cancelled = True
+            self.counters["cancelled"] += 1
+            return True
+
+    def _finish(self, flight):
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            active = len(self.flights)
+        requests = counters["flights"] + counters["followers"]
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "active": active,
+            "shared_ratio": round(counters["followers"] / requests, 4) if requests else 0.0
+        }
+
+
+class SingleFlight(BaseSingleFlight):
+    """线程模式：由独立线程读取上游，订阅者在条件变量上等待新行"""
+
+    def join(self, key, payload):
+        """加入或发起一次共享请求，返回 (Flight, 是否为发起者)"""
+        with self.lock:
+            flight = self._join_existing(key)
+            if flight is not None:
+                return flight, False
+            flight = self._new_flight(key)
+        Thread(target=self._run, args=(flight, payload), daemon=True, name="single_flight").start()
+        return flight, True
+
+    def _run(self, flight, payload):
+        response = None
+        try:
+            response = self.client.post_stream(payload)
+            with flight.cond:
+                flight.response = response
+            if flight.cancelled:
+                return
+            response.raise_for_status()
+            for line in self.client.iter_lines(response):
+                with flight.cond:
+                    flight.lines.append(line)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(flight)
+            with flight.cond:
+                flight.done = True
+                # leave() 已取走并取消的响应不再重复处理
+                response = flight.response
+                flight.response = None
+                flight.cond.notify_all()
+            if response is not None:
+                if flight.cancelled:
+                    self.client.cancel(response)
+                else:
+                    response.close()
+
+    def iter_lines(self, flight, timer=None):
+        """从头读取共享流的所有行；上游出错时在读完已收到的行后抛出同一异常
+
+        timer: 可选的 relay.RelayTimer；在 timer.timeout 秒内没有新行时产出 None
+        """
+        index = 0
+        while True:
+            timeout = timer.timeout if timer is not None else None
+            with flight.cond:
+                while index >= len(flight.lines) and not flight.done:
+                    if not flight.cond.wait(timeout):
+                        break
+                lines = flight.lines[index:]
+                done = flight.done
+            if not lines and not done:
+                yield None
+                continue
+            index += len(lines)
+            yield from lines
+            if done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def leave(self, flight):
+        """订阅者结束（完成或断开）；全部订阅者都已离开时取消上游请求"""
+        if self._detach(flight):
+            with flight.cond:
+                response = flight.response
+                flight.response = None
+            if response is not None:
+                # 唤醒阻塞中的读取，_run 随后以取消方式结束
+                self.client.cancel(response)
+
+
+class AsyncSingleFlight(BaseSingleFlight):
+    """asyncio 模式：由后台任务读取上游，订阅者等待事件"""
+
+    def join(self, key, payload):
+        with self.lock:
+            flight = self._join_existing(key)
+            if flight is not None:
+                return flight, False
+            flight = self._new_flight(key)
+            flight.changed = asyncio.Event()
+        flight.task = asyncio.create_task(self._run(flight, payload))
+        return flight, True
+
+    def _notify(self, flight):
+        flight.changed.set()
+        flight.changed = asyncio.Event()
+
+    async def _run(self, flight, payload):
+        response = None
+        try:
+            response = await self.client.post_stream(payload)
+            response.raise_for_status()
+            async for line in self.client.iter_lines(response):
+                flight.lines.append(line)
+                self._notify(flight)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._finish(flight)
+            flight.done = True
+            self._notify(flight)
+            if response is not None:
+                if flight.cancelled:
+                    self.client.cancel(response)
+                else:
+                    response.release()
+
+    async def iter_lines(self, flight):
+        index = 0
+        while True:
+            while index >= len(flight.lines) and not flight.done:
+                await flight.changed.wait()
+            lines = flight.lines[index:]
+            done = flight.done
+            index += len(lines)
+            for line in lines:
+                yield line
+            if done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+
+    def leave(self, flight):
+        if self._detach(flight):
+            flight.task.cancel()
@@ -3,8 +3,10 @@ let currentConversationId = null;
 let isProcessing = false;
 let activeForms = new Map();
 let formsCheckInterval;
+let formsEventSource = null;
 let isStreaming = false;
 let currentStreamDiv = null;
+let currentStreamController = null;  // 用于中止进行中的流式请求
 
 // ====== 工具函数 ======
 function debounce(func, wait) {
@@ -51,40 +53,61 @@ function updateFormCount(count) {
 }
 
 // ====== 表单管理 ======
-async function checkForForms() {
-    try {
-        const response = await fetch('/api/forms');
-        const data = await response.json();
-
-        if (data.status === "success") {
-            // 更新表单计数
-            updateFormCount(data.count);
-
-            // 处理新表单
-            data.forms.forEach(form => {
-                if (!activeForms.has(form.form_id)) {
-                    displayForm(form);
-                    activeForms.set(form.form_id, {
-                        ...form,
-                        selected_text: '',
-                        form_data: {}
-                    });
-                }
+function applyForms(data) {
+    if (data.status !== "success") return;
+
+    // 更新表单计数
+    updateFormCount(data.count);
+
+    // 处理新表单
+    data.forms.forEach(form => {
+        if (!activeForms.has(form.form_id)) {
+            displayForm(form);
+            activeForms.set(form.form_id, {
+                ...form,
+                selected_text: '',
+                form_data: {}
             });
+        }
+    });
 
-            // 清理已不存在的表单
-            const existingFormIds = data.forms.map(f => f.form_id);
-            activeForms.forEach((form, formId) => {
-                if (!existingFormIds.includes(formId)) {
-                    removeForm(formId);
-                }
-            });
+    // 清理已不存在的表单
+    const existingFormIds = data.forms.map(f => f.form_id);
+    activeForms.forEach((form, formId) => {
+        if (!existingFormIds.includes(formId)) {
+            removeForm(formId);
         }
+    });
+}
+
+// 轮询方式（仅在浏览器不支持 EventSource 时使用）
+async function checkForForms() {
+    try {
+        const response = await fetch('/api/forms');
+        applyForms(await response.json());
     } catch (error) {
         console.error('获取表单失败:', error);
     }
 }
 
+// 推送方式：服务端在表单变更时推送完整列表，空闲时不产生请求
+function connectFormsStream() {
+    formsEventSource = new EventSource('/api/forms/stream');
+
+    formsEventSource.onmessage = (event) => {
+        try {
+            applyForms(JSON.parse(event.data));
+        } catch (error) {
+            console.error('解析表单推送失败:', error);
+        }
+    };
+
+    formsEventSource.onerror = () => {
+        // EventSource 会自动重连，并通过 Last-Event-ID 带回已知版本号
+        console.warn('表单推送连接中断，等待自动重连');
+    };
+}
+
 function displayForm(form) {
     const container = document.getElementById('forms-container');
     if (!container) return;
@@ -622,6 +645,7 @@ async function sendMessage(isAutoSend = false, source = '') {
             document.getElementById('agent-output').appendChild(userDiv);
         }
 
+        currentStreamController = new AbortController();
         const response = await fetch('/post', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
@@ -629,7 +653,8 @@ async function sendMessage(isAutoSend = false, source = '') {
                 message: message,
                 conversation_id: currentConversationId,
                 option_value: source
-            })
+            }),
+            signal: currentStreamController.signal
         });
 
         if (!response.ok) {
@@ -734,6 +759,13 @@ async function sendMessage(isAutoSend = false, source = '') {
         showToast('消息发送成功', 'success');
 
     } catch (error) {
+        if (error.name === 'AbortError') {
+            // 用户重置会话时主动中止，服务端随之取消上游请求
+            console.log('流式请求已中止');
+            isStreaming = false;
+            currentStreamDiv = null;
+            return;
+        }
         console.error('发送消息失败:', error);
         updateStatus(`请求失败: ${error.message}`, true);
         showToast(`发送失败: ${error.message}`, 'error');
@@ -746,6 +778,7 @@ async function sendMessage(isAutoSend = false, source = '') {
             }
         }
     } finally {
+        currentStreamController = null;
         sendBtn.classList.remove('loading');
         isProcessing = false;
         updateStatus("准备就绪");
@@ -803,6 +836,10 @@ function setupEventListeners() {
     if (resetBtn) {
         resetBtn.addEventListener('click', () => {
             if (confirm('确定要重置会话吗？这将清除所有历史消息和表单。')) {
+                // 中止进行中的回答，避免上游继续生成
+                if (currentStreamController) {
+                    currentStreamController.abort();
+                }
                 fetch('/reset', { method: 'POST' })
                     .then(response => response.json())
                     .then(data => {
@@ -861,28 +898,32 @@ document.addEventListener('DOMContentLoaded', () => {
     // 启动气泡效果
     createDecorativeBubbles();
 
-    // 启动表单检查轮询（每秒检查一次）
-    formsCheckInterval = setInterval(checkForForms, 1000);
-
-    // 立即检查一次
-    setTimeout(checkForForms, 500);
-
-    // 页面可见性变化
-    document.addEventListener('visibilitychange', () => {
-        if (document.hidden) {
-            console.log('页面隐藏，暂停表单检查');
-            clearInterval(formsCheckInterval);
-        } else {
-            console.log('页面显示，恢复表单检查');
-            if (formsCheckInterval) clearInterval(formsCheckInterval);
-            formsCheckInterval = setInterval(checkForForms, 1000);
-            checkForForms();
-        }
-    });
+    if (window.EventSource) {
+        // 订阅表单推送通道
+        connectFormsStream();
+    } else {
+        // 不支持 EventSource 时退回轮询（每秒检查一次）
+        formsCheckInterval = setInterval(checkForForms, 1000);
+        setTimeout(checkForForms, 500);
+
+        // 页面可见性变化
+        document.addEventListener('visibilitychange', () => {
+            if (document.hidden) {
+                console.log('页面隐藏，暂停表单检查');
+                clearInterval(formsCheckInterval);
+            } else {
+                console.log('页面显示，恢复表单检查');
+                if (formsCheckInterval) clearInterval(formsCheckInterval);
+                formsCheckInterval = setInterval(checkForForms, 1000);
+                checkForForms();
+            }
+        });
+    }
 
     // 页面卸载处理
     window.addEventListener('beforeunload', () => {
         clearInterval(formsCheckInterval);
+        if (formsEventSource) formsEventSource.close();
     });
 
     console.log('✅ 初始化完成');
@@ -0,0 +1,512 @@
+import re
+import copy
+import html
+import json
+import configparser
+from xml.etree import ElementTree as ET
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+
+class PatchUnsupported(Exception):
+    """改动超出可局部修补的范围（删除、重排、类型变化等），需要整体序列化"""
+
+
+def patch_document(raw_text, new_content, file_type):
+    """在原文上只改写发生变化的片段，保留其余字节（缩进、注释、属性顺序、声明等）
+
+    参数:
+        raw_text: 下载并解码后的原文
+        new_content: 修改后的解析结果（dict/list、ET.Element、ConfigParser）
+        file_type: 'json' / 'xml' / 'ini'
+
+    返回修补后的文本；无法局部修补时返回 None，由调用方整体序列化。
+    JSON/INI 的修补结果会重新解析并与 new_content 比对，XML 在扫描时逐段核对被替换的原值。
+    """
+    bom = '\ufeff' if raw_text.startswith('\ufeff') else ''
+    text = raw_text[len(bom):]
+    try:
+        if file_type == 'json' and isinstance(new_content, (dict, list)):
+            patched = patch_json(text, new_content)
+        elif file_type == 'xml' and isinstance(new_content, ET.Element):
+            patched = patch_xml(text, new_content)
+        elif file_type == 'ini' and isinstance(new_content, configparser.ConfigParser):
+            patched = patch_ini(text, new_content)
+        else:
+            return None
+    except PatchUnsupported:
+        return None
+    return bom + patched
+
+
+def apply_edits(text, edits):
+    """edits 为 [(起, 止, 新内容)]；按位置一次拼接，区间重叠时放弃"""
+    parts = []
+    last = 0
+    for start, end, value in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+        if start < last:
+            raise PatchUnsupported()
+        parts.append(text[last:start])
+        parts.append(value)
+        last = end
+    parts.append(text[last:])
+    return text[:0].join(parts)
+
+
+# ========== JSON ==========
+
+_json_decoder = json.JSONDecoder()
+_WS = re.compile(r'[ \t\n\r]*')
+_TARGET = object()  # 路径树中的标记：需要记录该值的位置
+
+
+def _json_diff(old, new, path, changes, inserts):
+    """比较两个 JSON 值，记录需要替换的标量与需要追加的成员"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        old_keys = list(old)
+        new_keys = list(new)
+        if new_keys[:len(old_keys)] != old_keys:
+            raise PatchUnsupported()
+        for key in old_keys:
+            _json_diff(old[key], new[key], path + (key,), changes, inserts)
+        if len(new_keys) > len(old_keys):
+            if not old_keys:
+                raise PatchUnsupported()
+            inserts.append((path, [(key, new[key]) for key in new_keys[len(old_keys):]]))
+    elif isinstance(old, list) and isinstance(new, list):
+        if len(new) < len(old):
+            raise PatchUnsupported()
+        for index, item in enumerate(old):
+            _json_diff(item, new[index], path + (index,), changes, inserts)
+        if len(new) > len(old):
+            if not old:
+                raise PatchUnsupported()
+            inserts.append((path, [(None, item) for item in new[len(old):]]))
+    elif isinstance(old, (dict, list)) or isinstance(new, (dict, list)):
+        raise PatchUnsupported()
+    elif type(old) is not type(new) or old != new:
+        changes.append((path, new))
+
+
+def _json_tree(paths):
+    """把需要定位的路径组织成前缀树"""
+    tree = {}
+    for path in paths:
+        node = tree
+        for part in path:
+            node = node.setdefault(part, {})
+        node[_TARGET] = True
+    return tree
+
+
+def _skip_ws(text, pos):
+    return _WS.match(text, pos).end()
+
+
+def _json_locate(text, pos, node, path, found):
+    """从 pos 处的值开始扫描，只深入 node 中出现的子路径，其余值整体跳过
+
+    found[path] = (值起, 值止, 成员列表)；成员为 (键起, 键止, 值起, 值止)
+    返回值结束位置
+    """
+    if not node:
+        return _json_decoder.raw_decode(text, pos)[1]
+
+    opener = text[pos]
+    if opener not in '{[':
+        end = _json_decoder.raw_decode(text, pos)[1]
+        found[path] = (pos, end, None)
+        return end
+
+    closer = '}' if opener == '{' else ']'
+    members = []
+    index = 0
+    cursor = _skip_ws(text, pos + 1)
+    if text[cursor] != closer:
+        while True:
+            key_start = key_end = cursor
+            if opener == '{':
+                key, key_end = json.decoder.scanstring(text, cursor + 1)
+                cursor = _skip_ws(text, key_end)
+                if text[cursor] != ':':
+                    raise PatchUnsupported()
+                cursor = _skip_ws(text, cursor + 1)
+            else:
+                key = index
+                index += 1
+            child = node.get(key)
+            value_end = _json_locate(text, cursor, child, path + (key,), found)
+            members.append((key_start, key_end, cursor, value_end))
+            cursor = _skip_ws(text, value_end)
+            if text[cursor] == ',':
+                cursor = _skip_ws(text, cursor + 1)
+                continue
+            if text[cursor] != closer:
+                raise PatchUnsupported()
+            break
+    end = cursor + 1
+    if node.get(_TARGET):
+        found[path] = (pos, end, members)
+    return end
+
+
+def _json_members_text(text, container, items, is_object):
+    """按容器现有成员的缩进与分隔符渲染新增成员"""
+    start, end, members = container
+    first = members[0]
+    lead = text[start + 1:first[0]]
+    if len(members) > 1:
+        separator = text[first[3]:members[1][0]]
+    else:
+        separator = ',' + lead
+    key_separator = text[first[1]:first[2]] if is_object else ''
+
+    if '\n' in lead:
+        member_indent = lead.rsplit('\n', 1)[1]
+        closing = text[members[-1][3]:end - 1]
+        closing_indent = closing.rsplit('\n', 1)[1] if '\n' in closing else ''
+        unit = member_indent[len(closing_indent):] if member_indent.startswith(closing_indent) else member_indent
+        options = {'indent': unit or None}
+    else:
+        member_indent = ''
+        options = {'separators': (separator, key_separator if is_object else ': ')}
+
+    parts = []
+    for key, value in items:
+        rendered = json.dumps(value, ensure_ascii=False, **options)
+        if member_indent:
+            rendered = rendered.replace('\n', '\n' + member_indent)
+        if is_object:
+            rendered = json.dumps(key, ensure_ascii=False) + key_separator + rendered
+        parts.append(separator + rendered)
+    return ''.join(parts)
+
+
+def patch_json(text, new_content):
+    old = json.loads(text)
+    changes = []
+    inserts = []
+    _json_diff(old, new_content, (), changes, inserts)
+    if not changes and not inserts:
+        return text
+
+    found = {}
+    start = _skip_ws(text, 0)
+    _json_locate(text, start, _json_tree([path for path, _ in changes + inserts]), (), found)
+
+    edits = []
+    for path, value in changes:
+        value_start, value_end, _ = found[path]
+        edits.append((value_start, value_end, json.dumps(value, ensure_ascii=False)))
+    for path, items in inserts:
+        container = found[path]
+        position = container[2][-1][3]
+        is_object = text[container[0]] == '{'
+        edits.append((position, position, _json_members_text(text, container, items, is_object)))
+
+    patched = apply_edits(text, edits)
+    if json.loads(patched) != new_content:
+        raise PatchUnsupported()
+    return patched
+
+
+# ========== XML ==========
+
+# 从 '<' 之后找到标签结束的 '>'（跳过引号内的内容）
+_TAG_END = re.compile(rb'''(?:[^>"']|"[^"]*"|'[^']*')*>''')
+_TAG_NAME = re.compile(rb'<[^\s/>]+')
+_ATTRIBUTE = re.compile(rb'''([^\s=/<>"']+)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+_ATTRIBUTE_ENTITIES = {'\n': '&#10;', '\r': '&#13;', '\t': '&#09;'}
+
+
+def _xml_name(name):
+    """expat 以 '}' 分隔命名空间，与 ElementTree 一样转换为 {uri}local"""
+    return '{' + name if '}' in name else name
+
+
+def _xml_escape_attribute(value, quote):
+    entities = dict(_ATTRIBUTE_ENTITIES)
+    entities[quote] = '&quot;' if quote == '"' else '&apos;'
+    return escape(value, entities)
+
+
+def _xml_serialize(element):
+    """序列化新增元素（不含其 tail）"""
+    element = copy.copy(element)
+    element.tail = None
+    for node in element.iter():
+        if not isinstance(node.tag, str) or '{' in node.tag or any('{' in key for key in node.attrib):
+            raise PatchUnsupported()
+    return ET.tostring(element, encoding='unicode')
+
+
+class _XmlFrame:
+    """扫描中一个已打开的元素：对应的新元素、已遇到的子元素数量及位置"""
+    __slots__ = ('element', 'children', 'index', 'lt', 'child_end')
+
+    def __init__(self, element, lt):
+        self.element = element
+        self.children = list(element)
+        self.index = -1          # 最近一个已开始的子元素序号
+        self.lt = lt             # 开始标签 '<' 的字节位置
+        self.child_end = None    # 最近一个已结束的子元素之后的位置
+
+
+class _XmlPatcher:
+    """用 expat 顺序扫描原文，同时按文档顺序遍历新的元素树，只记录需要改写的字节区间
+
+    原文中的每段文本在扫描时与新树比较，位置与旧值一并确定，无需另外解析出旧树。
+    """
+
+    def __init__(self, data, new_root):
+        self.data = data
+        self.new_root = new_root
+        self.edits = []
+        self.stack = []
+        self.pending = []  # 上一个标签之后收到的字符数据
+        parser = expat.ParserCreate(encoding='utf-8', namespace_separator='}')
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.pending.append
+        self.parser = parser
+
+    def run(self):
+        self.parser.Parse(self.data, True)
+        return self.edits
+
+    def start_tag_end(self, lt):
+        return _TAG_END.match(self.data, lt + 1).end()
+
+    def flush_text(self, frame, position):
+        """处理 frame 中截至 position 的文本：元素的 text 或上一个子元素的 tail"""
+        old_text = ''.join(self.pending)
+        self.pending.clear()
+        if frame.index < 0:
+            new_text = frame.element.text or ''
+        else:
+            new_text = frame.children[frame.index].tail or ''
+        if old_text == new_text:
+            return
+        start = self.start_tag_end(frame.lt) if frame.index < 0 else frame.child_end
+        # 注释、处理指令、CDATA 不在 ElementTree 的文本中，所在区间不能整体改写
+        if b'<' in self.data[start:position]:
+            raise PatchUnsupported()
+        self.edits.append((start, position, escape(new_text).encode('utf-8')))
+
+    def start(self, name, attrs):
+        position = self.parser.CurrentByteIndex
+        if self.stack:
+            parent = self.stack[-1]
+            self.flush_text(parent, position)
+            parent.index += 1
+            if parent.index >= len(parent.children):
+                # 新树中删除了元素
+                raise PatchUnsupported()
+            element = parent.children[parent.index]
+        else:
+            self.pending.clear()
+            element = self.new_root
+
+        if _xml_name(name) != element.tag:
+            raise PatchUnsupported()
+        if attrs:
+            attrs = {_xml_name(key): value for key, value in attrs.items()}
+        if attrs != element.attrib:
+            self.patch_attributes(position, attrs, element.attrib)
+        self.stack.append(_XmlFrame(element, position))
+
+    def end(self, name):
+        position = self.parser.CurrentByteIndex
+        frame = self.stack.pop()
+        self_closing = self.data[position:position + 2] != b'</'
+        if self_closing:
+            self.pending.clear()
+            if frame.element.text or len(frame.children):
+                raise PatchUnsupported()
+            element_end = self.start_tag_end(frame.lt)
+        else:
+            self.flush_text(frame, position)
+            element_end = self.data.index(b'>', position) + 1
+
+        added = frame.children[frame.index + 1:]
+        if added:
+            if frame.index < 0:
+                raise PatchUnsupported()
+            # 沿用最后一个现有子元素之前的空白作为缩进
+            before_last = frame.children[frame.index - 1].tail if frame.index > 0 else frame.element.text
+            indent = before_last if before_last and not before_last.strip() else ''
+            text = ''.join(indent + _xml_serialize(child) for child in added)
+            self.edits.append((frame.child_end, frame.child_end, text.encode('utf-8')))
+
+        if self.stack:
+            self.stack[-1].child_end = element_end
+
+    def patch_attributes(self, lt, old, new):
+        if set(old) != set(new):
+            raise PatchUnsupported()
+        tag = self.data[lt:self.start_tag_end(lt)]
+        spans = {}
+        for match in _ATTRIBUTE.finditer(tag, _TAG_NAME.match(tag).end()):
+            group = 2 if match.group(2) is not None else 3
+            spans[match.group(1).decode('utf-8')] = (lt + match.start(group), lt + match.end(group),
+                                                     '"' if group == 2 else "'")
+        for key, value in old.items():
+            if new[key] == value:
+                continue
+            if key not in spans:
+                raise PatchUnsupported()
+            start, end, quote = spans[key]
+            # 确认定位到的原值与解析结果一致
+            if html.unescape(self.data[start:end].decode('utf-8')) != value:
+                raise PatchUnsupported()
+            self.edits.append((start, end, _xml_escape_attribute(new[key], quote).encode('utf-8')))
+
+
+def patch_xml(text, new_content):
+    if not text.lstrip().startswith('<'):
+        # 原文被包裹在 <root> 中解析，无法对应原始位置
+        raise PatchUnsupported()
+    data = text.encode('utf-8')
+    edits = _XmlPatcher(data, new_content).run()
+    if not edits:
+        return text
+    return apply_edits(data, edits).decode('utf-8')
+
+
+# ========== INI ==========
+
+_SECTION = configparser.ConfigParser.SECTCRE
+_OPTION = configparser.ConfigParser.OPTCRE
+
+
+class _IniLayout:
+    """逐行记录每个节的范围与每个选项值在原文中的位置（与 ConfigParser 的默认规则一致）"""
+
+    def __init__(self, text):
+        self.text = text
+        self.sections = {}  # 节名 -> {'end': 最后一行结束位置, 'options': {选项: (值起, 值止, 是否多行)}, 'header': 是否有节头}
+        self.separator = ' = '
+        separator_found = False
+        current = self._section('DEFAULT', 0)
+        option = None
+        option_indent = 0
+        offset = 0
+        for line in text.splitlines(keepends=True):
+            line_start = offset
+            offset += len(line)
+            stripped = line.strip()
+            if not stripped or stripped[0] in '#;':
+                continue
+            indent = len(line) - len(line.lstrip())
+            if option is not None and indent > option_indent:
+                # 续行：多行值
+                start, end, _ = current['options'][option]
+                current['options'][option] = (start, end, True)
+                current['end'] = offset
+                continue
+            match = _SECTION.match(stripped)
+            if match:
+                current = self._section(match.group('header'), offset)
+                current['header'] = True
+                option = None
+                continue
+            match = _OPTION.match(stripped)
+            if not match:
+                raise PatchUnsupported()
+            option = match.group('option').rstrip()
+            option_indent = indent
+            base = line_start + indent
+            current['options'][option] = (base + match.start('value'), base + match.end('value'), False)
+            current['end'] = offset
+            if not separator_found and match.group('value'):
+                self.separator = stripped[match.end('option'):match.start('value')]
+                separator_found = True
+
+    def _section(self, name, end):
+        if name in self.sections:
+            if name != 'DEFAULT' or self.sections[name]['header']:
+                # 重复的节名 ConfigParser 默认会报错，这里同样放弃
+                raise PatchUnsupported()
+            self.sections[name]['end'] = end
+            return self.sections[name]
+        section = {'end': end, 'options': {}, 'header': False}
+        self.sections[name] = section
+        return section
+
+
+def _ini_parse(text):
+    """与 post.load_content 相同的解析方式"""
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    try:
+        config.read_string(text)
+    except configparser.MissingSectionHeaderError:
+        config.read_string(f'[DEFAULT]\n{text}')
+    return config
+
+
+def _ini_items(config):
+    return [('DEFAULT', dict(config._defaults))] + [
+        (name, dict(options)) for name, options in config._sections.items()]
+
+
+def _ini_value(value):
+    if value is None or '\n' in str(value):
+        raise PatchUnsupported()
+    return str(value)
+
+
+def patch_ini(text, new_content):
+    old = _ini_parse(text)
+    old_items = _ini_items(old)
+    new_items = _ini_items(new_content)
+    old_names = [name for name, _ in old_items]
+    new_names = [name for name, _ in new_items]
+    if new_names[:len(old_names)] != old_names:
+        raise PatchUnsupported()
+    if old_items == new_items:
+        return text
+
+    layout = _IniLayout(text)
+    separator = layout.separator
+    newline = '\r\n' if '\r\n' in text else '\n'
+    edits = []
+    for (name, old_options), (_, new_options) in zip(old_items, new_items):
+        if list(new_options)[:len(old_options)] != list(old_options):
+            raise PatchUnsupported()
+        section = layout.sections[name]
+        if name == 'DEFAULT' and not section['header'] and not old_options:
+            if len(new_options) > len(old_options):
+                # 原文没有 DEFAULT 内容，在文件开头写入带节头的新增项
+                lines = ''.join(f"{key}{separator}{_ini_value(value)}{newline}"
+                                for key, value in new_options.items())
+                edits.append((0, 0, f"[DEFAULT]{newline}{lines}{newline}"))
+            continue
+        for key, value in old_options.items():
+            if new_options[key] != value:
+                start, end, multiline = section['options'][key]
+                if multiline:
+                    raise PatchUnsupported()
+                edits.append((start, end, _ini_value(new_options[key])))
+        added = list(new_options)[len(old_options):]
+        if added:
+            position = section['end']
+            prefix = newline if position and not text[:position].endswith(('\n', '\r')) else ''
+            lines = ''.join(f"{key}{separator}{_ini_value(new_options[key])}{newline}" for key in added)
+            edits.append((position, position, prefix + lines))
+
+    sections = []
+    for name, options in new_items[len(old_items):]:
+        lines = ''.join(f"{key}{separator}{_ini_value(value)}{newline}" for key, value in options.items())
+        sections.append(f"[{name}]{newline}{lines}")
+    if sections:
+        prefix = newline if text and not text.endswith(('\n', '\r')) else ''
+        if text.strip():
+            prefix += newline
+        edits.append((len(text), len(text), prefix + newline.join(sections)))
+
+    patched = apply_edits(text, edits)
+    if _ini_items(_ini_parse(patched)) != new_items:
+        raise PatchUnsupported()
+    return patched
@@ -0,0 +1,174 @@
+import re
+import json
+
+# 按路径更新需要显式前缀，不带前缀的检索内容一律按值匹配（'./bin'、'/data/logs'、'$HOME' 等都是普通的值）
+JSON_PATH_PREFIX = 'jsonpath:'
+XML_PATH_PREFIX = 'xpath:'
+# JSONPath 子集：$.a.b、$.list[0]、$['key with space']、$.*、$.list[*]
+_JSON_PATH_TOKEN = re.compile(r"""\.([^.\[\]]+)|\[(\d+|\*)\]|\[(['"])(.*?)\3\]""")
+# XPath 末尾的属性步：/config/server/@port
+_XML_ATTRIBUTE_STEP = re.compile(r'^(.*?)/@([^/\[\]@]+)$')
+
+
+def is_json_path(text):
+    return text.startswith(JSON_PATH_PREFIX)
+
+
+def is_xml_path(text):
+    return text.startswith(XML_PATH_PREFIX)
+
+
+def parse_json_path(path):
+    """'$.a.b[0]["c d"]' -> ['a', 'b', 0, 'c d']；'*' 表示该层的全部成员"""
+    if not path.startswith('$'):
+        raise ValueError(f'JSONPath 必须以 $ 开头: {path}')
+    tokens = []
+    position = 1
+    while position < len(path):
+        match = _JSON_PATH_TOKEN.match(path, position)
+        if not match:
+            raise ValueError(f'无法解析的JSONPath: {path}')
+        if match.group(1) is not None:
+            tokens.append(match.group(1))
+        elif match.group(2) is not None:
+            tokens.append('*' if match.group(2) == '*' else int(match.group(2)))
+        else:
+            tokens.append(match.group(4))
+        position = match.end()
+    return tokens
+
+
+def coerce_value(old, text):
+    """替换值的类型跟随原值：原值是字符串时保持字符串，否则按 JSON 解析（数字、布尔、null、对象）"""
+    if isinstance(old, str):
+        return text
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _json_children(node, token):
+    if token == '*':
+        if isinstance(node, dict):
+            return list(node.values())
+        return list(node) if isinstance(node, list) else []
+    if isinstance(node, dict) and isinstance(token, str):
+        return [node[token]] if token in node else []
+    if isinstance(node, list) and isinstance(token, int) and -len(node) <= token < len(node):
+        return [node[token]]
+    return []
+
+
+def _json_set(node, token, text):
+    """在容器 node 上设置 token 指向的已有成员，返回设置的个数；不存在的键不会新增"""
+    if token == '*':
+        keys = list(node) if isinstance(node, dict) else range(len(node)) if isinstance(node, list) else ()
+    elif isinstance(node, dict) and isinstance(token, str):
+        keys = [token] if token in node else ()
+    elif isinstance(node, list) and isinstance(token, int) and -len(node) <= token < len(node):
+        keys = [token]
+    else:
+        keys = ()
+    count = 0
+    for key in keys:
+        node[key] = coerce_value(node[key], text)
+        count += 1
+    return count
+
+
+def update_json(data, search, replace):
+    """更新 JSON 数据，返回 (新数据, 替换次数)
+
+    search 为 'jsonpath:$.a.b' 时按路径定位并整体设置已有的目标值，路径不存在时替换 0 次；否则遍历一次，
+    把字符串值中出现的 search 替换为 replace，与 search 完全相同的数字/布尔/null 值整体替换。
+    对象的键不参与匹配。
+    """
+    holder = [data]
+    if is_json_path(search):
+        tokens = parse_json_path(search[len(JSON_PATH_PREFIX):].strip())
+        if not tokens:
+            return coerce_value(data, replace), 1
+        nodes = [data]
+        for token in tokens[:-1]:
+            nodes = [child for node in nodes for child in _json_children(node, token)]
+        count = sum(_json_set(node, tokens[-1], replace) for node in nodes)
+        return data, count
+
+    # 只有检索内容本身是数字/布尔/null 时才比较非字符串值
+    try:
+        scalar = json.loads(search)
+        match_scalars = not isinstance(scalar, (str, dict, list))
+    except ValueError:
+        scalar, match_scalars = None, False
+    scalar_type = type(scalar)
+
+    count = 0
+    replacement = None  # 非字符串值的替换结果，首次使用时解析
+    stack = [holder]
+    while stack:
+        node = stack.pop()
+        items = node.items() if type(node) is dict else enumerate(node)
+        for key, value in items:
+            value_type = type(value)
+            if value_type is str:
+                if search in value:
+                    count += value.count(search)
+                    node[key] = value.replace(search, replace)
+            elif value_type is dict or value_type is list:
+                stack.append(value)
+            elif match_scalars and value_type is scalar_type and value == scalar:
+                if replacement is None:
+                    replacement = (coerce_value(value, replace),)
+                node[key] = replacement[0]
+                count += 1
+    return holder[0], count
+
+
+def find_xml_targets(root, path):
+    """按 XPath（ElementTree 支持的子集）查找元素；支持以根元素开头的绝对路径与 //"""
+    if path.startswith('//'):
+        return ([root] if root.tag == path[2:] else []) + root.findall('.' + path)
+    if path.startswith('/'):
+        first, separator, rest = path[1:].partition('/')
+        if first != root.tag:
+            return []
+        return root.findall('./' + rest) if separator else [root]
+    return root.findall(path)
+
+
+def update_xml(root, search, replace):
+    """更新 XML 元素树（原地修改），返回替换次数
+
+    search 为 'xpath:/config/server' 时按 XPath 定位：以 /@属性名 结尾时设置已有的属性，否则设置元素文本，
+    找不到目标时替换 0 次；否则遍历一次，替换元素文本、tail 与属性值中出现的 search。标签名与属性名不参与匹配。
+    """
+    if is_xml_path(search):
+        search = search[len(XML_PATH_PREFIX):].strip()
+        match = _XML_ATTRIBUTE_STEP.match(search)
+        path, attribute = (match.group(1) or '.', match.group(2)) if match else (search, None)
+        targets = find_xml_targets(root, path)
+        if attribute:
+            targets = [element for element in targets if attribute in element.attrib]
+        for element in targets:
+            if attribute:
+                element.set(attribute, replace)
+            else:
+                element.text = replace
+        return len(targets)
+
+    count = 0
+    for element in root.iter():
+        text = element.text
+        if text and search in text:
+            count += text.count(search)
+            element.text = text.replace(search, replace)
+        tail = element.tail
+        if tail and search in tail and element is not root:
+            count += tail.count(search)
+            element.tail = tail.replace(search, replace)
+        for key, value in element.attrib.items():
+            if search in value:
+                count += value.count(search)
+                element.attrib[key] = value.replace(search, replace)
+    return count
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 各模块按脚本方式互相导入（from ftp_pool import ...），测试时把模块所在目录加入搜索路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+import codecs
+
+import pytest
+
+from ftp_stream import encode_appended, StreamFallback
+from text_encoding import encoding_detector
+
+ASCII_HEAD = b"2024-01-01 start log line\n" * 10
+
+
+def test_ascii_head_without_cached_encoding_falls_back():
+    # 开头全是 ASCII 的 GBK 日志：样本看不出编码，不能按 UTF-8 追加
+    with pytest.raises(StreamFallback):
+        encode_appended(ASCII_HEAD, "温度=30", key="/logs/no-cache.log")
+
+
+def test_ascii_head_uses_cached_full_file_encoding():
+    key = "/logs/gbk.log"
+    full = ASCII_HEAD + "温度=25\n".encode("gbk")
+    encoding_detector.decode_detail(full, key)
+    data, encoding = encode_appended(ASCII_HEAD, "温度=30", key=key)
+    assert codecs.lookup(encoding).name in ("gbk", "gb18030")
+    assert data == "\n温度=30".encode("gbk")
+
+
+def test_complete_ascii_file_appends_utf8():
+    data, encoding = encode_appended(ASCII_HEAD, "温度=30", key="/logs/small.log", complete=True)
+    assert (data, encoding) == ("\n温度=30".encode("utf-8"), "utf-8")
+
+
+def test_ascii_text_needs_no_encoding():
+    data, encoding = encode_appended(ASCII_HEAD, "temp=30", key="/logs/ascii.log")
+    assert data == b"\ntemp=30"
+
+
+def test_crlf_and_bom_are_kept():
+    head = codecs.BOM_UTF8 + "名称=测试\r\n".encode("utf-8")
+    data, encoding = encode_appended(head, "a\nb", key="/logs/bom.log")
+    assert (data, encoding) == ("\r\na\r\nb".encode("utf-8"), "utf-8")
+
+
+def test_unrecognised_head_falls_back():
+    head = "Café résumé naïve à la carte déjà vu, élève, forêt, garçon\n".encode("latin-1") * 30
+    with pytest.raises(StreamFallback):
+        encode_appended(head, "x", key="/logs/latin1.log")
+
+
+def test_unrepresentable_text_is_refused():
+    head = "ログ開始 温度を測定しました。システムは正常に動作しています。\n".encode("shift_jis") * 20
+    assert encode_appended(head, "温度=30", key="/logs/sjis.log")[0] == "\n温度=30".encode("cp932")
+    # 不再把无法表示的字符替换为 '?'
+    with pytest.raises(UnicodeEncodeError):
+        encode_appended(head, "价格 €5", key="/logs/sjis.log")
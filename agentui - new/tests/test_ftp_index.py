@@ -0,0 +1,25 @@
+from ftp_index import FTPIndex
+from post import build_list_result
+
+
+def entry(name, kind='file'):
+    return {'name': name, 'type': kind, 'size': 1 if kind == 'file' else None, 'modify': '20240101000000'}
+
+
+def test_tree_matches_carry_listed_at(tmp_path):
+    index = FTPIndex(path=str(tmp_path / 'idx.db'), roots='')
+    index._store_directory('h', 'u', '/tree', [entry('a.ini'), entry('sub', 'dir')], '20240101000000')
+    index._store_directory('h', 'u', '/tree/sub', [entry('a_sub.ini')], '20240101000000')
+
+    matches = index.search('h', 'u', '/tree', 'a*')
+    assert [match['path'] for match in matches] == ['a.ini', 'sub/a_sub.ini']
+    assert all(match['listed_at'] for match in matches)
+
+    result = build_list_result(['a.ini'], ['sub'], True, matches)
+    assert result['tree_matches_possibly_stale'] is True
+    assert result['tree_matches_listed_at'] == min(match['listed_at'] for match in matches)
+
+
+def test_list_without_tree_search_is_not_labelled():
+    result = build_list_result(['a.ini'], [], True)
+    assert 'tree_matches_possibly_stale' not in result
@@ -0,0 +1,78 @@
+import pytest
+
+from ftp_stream import LineSearcher, StreamStop
+
+
+def make_log(lines=3000):
+    rows = []
+    for i in range(lines):
+        level = 'ERROR' if i % 97 == 0 else 'INFO'
+        rows.append(f"2024-01-01 00:00:{i % 60:02d} {level} 模块{i % 7} message number {i}")
+    return '\n'.join(rows) + '\n'
+
+
+def reference(data, encoding, search_str, offset=0):
+    """整体解码后逐行搜索，附上每行在文件中的字节偏移"""
+    matches = []
+    position = offset
+    for number, raw_line in enumerate(data[offset:].split(b'\n'), 1):
+        line = raw_line.decode(encoding)
+        index = line.lower().find(search_str)
+        if index >= 0 and position < len(data):
+            matches.append({'type': 'line', 'line_number': number, 'content': line.strip(),
+                            'start_index': index + 1, 'byte_offset': position})
+        position += len(raw_line) + 1
+    return matches
+
+
+def run(data, search_str, chunk_size, **kwargs):
+    searcher = LineSearcher(search_str, **kwargs)
+    try:
+        for start in range(0, len(data), chunk_size):
+            searcher.feed(data[start:start + chunk_size])
+        searcher.finish()
+    except StreamStop:
+        pass
+    return searcher
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'gb18030'])
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000, 65536, 1 << 20])
+def test_matches_across_chunk_boundaries(encoding, chunk_size):
+    data = make_log(600 if chunk_size == 1 else 3000).encode(encoding)
+    searcher = run(data, 'error', chunk_size)
+    expected = reference(data, encoding, 'error')
+    assert searcher.matches == expected
+    assert searcher.position == len(data)
+    for match in searcher.matches:
+        line = match['content'].encode(encoding)
+        assert data[match['byte_offset']:match['byte_offset'] + len(line)] == line
+
+
+def test_rest_offset_continues_from_byte_offset():
+    data = make_log().encode('utf-8')
+    first = run(data, 'error', 4096, max_matches=5)
+    assert first.truncated
+    assert len(first.matches) == 5
+
+    # 从第5个匹配的下一行开始续搜，行号相对于续搜的起点
+    last = first.matches[-1]
+    offset = data.index(b'\n', last['byte_offset']) + 1
+    second = run(data[offset:], 'error', 4096, offset=offset)
+    expected = reference(data, 'utf-8', 'error', offset)
+    assert second.matches == expected
+    assert second.matches[0]['byte_offset'] == offset + data[offset:].index(b'2024-01-01 00:00:05 ERROR')
+    full = reference(data, 'utf-8', 'error')
+    assert [m['byte_offset'] for m in first.matches + second.matches] == [m['byte_offset'] for m in full]
+
+
+def test_utf8_bom_is_skipped_in_offsets():
+    data = b'\xef\xbb\xbf' + 'first\nsecond error\n'.encode('utf-8')
+    searcher = run(data, 'error', 3)
+    assert searcher.matches == [{'type': 'line', 'line_number': 2, 'content': 'second error',
+                                 'start_index': 8, 'byte_offset': 9}]
+
+
+def test_last_line_without_newline():
+    searcher = run(b'a\nb error', 'error', 1)
+    assert [(m['line_number'], m['byte_offset']) for m in searcher.matches] == [(2, 2)]
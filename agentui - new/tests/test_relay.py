@@ -0,0 +1,210 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from relay import SSERelay, RelayTimer, StreamCancelled, socket_disconnected
+from upstream import UpstreamClient
+
+
+def sse_line(event, **data):
+    return ("data:" + json.dumps({"event": event, **data}) + "\n\n").encode("utf-8")
+
+
+def chunk_line(text):
+    return sse_line("stream_chunk", data={"chunk": text})
+
+
+class StallingUpstream:
+    """最小的分块SSE上游：按脚本依次发送数据或停顿"""
+
+    def __init__(self, script, header_delay=0, keep_alive=True):
+        self.script = script
+        self.header_delay = header_delay
+        self.keep_alive = keep_alive
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/run"
+
+    @staticmethod
+    def recv_until_closed(conn, timeout):
+        """最多等待 timeout 秒，客户端关闭连接时返回 True"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            conn.settimeout(remaining)
+            try:
+                if not conn.recv(65536):
+                    return True
+            except socket.timeout:
+                return False
+
+    def serve(self):
+        conn, _ = self.server.accept()
+        with conn:
+            request = b""
+            while b"\r\n\r\n" not in request:
+                request += conn.recv(65536)
+            head, _, body = request.partition(b"\r\n\r\n")
+            length = int([line.split(b":")[1] for line in head.split(b"\r\n")
+                          if line.lower().startswith(b"content-length")][0])
+            while len(body) < length:
+                body += conn.recv(65536)
+            time.sleep(self.header_delay)
+            try:
+                conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                             + (b"" if self.keep_alive else b"Connection: close\r\n")
+                             + b"Transfer-Encoding: chunked\r\n\r\n")
+                for step in self.script:
+                    if isinstance(step, (int, float)):
+                        # 停顿期间客户端断开则立即结束
+                        if self.recv_until_closed(conn, step):
+                            break
+                    else:
+                        conn.sendall(b"%x\r\n%s\r\n" % (len(step), step))
+                else:
+                    conn.sendall(b"0\r\n\r\n")
+                    self.recv_until_closed(conn, 5)
+            except OSError:
+                pass
+        self.closed.set()
+        self.server.close()
+
+
+def to_events(lines):
+    for line in lines:
+        if line is None:
+            yield None
+            continue
+        if line.startswith(b"data:"):
+            data = json.loads(line[5:])
+            if data["event"] == "stream_chunk":
+                yield {"type": "chunk", "chunk": data["data"]["chunk"]}
+            elif data["event"] == "workflow_finished":
+                yield {"type": "complete"}
+
+
+def open_stream(upstream, client):
+    response = client.post_stream({"query": "x"}, url=upstream.url)
+    response.raise_for_status()
+    return response
+
+
+def test_coalesced_text_is_flushed_while_upstream_stalls():
+    upstream = StallingUpstream([chunk_line("你好"), 1.0, sse_line("workflow_finished")])
+    client = UpstreamClient(idle_timeout=5)
+    relay = SSERelay(max_bytes=1024, max_delay_ms=50)
+    timer = RelayTimer()
+    response = open_stream(upstream, client)
+    started = time.monotonic()
+    received = []
+    try:
+        for frame in relay.relay(to_events(client.iter_lines(response, timer)), timer=timer):
+            received.append((time.monotonic() - started, json.loads(frame[6:])))
+    finally:
+        response.close()
+
+    assert [payload for _, payload in received] == [{"type": "chunk", "chunk": "你好"}, {"type": "complete"}]
+    # 合并内容在 max_delay 后写出，而不是等到停顿结束后的下一帧
+    assert received[0][0] < 0.5
+    assert received[1][0] > 0.8
+    assert relay.stats()["flush_time"] == 1
+
+
+def test_timed_iter_lines_matches_requests_splitting():
+    payload = b"".join(chunk_line(f"片段{i}") for i in range(50)) + sse_line("workflow_finished")
+    # 按 7 字节分块发送，行在任意位置被截断
+    upstream = StallingUpstream([payload[i:i + 7] for i in range(0, len(payload), 7)])
+    client = UpstreamClient(idle_timeout=5)
+    timer = RelayTimer()
+    timer.timeout = 0.01
+    response = open_stream(upstream, client)
+    try:
+        lines = [line for line in client.iter_lines(response, timer) if line is not None]
+    finally:
+        response.close()
+    assert lines == payload.splitlines()
+
+
+def test_timed_iter_lines_raises_idle_timeout():
+    upstream = StallingUpstream([chunk_line("a"), 2.0])
+    client = UpstreamClient(idle_timeout=0.3)
+    timer = RelayTimer()
+    timer.timeout = 0.05
+    response = open_stream(upstream, client)
+    try:
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            for _ in client.iter_lines(response, timer):
+                pass
+    finally:
+        response.close()
+    assert client.stats()["idle_timeouts"] == 1
+
+
+def browser():
+    """返回 (服务端看到的客户端socket, 浏览器一侧socket)"""
+    server_side, client_side = socket.socketpair()
+    return server_side, client_side
+
+
+@pytest.mark.parametrize("keep_alive", [True, False])
+def test_disconnect_is_noticed_while_upstream_stalls(keep_alive):
+    # Connection: close 的响应由响应体读取对象持有socket
+    upstream = StallingUpstream([chunk_line("你好"), 10.0, sse_line("workflow_finished")], keep_alive=keep_alive)
+    client = UpstreamClient(idle_timeout=30)
+    relay = SSERelay(max_bytes=1024, max_delay_ms=50, disconnect_poll=0.1)
+    timer = RelayTimer()
+    server_side, client_side = browser()
+    response = open_stream(upstream, client)
+    frames = relay.relay(to_events(client.iter_lines(response, timer)),
+                         lambda: socket_disconnected(server_side), timer)
+    try:
+        assert json.loads(next(frames)[6:]) == {"type": "chunk", "chunk": "你好"}
+        # 上游停顿期间浏览器关闭
+        client_side.close()
+        closed_at = time.monotonic()
+        with pytest.raises(StreamCancelled):
+            next(frames)
+        assert time.monotonic() - closed_at < 1.0
+    finally:
+        client.cancel(response)
+        server_side.close()
+    assert relay.stats()["disconnects"] == 1
+    assert upstream.closed.wait(1.0)
+
+
+def test_disconnect_is_noticed_while_waiting_for_headers():
+    upstream = StallingUpstream([sse_line("workflow_finished")], header_delay=10.0)
+    client = UpstreamClient(first_byte_timeout=30)
+    server_side, client_side = browser()
+    client_side.close()
+    started = time.monotonic()
+    try:
+        with pytest.raises(StreamCancelled):
+            client.post_stream({"query": "x"}, url=upstream.url,
+                               should_stop=lambda: socket_disconnected(server_side), poll=0.1)
+    finally:
+        server_side.close()
+    assert time.monotonic() - started < 1.0
+    stats = client.stats()
+    assert stats["cancelled"] == 1
+    assert stats["errors"] == 0
+
+
+def test_headers_wait_keeps_first_byte_timeout():
+    upstream = StallingUpstream([sse_line("workflow_finished")], header_delay=2.0)
+    client = UpstreamClient(first_byte_timeout=0.3)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.post_stream({"query": "x"}, url=upstream.url, should_stop=lambda: False, poll=0.1)
+    assert client.stats()["first_byte_timeouts"] == 1
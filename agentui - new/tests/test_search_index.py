@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+import post
+from content_cache import ContentCache
+from post import apply_operation, load_content
+from search_index import build_search_index
+
+JSON_TEXT = json.dumps({
+    "server": {"host": "Alpha.example", "port": 2121, "alpha": True},
+    "items": [{"name": "alpha1", "tags": ["beta", "ALPHA2"]}, {"name": "gamma", "value": 1.5}]
+})
+XML_TEXT = ('<config alpha="1"><server name="alpha-a" port="21">Alpha text</server>'
+            '<server name="b"><note>beta alpha</note></server></config>')
+INI_TEXT = "[DEFAULT]\nalpha_default = x\n\n[alpha]\nhost = ALPHA.example\nport = 21\n\n[beta]\nalphaname = y\n"
+TEXT = "first alpha line\nsecond\n  Alpha indented  \n\nlast alphaalpha\n"
+
+CASES = [
+    ('c.json', 'json', JSON_TEXT),
+    ('c.xml', 'xml', XML_TEXT),
+    ('c.ini', 'ini', INI_TEXT),
+    ('c.txt', 'text', TEXT),
+]
+
+
+def walk_search(filename, file_type, text, term, max_matches=None):
+    parsed = load_content(filename, text, file_type)
+    result, _ = apply_operation('search', filename, term, file_type, parsed, text, max_matches=max_matches)
+    return result['matches']
+
+
+@pytest.mark.parametrize('filename, file_type, text', CASES)
+@pytest.mark.parametrize('term', ['alpha', 'ALPHA', 'a', '21', 'missing', 'alpha line'])
+def test_index_matches_tree_walk(filename, file_type, text, term):
+    index = build_search_index(file_type, load_content(filename, text, file_type), text)
+    assert index is not None
+    assert index.search(term.lower()) == walk_search(filename, file_type, text, term)
+
+
+@pytest.mark.parametrize('filename, file_type, text', CASES)
+def test_index_limit_keeps_walk_order(filename, file_type, text):
+    index = build_search_index(file_type, load_content(filename, text, file_type), text)
+    assert index.search('a', 2) == walk_search(filename, file_type, text, 'a')[:2]
+
+
+class FakeConn:
+    def path_key(self, filename):
+        return 'h', 'u', '/' + filename
+
+
+def test_index_built_on_second_search_and_counted(monkeypatch):
+    cache = ContentCache(max_chars=10 ** 6)
+    monkeypatch.setattr(post, 'content_cache', cache)
+    parsed = load_content('c.txt', TEXT, 'text')
+    entry = cache.put(FakeConn(), 'c.txt', {'size': len(TEXT), 'modify': 'm'}, len(TEXT), TEXT, 'text', parsed)
+
+    def search():
+        result, _ = apply_operation('search', 'c.txt', 'alpha', 'text', parsed, TEXT, cache_entry=entry)
+        return result['matches']
+
+    first = search()
+    assert entry.index is None
+    assert cache.stats()['chars'] == len(TEXT)
+
+    assert search() == first
+    assert entry.index is not None
+    assert cache.stats()['chars'] == len(TEXT) + entry.index.chars
+
+    cache.invalidate(FakeConn(), 'c.txt')
+    assert cache.stats()['chars'] == 0
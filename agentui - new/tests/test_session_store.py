@@ -0,0 +1,58 @@
+import threading
+import time
+
+from session_store import SessionManager, SqliteSessionManager
+
+
+def test_memory_clear_sessions_keeps_entries_in_step():
+    manager = SessionManager(shards=2)
+    for i in range(10):
+        manager.get_or_create_session(f"s{i}")
+    manager.add_pending_form("s0", {"type": "text"})
+    assert manager.stats()["entries"] == 10
+
+    manager.clear_sessions()
+    assert manager.session_count() == 0
+    # 只剩仍有表单的会话
+    assert manager.stats()["entries"] == 1
+    assert len(manager.get_pending_forms("s0")) == 1
+
+
+def test_sqlite_forms_follow_session_last_access(tmp_path):
+    manager = SqliteSessionManager(path=str(tmp_path / "sessions.db"), ttl=60)
+    manager.get_or_create_session("active")
+    manager.get_or_create_session("idle")
+    manager.add_pending_form("active", {"type": "text"})
+    manager.add_pending_form("idle", {"type": "text"})
+    manager.add_pending_form("orphan", {"type": "text"})
+
+    conn = manager._conn()
+    old = time.time() - 120
+    # 表单很久以前添加，但 active 会话仍在使用
+    conn.execute("UPDATE form_versions SET last_access = ?", (old,))
+    conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = 'idle'", (old,))
+
+    assert manager.sweep_expired() == 1
+    assert len(manager.get_forms_snapshot("active")[1]) == 1
+    assert manager.get_forms_snapshot("idle") == (0, [])
+    # 没有会话记录的表单按表单变更时间过期
+    assert manager.get_forms_snapshot("orphan") == (0, [])
+    assert manager.stats()["evictions"] == 1
+
+
+def test_sqlite_counters_are_exact_under_threads(tmp_path):
+    manager = SqliteSessionManager(path=str(tmp_path / "sessions.db"))
+    manager.get_or_create_session("s")
+    before = manager.stats()
+
+    def work():
+        for _ in range(50):
+            manager.get_sessions(["s"])
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # stats() 自身的 session_count 也是一次读事务
+    assert manager.stats()["reads"] - before["reads"] == 8 * 50 + 1
@@ -0,0 +1,155 @@
+import threading
+import time
+
+from singleflight import SingleFlight, payload_key
+
+
+class FakeResponse:
+    def __init__(self):
+        self.closed = False
+        self.cancelled = threading.Event()
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """上游每隔 delay 秒产生一行；cancel 后停止产生"""
+
+    def __init__(self, lines, delay=0.0, started=None):
+        self.lines = lines
+        self.delay = delay
+        self.started = started
+        self.calls = 0
+        self.responses = []
+        self.lock = threading.Lock()
+
+    def post_stream(self, payload):
+        with self.lock:
+            self.calls += 1
+        if self.started is not None:
+            self.started.wait()
+        response = FakeResponse()
+        self.responses.append(response)
+        return response
+
+    def iter_lines(self, response):
+        for line in self.lines:
+            if response.cancelled.wait(self.delay):
+                raise ConnectionError("cancelled")
+            yield line
+
+    def cancel(self, response):
+        response.cancelled.set()
+
+
+def test_payload_key_ignores_whitespace_and_skips_conversations():
+    assert payload_key({"query": " a  b "}) == payload_key({"query": "a b"})
+    assert payload_key({"query": "a", "conversationId": "c"}) is None
+
+
+def test_concurrent_joins_share_one_upstream():
+    lines = [f"line {i}" for i in range(20)]
+    started = threading.Event()
+    client = FakeClient(lines, delay=0.001, started=started)
+    flights = SingleFlight(client, enabled=True)
+    key = flights.key({"query": "q"})
+    results = []
+    barrier = threading.Barrier(16)
+
+    def subscriber():
+        barrier.wait()
+        flight, _ = flights.join(key, {"query": "q"})
+        try:
+            results.append(list(flights.iter_lines(flight)))
+        finally:
+            flights.leave(flight)
+
+    threads = [threading.Thread(target=subscriber) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    # 上游在所有订阅者加入后才开始返回
+    time.sleep(0.05)
+    started.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert client.calls == 1
+    assert results == [lines] * 16
+    stats = flights.stats()
+    assert stats["flights"] == 1
+    assert stats["followers"] == 15
+    assert stats["active"] == 0
+    assert stats["cancelled"] == 0
+    assert client.responses[0].closed
+
+
+def test_joiner_always_gets_a_condition():
+    client = FakeClient(["x"], started=threading.Event())
+    flights = SingleFlight(client, enabled=True)
+    errors = []
+
+    def join():
+        try:
+            flight, _ = flights.join("k", {})
+            with flight.cond:
+                pass
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=join) for _ in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert errors == []
+    client.started.set()
+
+
+def test_last_leave_cancels_upstream():
+    client = FakeClient([f"line {i}" for i in range(1000)], delay=0.01)
+    flights = SingleFlight(client, enabled=True)
+    first, leader = flights.join("k", {})
+    second, follower = flights.join("k", {})
+    assert (leader, follower) == (True, False)
+    assert first is second
+
+    lines = flights.iter_lines(first)
+    assert next(lines) == "line 0"
+    flights.leave(first)
+    assert not first.cancelled
+    flights.leave(second)
+    assert first.cancelled
+
+    with first.cond:
+        assert first.cond.wait_for(lambda: first.done, timeout=5)
+    assert client.responses[0].cancelled.is_set()
+    assert flights.stats()["cancelled"] == 1
+    # 已取消的流不再被新请求加入
+    third, leader = flights.join("k", {})
+    assert leader and third is not first
+    flights.leave(third)
+
+
+def test_upstream_error_is_raised_after_received_lines():
+    class FailingClient(FakeClient):
+        def iter_lines(self, response):
+            yield "a"
+            raise ConnectionError("boom")
+
+    flights = SingleFlight(FailingClient([]), enabled=True)
+    flight, _ = flights.join("k", {})
+    received = []
+    try:
+        for line in flights.iter_lines(flight):
+            received.append(line)
+    except ConnectionError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("expected ConnectionError")
+    finally:
+        flights.leave(flight)
+    assert received == ["a"]
@@ -0,0 +1,125 @@
+import configparser
+import json
+from xml.etree import ElementTree as ET
+
+from post import apply_operation, auto_decode, load_content
+from structured_patch import patch_document
+
+JSON_TEXT = '''{
+    "server": {"host": "10.0.0.1",   "port": 21},
+    "paths": [
+        "/data/a",
+        "/data/b"
+    ],
+    "name": "测试"
+}
+'''
+XML_TEXT = '''<?xml version="1.0" encoding="UTF-8"?>
+<!-- 配置说明 -->
+<config>
+  <server name="a"   port="21">10.0.0.1</server>
+  <server name="b" port="22"><![CDATA[raw <text>]]></server>
+</config>
+'''
+INI_TEXT = '''; 全局说明
+[server]
+host   =   10.0.0.1
+port=21
+
+# 另一段
+[paths]
+data = /data/a
+'''
+
+
+def update(filename, text, file_type, content, encoding='utf-8'):
+    data = text.encode(encoding)
+    raw, source_encoding, bom = auto_decode(data)
+    parsed = load_content(filename, raw, file_type)
+    return apply_operation('update', filename, content, file_type, parsed, raw, data, len(data),
+                           source_encoding, bom)
+
+
+def test_json_patch_keeps_layout():
+    data = json.loads(JSON_TEXT)
+    data['server']['port'] = 2121
+    data['paths'][1] = '/data/c'
+    patched = patch_document(JSON_TEXT, data, 'json')
+    assert patched == JSON_TEXT.replace('"port": 21', '"port": 2121').replace('"/data/b"', '"/data/c"')
+    assert json.loads(patched) == data
+
+
+def test_json_new_key_is_inserted_in_place():
+    data = json.loads(JSON_TEXT)
+    data['server']['user'] = 'ftp'
+    patched = patch_document(JSON_TEXT, data, 'json')
+    assert json.loads(patched) == data
+    assert patched.splitlines()[2:] == JSON_TEXT.splitlines()[2:]
+
+
+def test_xml_patch_keeps_declaration_comments_and_cdata():
+    root = ET.fromstring(XML_TEXT.split('\n', 1)[1])
+    root[0].set('port', '2121')
+    root[0].text = '10.0.0.9'
+    patched = patch_document(XML_TEXT, root, 'xml')
+    assert patched == XML_TEXT.replace('port="21">10.0.0.1', 'port="2121">10.0.0.9')
+
+
+def test_ini_patch_keeps_comments():
+    config = configparser.ConfigParser()
+    config.read_string(INI_TEXT)
+    config.set('server', 'port', '2121')
+    config.set('paths', 'data', '/data/c')
+    patched = patch_document(INI_TEXT, config, 'ini')
+    assert patched == INI_TEXT.replace('port=21', 'port=2121').replace('/data/a', '/data/c')
+
+
+def test_bom_is_preserved():
+    text = '﻿' + JSON_TEXT
+    data = json.loads(JSON_TEXT)
+    data['name'] = '新'
+    assert patch_document(text, data, 'json') == '﻿' + JSON_TEXT.replace('"测试"', '"新"')
+
+
+def test_update_round_trips_through_encoding():
+    result, updated = update('c.json', JSON_TEXT, 'json', '10.0.0.1&update&10.0.0.2')
+    assert result['replacements'] == 1
+    assert updated == JSON_TEXT.replace('10.0.0.1', '10.0.0.2').encode('utf-8')
+
+    result, updated = update('c.xml', XML_TEXT, 'xml', 'xpath:/config/server[@name="b"]/@port&update&23')
+    assert result['replacements'] == 1
+    assert updated == XML_TEXT.replace('port="22"', 'port="23"').encode('utf-8')
+
+    result, updated = update('c.ini', INI_TEXT, 'ini', '/data/a&update&/data/z', encoding='gbk')
+    assert result['replacements'] == 1
+    assert updated == INI_TEXT.replace('/data/a', '/data/z').encode('gbk')
+
+
+def test_unchanged_file_is_not_uploaded():
+    # 替换成相同的值：解析结果不变，不回写文件
+    for filename, text, file_type in (('c.json', JSON_TEXT, 'json'), ('c.xml', XML_TEXT, 'xml'),
+                                      ('c.ini', INI_TEXT, 'ini')):
+        result, updated = update(filename, text, file_type, '10.0.0.1&update&10.0.0.1')
+        assert updated is None, filename
+        assert result['unchanged'] is True
+
+
+def test_json_path_miss_is_unchanged():
+    result, updated = update('c.json', JSON_TEXT, 'json', 'jsonpath:$.server.user&update&ftp')
+    assert updated is None
+    assert result['replacements'] == 0
+
+
+def test_ini_update_section_option_equal_to_default():
+    text = '[DEFAULT]\nport = 21\n\n[srv]\nport = 21\nhost = a\n'
+    result, updated = update('c.ini', text, 'ini', '21&update&22')
+    # 节内显式写出的选项即使与DEFAULT同值也要更新
+    assert result['replacements'] == 2
+    assert updated == text.replace('21', '22').encode('utf-8')
+
+
+def test_ini_update_skips_inherited_options():
+    text = '[DEFAULT]\nport = 21\n\n[srv]\nhost = a\n'
+    result, updated = update('c.ini', text, 'ini', '21&update&22')
+    assert result['replacements'] == 1
+    assert updated == text.replace('21', '22').encode('utf-8')
@@ -0,0 +1,91 @@
+from xml.etree import ElementTree as ET
+
+import pytest
+
+from structured_update import update_json, update_xml
+
+
+def xml(text):
+    return ET.fromstring(text)
+
+
+# ---------- 按值匹配：不带前缀的检索内容即使像路径也按值处理 ----------
+
+def test_xml_value_that_looks_like_relative_path():
+    root = xml('<cfg><path>./bin</path><bin>keep</bin></cfg>')
+    assert update_xml(root, './bin', './sbin') == 1
+    assert root.find('path').text == './sbin'
+    assert root.find('bin').text == 'keep'
+
+
+def test_xml_value_that_looks_like_absolute_path():
+    root = xml('<cfg><logs dir="/data/logs">/data/logs</logs></cfg>')
+    assert update_xml(root, '/data/logs', '/var/logs') == 2
+    assert root.find('logs').text == '/var/logs'
+    assert root.find('logs').get('dir') == '/var/logs'
+
+
+def test_xml_value_does_not_touch_tags_or_attribute_names():
+    root = xml('<cfg><port port="1">port</port></cfg>')
+    assert update_xml(root, 'port', 'p') == 1
+    assert root.find('port').get('port') == '1'
+
+
+def test_json_value_that_looks_like_jsonpath():
+    data, count = update_json({'home': '$HOME/app', 'other': 'x'}, '$HOME/app', '/opt/app')
+    assert count == 1
+    assert data == {'home': '/opt/app', 'other': 'x'}
+
+
+def test_json_value_scalars_follow_original_type():
+    data, count = update_json({'port': 21, 'name': 'port 21', 'on': True}, '21', '22')
+    assert count == 2
+    assert data == {'port': 22, 'name': 'port 22', 'on': True}
+
+
+def test_json_keys_are_not_matched():
+    data, count = update_json({'port': 'x'}, 'port', 'y')
+    assert count == 0
+    assert data == {'port': 'x'}
+
+
+# ---------- 按路径定位：必须带 jsonpath: / xpath: 前缀 ----------
+
+def test_jsonpath_sets_existing_values():
+    data = {'servers': [{'name': 'a', 'port': 1}, {'name': 'b', 'port': 2}]}
+    data, count = update_json(data, 'jsonpath:$.servers[*].port', '9')
+    assert count == 2
+    assert [server['port'] for server in data['servers']] == [9, 9]
+
+
+def test_jsonpath_missing_key_is_not_created():
+    data, count = update_json({'server': {'port': 21}}, 'jsonpath:$.server.prot', '2')
+    assert count == 0
+    assert data == {'server': {'port': 21}}
+
+
+def test_jsonpath_missing_parent_and_index():
+    data = {'list': [1]}
+    assert update_json(data, 'jsonpath:$.nope.x', '1') == (data, 0)
+    assert update_json(data, 'jsonpath:$.list[5]', '1') == (data, 0)
+
+
+def test_jsonpath_requires_dollar():
+    with pytest.raises(ValueError):
+        update_json({}, 'jsonpath:server.port', '1')
+
+
+def test_xpath_sets_text_and_existing_attribute():
+    root = xml('<config><server name="a" port="1">x</server><server name="b" port="2">y</server></config>')
+    assert update_xml(root, "xpath:/config/server[@name='b']/@port", '9') == 1
+    assert [server.get('port') for server in root] == ['1', '9']
+    assert update_xml(root, 'xpath:.//server', 'T') == 2
+    assert [server.text for server in root] == ['T', 'T']
+
+
+def test_xpath_misses_change_nothing():
+    root = xml('<config><server port="1"/></config>')
+    assert update_xml(root, 'xpath:/config/server/@prot', '2') == 0
+    assert update_xml(root, 'xpath:/other/server', '2') == 0
+    assert update_xml(root, 'xpath:.//client', '2') == 0
+    assert ET.tostring(root) == b'<config><server port="1" /></config>'
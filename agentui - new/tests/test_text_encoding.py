@@ -0,0 +1,63 @@
+import codecs
+
+import pytest
+
+from text_encoding import EncodingDetector
+
+
+@pytest.fixture
+def detector():
+    return EncodingDetector(sample_bytes=4096)
+
+
+def test_utf8(detector):
+    data = '名称=测试\n'.encode('utf-8')
+    assert detector.decode_detail(data) == ('名称=测试\n', 'utf-8', b'')
+
+
+def test_ascii_head_gbk_tail(detector):
+    # ASCII 部分远大于采样长度，采样必须从第一个非 UTF-8 字节开始
+    text = '; pad\n' * 12000 + '[sec]\nname=测试数据\n'
+    decoded, encoding, bom = detector.decode_detail(text.encode('gbk'), key='/a.ini')
+    assert decoded == text
+    assert codecs.lookup(encoding).name in ('gbk', 'gb18030')
+    assert bom == b''
+    assert (decoded + 'x').encode(encoding) == text.encode('gbk') + b'x'
+
+
+def test_detected_encoding_is_cached_per_key(detector):
+    data = ('; pad\n' * 100 + '名称=测试数据\n').encode('gbk')
+    assert detector.decode_detail(data, key='/b.ini')[0].endswith('测试数据\n')
+    assert detector.decode_detail(data, key='/b.ini')[0].endswith('测试数据\n')
+    assert detector.stats()['cache_hits'] == 1
+
+
+@pytest.mark.parametrize('bom, codec, body_encoding', [
+    (codecs.BOM_UTF8, 'utf-8', 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le', 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be', 'utf-16-be'),
+])
+def test_bom_round_trip(detector, bom, codec, body_encoding):
+    text = '[sec]\nname=测试\n'
+    data = bom + text.encode(codec)
+    decoded, encoding, kept_bom = detector.decode_detail(data)
+    assert decoded == text
+    assert encoding == body_encoding
+    assert kept_bom == bom
+    assert kept_bom + decoded.encode(encoding) == data
+
+
+def test_lossy_decode_has_no_encoding(detector):
+    decoded, encoding, bom = detector.decode_detail(b'abc\xff\xfe\x80\x81zz')
+    assert encoding is None
+    assert decoded.startswith('abc')
+    assert detector.stats()['fallbacks'] == 1
+
+
+def test_detect_head_sample(detector):
+    head = ('x' * 100 + '测试数据' * 50).encode('gbk')
+    encoding, bom_length = detector.detect(head[:-1])
+    assert codecs.lookup(encoding).name in ('gbk', 'gb18030')
+    assert bom_length == 0
+    assert detector.detect(codecs.BOM_UTF8 + b'abc') == ('utf-8', 3)
+    assert detector.detect(codecs.BOM_UTF16_LE + 'ab'.encode('utf-16-le')) == ('utf-16', 2)
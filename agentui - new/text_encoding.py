@@ -0,0 +1,204 @@
+import os
+import codecs
+from collections import OrderedDict
+from threading import Lock
+
+import chardet
+
+# ========== 编码检测配置 ==========
+# chardet 与回退编码校验使用的样本字节数（从严格 UTF-8 解码失败的位置开始取）
+ENCODING_SAMPLE_BYTES = int(os.environ.get("ENCODING_SAMPLE_BYTES", str(64 * 1024)))
+# 按文件路径缓存检测结果的条目上限
+ENCODING_CACHE_MAX_ENTRIES = int(os.environ.get("ENCODING_CACHE_MAX_ENTRIES", "1024"))
+# chardet 结果的最低置信度，与原 auto_decode 一致
+ENCODING_MIN_CONFIDENCE = 0.7
+# chardet 结果不可用时，按顺序严格校验的候选编码（GB18030 兼容 GBK/GB2312）
+FALLBACK_ENCODINGS = ('gb18030',)
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# 去掉 BOM 之后正文对应的编码
+BOM_BODY_ENCODINGS = {'utf-8-sig': 'utf-8', 'utf-16': 'utf-16-le'}
+
+
+def sniff_bom(data):
+    """返回 (BOM对应的编码, BOM长度)，没有 BOM 时返回 (None, 0)"""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding, len(bom)
+    return None, 0
+
+
+class EncodingDetector:
+    """文本编码检测：BOM -> 严格 UTF-8 -> 路径缓存 -> 采样 chardet -> 候选编码 -> UTF-8（忽略错误）
+
+    与原 auto_decode 的判定顺序一致，只是：
+    - 合法 UTF-8 直接一次解码返回，不再对全文运行 chardet（旧版 chardet 为纯 Python，MB 级文件需数秒）
+    - chardet 只分析从 UTF-8 解码失败位置开始的样本（开头大段 ASCII 的文件也能采到非 ASCII 字节）
+    - chardet 给出的编码与候选编码都对全文严格解码校验，失败时继续尝试下一个
+    - 原回退列表中 utf-8(ignore) 总是成功，其后的 gbk 等从未生效；现在先严格校验 GB18030
+    - 非 UTF-8 文件的检测结果按路径缓存，下次先用缓存编码严格解码，失败才重新检测
+    - 所有编码都无法严格解码时按 UTF-8 忽略错误解码，返回的编码为 None，表示内容有损、不可写回
+    """
+
+    def __init__(self, sample_bytes=ENCODING_SAMPLE_BYTES, max_entries=ENCODING_CACHE_MAX_ENTRIES):
+        self.sample_bytes = sample_bytes
+        self.max_entries = max_entries
+        self.cache = OrderedDict()  # 路径键 -> 编码
+        self.lock = Lock()
+        self.counters = {
+            "bom": 0,
+            "utf8": 0,
+            "cache_hits": 0,
+            "detections": 0,
+            "fallbacks": 0
+        }
+
+    def _count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def _cached(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            encoding = self.cache.get(key)
+            if encoding is not None:
+                self.cache.move_to_end(key)
+            return encoding
+
+    def _remember(self, key, encoding):
+        if key is None:
+            return
+        with self.lock:
+            self.cache[key] = encoding
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def _forget(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def _detect_sample(self, sample):
+        """对样本运行 chardet，返回置信度足够的编码或 None；样本含非 ASCII 字节时不接受 ascii"""
+        self._count("detections")
+        result = chardet.detect(sample)
+        encoding = result.get('encoding')
+        if not encoding or (result.get('confidence') or 0) <= ENCODING_MIN_CONFIDENCE:
+            return None
+        if encoding.lower() == 'ascii' and not sample.isascii():
+            return None
+        return encoding
+
+    def _candidates(self, sample):
+        """待校验的编码：chardet 结果在前，候选编码在后"""
+        candidates = []
+        for encoding in (self._detect_sample(sample), *FALLBACK_ENCODINGS):
+            if encoding and encoding not in candidates:
+                candidates.append(encoding)
+        return candidates
+
+    def cached(self, key):
+        """路径缓存中的编码（此前对完整文件检测得到），没有时返回 None"""
+        return self._cached(key)
+
+    def decode(self, data, key=None):
+        """解码完整的字节内容；key 为文件路径等标识，用于缓存检测结果"""
+        return self.decode_detail(data, key)[0]
+
+    def decode_detail(self, data, key=None):
+        """解码完整的字节内容，返回 (文本, 编码, BOM字节)
+
+        返回的编码与 BOM 可用于按原格式写回：BOM + 文本.encode(编码)；
+        编码为 None 表示没有能严格解码全文的编码，文本丢弃了非法字节，不能写回
+        """
+        if not data:
+            return "", 'utf-8', b''
+
+        encoding, bom_length = sniff_bom(data)
+        if encoding:
+            # 去掉 BOM 后按对应字节序解码，写回时再加上同一个 BOM
+            body_encoding = BOM_BODY_ENCODINGS.get(encoding, encoding)
+            try:
+                text = data[bom_length:].decode(body_encoding)
+                self._count("bom")
+                return text, body_encoding, data[:bom_length]
+            except UnicodeDecodeError:
+                pass
+
+        try:
+            # 严格解码即校验，合法时一遍完成
+            text = data.decode('utf-8')
+            self._count("utf8")
+            return text, 'utf-8', b''
+        except UnicodeDecodeError as e:
+            # 之前的字节都是合法 UTF-8，从第一个非法字节开始采样
+            offset = e.start
+
+        encoding = self._cached(key)
+        if encoding:
+            try:
+                text = data.decode(encoding)
+                self._count("cache_hits")
+                return text, encoding, b''
+            except (UnicodeDecodeError, LookupError):
+                self._forget(key)
+
+        sample = data[offset:offset + self.sample_bytes]
+        for encoding in self._candidates(sample):
+            try:
+                text = data.decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                continue
+            self._remember(key, encoding)
+            return text, encoding, b''
+
+        self._count("fallbacks")
+        return data.decode('utf-8', errors='ignore'), None, b''
+
+    def detect(self, sample, key=None):
+        """只根据文件开头的样本判断编码（流式处理用），返回 (编码, BOM长度)"""
+        encoding, bom_length = sniff_bom(sample)
+        if encoding:
+            self._count("bom")
+            return ('utf-8' if encoding == 'utf-8-sig' else encoding), bom_length
+        try:
+            # 样本末尾可能截断在多字节字符中间，按增量方式校验
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            self._count("utf8")
+            return 'utf-8', 0
+        except UnicodeDecodeError as e:
+            offset = e.start
+
+        encoding = self._cached(key)
+        if encoding:
+            self._count("cache_hits")
+            return encoding, 0
+        sample = sample[offset:]
+        for encoding in self._candidates(sample):
+            try:
+                # 只有文件开头可用，严格校验这一段
+                codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            except (UnicodeDecodeError, LookupError):
+                continue
+            self._remember(key, encoding)
+            return encoding, 0
+        self._count("fallbacks")
+        return 'utf-8', 0
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.cache)
+        return {
+            "cached_paths": size,
+            "sample_bytes": self.sample_bytes,
+            **counters
+        }
+
+
+encoding_detector = EncodingDetector()
@@ -0,0 +1,319 @@
+import os
+import ssl
+import time
+import select
+import socket
+from threading import Lock, local
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from relay import StreamCancelled
+
+# ========== 上游 dfApp 配置 ==========
+UPSTREAM_RUN_URL = os.environ.get(
+    "UPSTREAM_RUN_URL", "https://auodigital.corpnet.auo.com:8080/ex/api/dfApp/run"
+)
+UPSTREAM_HEADERS = {
+    "Authorization": os.environ.get("UPSTREAM_AUTHORIZATION", "K2405124"),
+    "Content-Type": "application/json"
+}
+
+# 连接池大小：pool_connections 为缓存的主机数，pool_maxsize 为每个主机的最大连接数
+UPSTREAM_POOL_HOSTS = int(os.environ.get("UPSTREAM_POOL_HOSTS", "4"))
+UPSTREAM_POOL_PER_HOST = int(os.environ.get("UPSTREAM_POOL_PER_HOST", "20"))
+
+# 分阶段超时（秒）：建立连接 / 等待首字节 / 两个数据块之间的空闲
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_FIRST_BYTE_TIMEOUT = float(os.environ.get("UPSTREAM_FIRST_BYTE_TIMEOUT", "30"))
+UPSTREAM_IDLE_TIMEOUT = float(os.environ.get("UPSTREAM_IDLE_TIMEOUT", "60"))
+
+# 按行读取时每次从响应体读取的字节数（与 requests 的 iter_lines 默认值一致）
+ITER_CHUNK_SIZE = 512
+
+
+def response_socket(response):
+    """流式响应的底层socket
+
+    上游返回 Connection: close 时 http.client 会提前把连接对象的 sock 置空，此时socket只由响应体的读取对象持有
+    """
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        fp = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    return sock
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """统计真实建连（TCP/TLS握手）次数的适配器
+
+    urllib3 的 num_connections 只统计新建的连接对象，服务端关闭后在同一对象上重连不会计入，
+    因此这里包装连接类的 connect() 计数。
+    before_response: 可选，在连接开始读取响应头之前以连接对象调用
+    """
+
+    def __init__(self, on_connect, before_response=None, **kwargs):
+        self.on_connect = on_connect
+        self.before_response = before_response
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # pool_classes_by_scheme 是 PoolManager 实例上的副本，不会影响其他会话
+        classes = self.poolmanager.pool_classes_by_scheme
+        for scheme, pool_cls in list(classes.items()):
+            classes[scheme] = type(pool_cls.__name__, (pool_cls,), {
+                "ConnectionCls": self._counting_connection(pool_cls.ConnectionCls)
+            })
+
+    def _counting_connection(self, connection_cls):
+        on_connect = self.on_connect
+        before_response = self.before_response
+
+        def connect(conn):
+            on_connect()
+            return connection_cls.connect(conn)
+
+        def getresponse(conn):
+            before_response(conn)
+            return connection_cls.getresponse(conn)
+
+        methods = {"connect": connect}
+        if before_response is not None:
+            methods["getresponse"] = getresponse
+        return type(connection_cls.__name__, (connection_cls,), methods)
+
+
+class UpstreamClient:
+    """共享的上游HTTP客户端：keep-alive连接池 + 分阶段超时，线程安全"""
+
+    def __init__(self, pool_hosts=UPSTREAM_POOL_HOSTS, pool_per_host=UPSTREAM_POOL_PER_HOST,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+                 first_byte_timeout=UPSTREAM_FIRST_BYTE_TIMEOUT,
+                 idle_timeout=UPSTREAM_IDLE_TIMEOUT, verify=False):
+        self.connect_timeout = connect_timeout
+        self.first_byte_timeout = first_byte_timeout
+        self.idle_timeout = idle_timeout
+        self.verify = verify
+
+        # pool_block=True：连接数达到上限时排队等待，而不是无限新建连接
+        self.adapter = CountingHTTPAdapter(
+            lambda: self._count("handshakes"),
+            before_response=self._wait_response,
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_per_host,
+            pool_block=True,
+            max_retries=0
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers.update(UPSTREAM_HEADERS)
+
+        # post_stream 调用方的断线检查函数，供等待响应头的连接读取
+        self.local = local()
+        self.lock = Lock()
+        self.counters = {
+            "requests": 0,
+            "errors": 0,
+            "handshakes": 0,
+            "first_byte_timeouts": 0,
+            "idle_timeouts": 0,
+            "cancelled": 0,
+            "first_byte_ms_total": 0.0
+        }
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def post_stream(self, payload, url=UPSTREAM_RUN_URL, should_stop=None, poll=1.0):
+        """发送流式POST请求，返回已收到响应头的 Response（调用方负责 close）
+
+        should_stop: 可选的断线检查函数，等待响应头期间每隔 poll 秒调用，返回 True 时断开连接并抛出 StreamCancelled
+        """
+        self._count("requests")
+        started = time.monotonic()
+        self.local.should_stop = should_stop
+        self.local.poll = poll
+        try:
+            # read 超时在此阶段即为“首字节”超时
+            response = self.session.post(
+                url,
+                json=payload,
+                verify=self.verify,
+                stream=True,
+                timeout=(self.connect_timeout, self.first_byte_timeout)
+            )
+        except StreamCancelled:
+            self._count("cancelled")
+            raise
+        except requests.exceptions.ReadTimeout:
+            self._count("first_byte_timeouts")
+            self._count("errors")
+            raise
+        except requests.exceptions.RequestException:
+            self._count("errors")
+            raise
+        finally:
+            self.local.should_stop = None
+        self._count("first_byte_ms_total", (time.monotonic() - started) * 1000)
+
+        # 收到响应头后，把底层socket的超时切换为块间空闲超时
+        sock = response_socket(response)
+        if sock is not None:
+            sock.settimeout(self.idle_timeout)
+        return response
+
+    def _wait_response(self, conn):
+        """等待响应头：每隔 poll 秒检查一次调用方是否已离开；未传入 should_stop 时直接返回"""
+        should_stop = getattr(self.local, "should_stop", None)
+        sock = conn.sock
+        if should_stop is None or sock is None:
+            return
+        deadline = time.monotonic() + self.first_byte_timeout
+        while not (hasattr(sock, "pending") and sock.pending()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # 与读取超时相同的异常，由 urllib3 转换为 ReadTimeout
+                raise socket.timeout("timed out")
+            try:
+                readable, _, _ = select.select([sock], [], [], min(self.local.poll, remaining))
+            except (OSError, ValueError):
+                return
+            if readable:
+                return
+            if should_stop():
+                # 抛出后 urllib3 关闭该连接，不放回连接池
+                raise StreamCancelled("客户端已断开")
+
+    def iter_lines(self, response, timer=None):
+        """逐行读取流式响应，块间空闲超时统一抛出 ReadTimeout
+
+        timer: 可选的 relay.RelayTimer；上游在 timer.timeout 秒内没有新数据时产出 None，由调用方处理定时任务后继续读取
+        """
+        try:
+            if timer is None:
+                yield from response.iter_lines()
+            else:
+                yield from self._iter_lines_timed(response, timer)
+        except requests.exceptions.ConnectionError as e:
+            if getattr(response, "cancelled", False):
+                # 已由 cancel() 主动断开，不计为上游错误
+                return
+            # requests 会把读取阶段的超时包装成 ConnectionError
+            if "timed out" in str(e).lower():
+                self._count("idle_timeouts")
+                raise requests.exceptions.ReadTimeout(f"上游空闲超时（{self.idle_timeout}s）") from e
+            self._count("errors")
+            raise
+
+    def _iter_lines_timed(self, response, timer):
+        """与 Response.iter_lines 相同的分行规则，读取前先按 timer 等待socket可读"""
+        chunks = response.iter_content(chunk_size=ITER_CHUNK_SIZE)
+        pending = None
+        idle_since = time.monotonic()
+        while True:
+            if timer.timeout is not None and not self._wait_readable(response, timer.timeout):
+                if time.monotonic() - idle_since >= self.idle_timeout:
+                    self._count("idle_timeouts")
+                    raise requests.exceptions.ReadTimeout(f"上游空闲超时（{self.idle_timeout}s）")
+                yield None
+                continue
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            idle_since = time.monotonic()
+            if pending is not None:
+                chunk = pending + chunk
+            lines = chunk.splitlines()
+            if lines and lines[-1] and chunk[-1:] == lines[-1][-1:]:
+                pending = lines.pop()
+            else:
+                pending = None
+            yield from lines
+        if pending is not None:
+            yield pending
+
+    def _wait_readable(self, response, timeout):
+        """等待上游数据：已有缓冲数据或 timeout 秒内socket可读时返回 True，无法判断时按可读处理"""
+        raw = response.raw
+        if len(getattr(raw, "_decoded_buffer", b"")):
+            return True
+        fp = getattr(getattr(raw, "_fp", None), "fp", None)
+        sock = response_socket(response)
+        if fp is None or sock is None:
+            return True
+        # 非阻塞地查看 http.client 的读缓冲：缓冲为空时 peek 不会阻塞，也不会让读取对象进入超时状态
+        previous = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            buffered = fp.peek(1)
+        except ssl.SSLWantReadError:
+            buffered = b""
+        except (OSError, ValueError):
+            return True
+        finally:
+            sock.settimeout(previous)
+        if buffered:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], timeout)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def cancel(self, response):
+        """客户端已离开：立即断开上游响应，唤醒阻塞中的读取；该连接不再放回连接池复用"""
+        self._count("cancelled")
+        response.cancelled = True
+        sock = response_socket(response)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+    def stats(self):
+        """连接池统计：握手次数、请求数、连接复用率"""
+        pool_requests = 0
+        pools = 0
+        pool_container = self.adapter.poolmanager.pools
+        # RecentlyUsedContainer 不支持直接迭代，keys() 在其内部锁下返回快照
+        for key in pool_container.keys():
+            pool = pool_container.get(key)
+            if pool is None:
+                continue
+            pools += 1
+            pool_requests += pool.num_requests
+
+        with self.lock:
+            counters = dict(self.counters)
+
+        completed = counters["requests"] - counters["errors"]
+        avg_first_byte = counters.pop("first_byte_ms_total") / completed if completed > 0 else 0.0
+        handshakes = counters["handshakes"]
+        hit_rate = (pool_requests - handshakes) / pool_requests if pool_requests else 0.0
+
+        return {
+            **counters,
+            "pools": pools,
+            "pool_requests": pool_requests,
+            "pool_hit_rate": round(max(hit_rate, 0.0), 4),
+            "avg_first_byte_ms": round(avg_first_byte, 1),
+            "limits": {
+                "pool_hosts": self.adapter._pool_connections,
+                "pool_per_host": self.adapter._pool_maxsize,
+                "connect_timeout": self.connect_timeout,
+                "first_byte_timeout": self.first_byte_timeout,
+                "idle_timeout": self.idle_timeout
+            }
+        }
+
+    def close(self):
+        self.session.close()
+
+
+upstream_client = UpstreamClient()
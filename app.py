@@ -1,18 +1,23 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
 from datetime import datetime
 import os
 import requests
 import json
 import html
-import re
+import codecs
+from collections import deque
+from tag_parser import TagStreamParser, parse_tagged_text, FORM_FIELDS
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 # 确保必要的文件夹存在
 os.makedirs('static/images', exist_ok=True)
 
-# 全局消息历史（简单存储）
-messages = []
+# AI服务地址（测试时使用本地模拟服务 post.py）
+API_URL = "http://127.0.0.1:5000/post"
+
+# 全局消息历史（简单存储，定长队列只保留最近50条）
+messages = deque(maxlen=50)
 
 
 # ========== 辅助函数 ==========
@@ -34,41 +39,92 @@ def parse_response_content(text):
     """
     print(f"🔍 开始解析响应内容，原始文本: {text[:200]}...")
 
-    # 定义所有可能的标识符
-    all_identifiers = ['time', 'topic', 'participants', 'location', 'type', 'output']
+    # 单次扫描、预编译正则，规则见 tag_parser.TagStreamParser
+    extracted_info = parse_tagged_text(text)
 
-    # 存储提取结果
-    extracted_info = {}
-    remaining_text = text
+    print(f"📋 解析结果: {extracted_info}")
+    return extracted_info
 
-    # 1. 首先提取所有 [标识]:{值} 格式的内容
-    for identifier in all_identifiers:
-        pattern = r'\[' + identifier + r'\]:\{([^}]+)\}'
-        matches = re.findall(pattern, text)
 
-        if matches:
-            # 只取第一个匹配的值
-            value = matches[0].strip()
-            if value:  # 只存储非空值
-                extracted_info[identifier] = value
-                print(f"✅ 提取到 [{identifier}]:{{{value}}}")
+def build_result(parsed_info, ai_response):
+    """根据解析结果构建返回给前端的 answer 和表单更新"""
+    result = {
+        "status": "success",
+        "timestamp": datetime.now().isoformat(),
+        "answer": parsed_info.get('output', ai_response),  # 如果有output就用output，否则用整个响应
+        "updates": {}
+    }
 
-                # 从剩余文本中移除这个匹配项
-                remaining_text = re.sub(pattern, '', remaining_text)
+    # 提取非output的关键字用于更新表单
+    for key in FORM_FIELDS:
+        if key in parsed_info and parsed_info[key]:
+            result["updates"][key] = parsed_info[key]
+    return result
 
-    # 2. 处理剩余文本（没有标识的部分）
-    remaining_text = re.sub(r'\s+', ' ', remaining_text).strip()
 
-    # 3. 如果没有output标识但有剩余文本，将其作为output
-    if remaining_text and 'output' not in extracted_info:
-        extracted_info['output'] = remaining_text
-        print(f"📄 将剩余文本设为output: {remaining_text[:100]}...")
-    elif not remaining_text and 'output' not in extracted_info:
-        # 如果既没有output标识也没有剩余文本，output设为空
-        extracted_info['output'] = ""
+def save_message(user_input, answer, parsed_info):
+    """保存消息历史"""
+    # 超出50条时 deque 自动丢弃最旧的消息（O(1)）
+    messages.append({
+        "id": len(messages) + 1,
+        "user": user_input,
+        "ai": answer,
+        "timestamp": datetime.now().isoformat(),
+        "parsed_info": parsed_info
+    })
 
-    print(f"📋 解析结果: {extracted_info}")
-    return extracted_info
+
+def extract_answer(response_json):
+    """根据API的实际响应结构提取回答内容"""
+    if isinstance(response_json, dict):
+        # 如果是字典，尝试获取常见的字段
+        if "answer" in response_json:
+            return response_json["answer"]
+        elif "response" in response_json:
+            return response_json["response"]
+        elif "data" in response_json:
+            return response_json["data"]
+        # 转换为字符串
+        return str(response_json)
+    elif isinstance(response_json, str):
+        return response_json
+    return str(response_json)
+
+
+def iter_upstream_text(response):
+    """按到达顺序逐段产出上游回答文本，兼容SSE事件流、JSON和纯文本响应"""
+    content_type = response.headers.get('Content-Type', '')
+
+    if 'text/event-stream' in content_type:
+        received_chunk = False
+        for line in response.iter_lines():
+            if not line or not line.startswith(b'data:'):
+                continue
+            try:
+                data = json.loads(line[5:].decode('utf-8'))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+            if data.get("event") == "stream_chunk":
+                chunk = data.get("data", {}).get("chunk", "")
+                if chunk:
+                    received_chunk = True
+                    yield chunk
+            elif data.get("event") == "workflow_finished" and not received_chunk:
+                yield data.get("data", {}).get("outputs", {}).get("answer", "")
+
+    elif 'application/json' in content_type:
+        yield extract_answer(response.json())
+
+    else:
+        # 纯文本：增量解码，避免多字节字符被切断
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        for piece in response.iter_content(chunk_size=None):
+            text = decoder.decode(piece)
+            if text:
+                yield text
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
 
 
 def create_api_payload(user_input):
@@ -145,7 +201,7 @@ def post_message():
             # 测试时使用模拟响应
             print(f"📤 发送请求到API: {payload}")
             response = requests.post(
-                "http://127.0.0.1:5000/post",
+                API_URL,
                 json=payload,
                 headers={
                     "Authorization": "K2405124",
@@ -164,21 +220,7 @@ def post_message():
                 print(f"📥 API返回JSON: {response_json}")
 
                 # 根据API的实际响应结构提取内容
-                if isinstance(response_json, dict):
-                    # 如果是字典，尝试获取常见的字段
-                    if "answer" in response_json:
-                        ai_response = response_json["answer"]
-                    elif "response" in response_json:
-                        ai_response = response_json["response"]
-                    elif "data" in response_json:
-                        ai_response = response_json["data"]
-                    else:
-                        # 转换为字符串
-                        ai_response = str(response_json)
-                elif isinstance(response_json, str):
-                    ai_response = response_json
-                else:
-                    ai_response = str(response_json)
+                ai_response = extract_answer(response_json)
 
             except (json.JSONDecodeError, ValueError):
                 # 如果不是JSON，直接使用文本内容
@@ -209,32 +251,10 @@ def post_message():
         parsed_info = parse_response_content(ai_response)
 
         # 构建返回结果
-        result = {
-            "status": "success",
-            "timestamp": datetime.now().isoformat(),
-            "answer": parsed_info.get('output', ai_response),  # 如果有output就用output，否则用整个响应
-            "updates": {}
-        }
-
-        # 提取非output的关键字用于更新表单
-        for key in ['time', 'topic', 'participants', 'location', 'type']:
-            if key in parsed_info and parsed_info[key]:
-                result["updates"][key] = parsed_info[key]
+        result = build_result(parsed_info, ai_response)
 
         # 保存消息历史
-        timestamp = datetime.now().isoformat()
-        new_message = {
-            "id": len(messages) + 1,
-            "user": user_input,
-            "ai": result["answer"],
-            "timestamp": timestamp,
-            "parsed_info": parsed_info
-        }
-        messages.append(new_message)
-
-        # 只保留最近的50条消息
-        if len(messages) > 50:
-            messages.pop(0)
+        save_message(user_input, result["answer"], parsed_info)
 
         print(f"📤 返回结果: answer={result['answer'][:100]}..., updates={result['updates']}")
         return jsonify(result)
@@ -250,6 +270,81 @@ def post_message():
         }), 500
 
 
+@app.route('/post/stream', methods=['POST'])
+def post_message_stream():
+    """处理用户消息 - 流式输出，每个标识闭合后立即推送表单更新"""
+    data = request.get_json()
+    if not data:
+        return jsonify({
+            "status": "error",
+            "message": "无效的请求数据"
+        }), 400
+
+    user_input = data.get("message", "").strip()
+
+    if not user_input:
+        return jsonify({
+            "status": "error",
+            "message": "消息不能为空"
+        }), 400
+
+    user_input = sanitize_input(user_input)
+    print(f"📤 用户消息(流式): {user_input[:300]}...")
+
+    payload = create_api_payload(user_input)
+
+    def sse(event):
+        return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    def generate_stream():
+        parser = TagStreamParser()
+        response = None
+        try:
+            response = requests.post(
+                API_URL,
+                json=payload,
+                headers={
+                    "Authorization": "K2405124",
+                    "Content-Type": "application/json"
+                },
+                stream=True,
+                timeout=30
+            )
+            response.raise_for_status()
+            yield sse({"type": "start"})
+
+            ai_response = []
+            for piece in iter_upstream_text(response):
+                ai_response.append(piece)
+                for event in parser.feed(piece):
+                    if event[0] == 'field':
+                        if event[1] in FORM_FIELDS:
+                            print(f"✅ 提取到 [{event[1]}]:{{{event[2]}}}")
+                            yield sse({"type": "update", "field": event[1], "value": event[2]})
+                    else:
+                        yield sse({"type": "chunk", "chunk": event[1]})
+
+            parsed_info = parser.close()
+            result = build_result(parsed_info, ''.join(ai_response))
+            save_message(user_input, result["answer"], parsed_info)
+            print(f"📤 返回结果: answer={result['answer'][:100]}..., updates={result['updates']}")
+            yield sse({"type": "complete", **result})
+
+        except requests.exceptions.Timeout:
+            yield sse({"type": "error", "message": "请求超时，请稍后重试"})
+        except requests.exceptions.RequestException as e:
+            print(f"❌ API请求异常: {str(e)}")
+            yield sse({"type": "error", "message": f"API请求失败: {str(e)}"})
+        except Exception as e:
+            print(f"❌ 处理API响应时出错: {str(e)}")
+            yield sse({"type": "error", "message": f"处理API响应失败: {str(e)}"})
+        finally:
+            if response is not None:
+                response.close()
+
+    return Response(generate_stream(), mimetype='text/event-stream')
+
+
 @app.route('/reset', methods=['POST'])
 def reset_conversation():
     """重置会话"""
@@ -0,0 +1,107 @@
+"""
+[标识]:{值} 解析微基准：旧版逐标识正则扫描 vs TagStreamParser
+
+1. 校验新旧实现在样例上的解析结果一致
+2. 对比整段解析耗时，以及按SSE片段增量喂入的耗时
+
+用法: python bench_parser.py --repeat 2000 --chunk 16
+"""
+import argparse
+import re
+import time
+
+from tag_parser import TagStreamParser, parse_tagged_text
+
+
+def legacy_parse_response_content(text):
+    """旧版实现（去掉日志输出）：每个标识单独编译、findall、sub，共扫描全文约12次"""
+    all_identifiers = ['time', 'topic', 'participants', 'location', 'type', 'output']
+    extracted_info = {}
+    remaining_text = text
+
+    for identifier in all_identifiers:
+        pattern = r'\[' + identifier + r'\]:\{([^}]+)\}'
+        matches = re.findall(pattern, text)
+        if matches:
+            value = matches[0].strip()
+            if value:
+                extracted_info[identifier] = value
+                remaining_text = re.sub(pattern, '', remaining_text)
+
+    remaining_text = re.sub(r'\s+', ' ', remaining_text).strip()
+    if 'output' not in extracted_info:
+        extracted_info['output'] = remaining_text
+    return extracted_info
+
+
+SAMPLES = [
+    "[time]:{2020}569[topic]:{test}",
+    "好的，已为您记录。[time]:{2024-05-20 14:00}[topic]:{季度复盘}[location]:{A栋301}"
+    "[type]:{线下}[participants]:{张三, 李四, 王五}[output]:{会议信息已更新，请确认。}",
+    "请问会议的具体时间是？\n\n目前已知：[topic]:{产品评审}  [participants]:{研发组}",
+    "没有任何标识的普通回复，   包含   多余空白\n和换行。",
+    "[time]:{ }空值首次出现会保留原文[time]:{明天上午}",
+    "[topic]:{第一次}重复标识只取第一次[topic]:{第二次}[output]:{完成}",
+    "未闭合的标识 [time]:{2024 以及 [unknown]:{x} 和 [output] 文本",
+]
+
+
+def long_sample(repeat):
+    body = "根据您的描述，整理会议信息如下。" * 20
+    return (body + SAMPLES[1]) * repeat
+
+
+def check_equivalence():
+    texts = SAMPLES + [long_sample(3)]
+    for text in texts:
+        expected = legacy_parse_response_content(text)
+        for chunk_size in (None, 1, 3, 7, 16):
+            if chunk_size is None:
+                actual = parse_tagged_text(text)
+            else:
+                parser = TagStreamParser()
+                for i in range(0, len(text), chunk_size):
+                    parser.feed(text[i:i + chunk_size])
+                actual = parser.close()
+            if actual != expected:
+                raise AssertionError(f"解析结果不一致 (chunk={chunk_size}):\n{text!r}\n"
+                                     f"旧: {expected}\n新: {actual}")
+    print(f"✅ {len(texts)} 个样例结果一致（整段与 1/3/7/16 字符分片）")
+
+
+def timeit(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def feed_chunks(text, chunk_size):
+    parser = TagStreamParser()
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+    return parser.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="[标识]:{值} 解析微基准")
+    parser.add_argument("--repeat", type=int, default=2000, help="每项重复次数")
+    parser.add_argument("--chunk", type=int, default=16, help="增量喂入的片段长度（字符）")
+    args = parser.parse_args()
+
+    check_equivalence()
+
+    print("=" * 60)
+    for name, text in (("短回复", SAMPLES[1]), ("长回复", long_sample(10))):
+        legacy = timeit(lambda: legacy_parse_response_content(text), args.repeat)
+        single = timeit(lambda: parse_tagged_text(text), args.repeat)
+        chunked = timeit(lambda: feed_chunks(text, args.chunk), max(1, args.repeat // 10))
+        print(f"[{name}] {len(text)} 字符")
+        print(f"  旧版逐标识正则: {legacy:9.1f} µs")
+        print(f"  单次扫描:       {single:9.1f} µs  ({legacy / single:.1f}x)")
+        print(f"  增量喂入({args.chunk}字符/片): {chunked:9.1f} µs")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -216,8 +216,8 @@ async function sendMessage() {
         input.value = '';
         input.style.height = 'auto';
 
-        // 发送请求
-        const response = await fetch('/post', {
+        // 发送请求（流式：每个标识闭合后立即更新表单）
+        const response = await fetch('/post/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -230,35 +230,67 @@ async function sendMessage() {
             throw new Error(errorData.message || `HTTP错误: ${response.status}`);
         }
 
-        const data = await response.json();
-
-        if (data.status === 'success') {
-            // 创建AI消息容器
-            const aiTimestamp = new Date().toLocaleTimeString('zh-CN', {
-                hour: '2-digit',
-                minute: '2-digit',
-                second: '2-digit'
-            });
-
-            const aiDiv = document.createElement('div');
-            aiDiv.className = 'message-block ai-message complete';
-            aiDiv.innerHTML = `
-                <div class="message-timestamp">${aiTimestamp} <span class="role-badge">会议预约助手</span></div>
-                <div class="message-content">${data.answer}</div>
-            `;
-
-            outputEl.appendChild(aiDiv);
+        // 创建AI消息容器
+        const aiTimestamp = new Date().toLocaleTimeString('zh-CN', {
+            hour: '2-digit',
+            minute: '2-digit',
+            second: '2-digit'
+        });
 
-            // 更新左侧表单字段
-            if (data.updates) {
-                applyMeetingInfoUpdates(data.updates);
-                showToast('会议信息已自动更新', 'success');
+        const aiDiv = document.createElement('div');
+        aiDiv.className = 'message-block ai-message';
+        aiDiv.innerHTML = `
+            <div class="message-timestamp">${aiTimestamp} <span class="role-badge">会议预约助手</span></div>
+            <div class="message-content"></div>
+        `;
+        outputEl.appendChild(aiDiv);
+        const contentEl = aiDiv.querySelector('.message-content');
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let streamedText = '';
+        let hasUpdates = false;
+        let completed = false;
+
+        while (!completed) {
+            const { done, value } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+
+            for (const frame of frames) {
+                if (!frame.startsWith('data: ')) continue;
+                const data = JSON.parse(frame.slice(6));
+
+                if (data.type === 'update') {
+                    applyMeetingInfoUpdates({ [data.field]: data.value });
+                    hasUpdates = true;
+                } else if (data.type === 'chunk') {
+                    streamedText += data.chunk;
+                    contentEl.textContent = streamedText;
+                    outputEl.scrollTop = outputEl.scrollHeight;
+                } else if (data.type === 'complete') {
+                    // 以服务端最终解析结果为准
+                    contentEl.innerHTML = data.answer;
+                    aiDiv.classList.add('complete');
+                    completed = true;
+                } else if (data.type === 'error') {
+                    throw new Error(data.message || '未知错误');
+                }
             }
+        }
+
+        if (!completed) {
+            throw new Error('未获取到完整响应');
+        }
 
-            showToast('消息发送成功', 'success');
-        } else {
-            throw new Error(data.message || '未知错误');
+        if (hasUpdates) {
+            showToast('会议信息已自动更新', 'success');
         }
+        showToast('消息发送成功', 'success');
 
     } catch (error) {
         console.error('❌ 发送消息失败:', error);
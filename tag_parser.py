@@ -0,0 +1,121 @@
+import os
+import re
+
+# ========== [标识]:{值} 协议解析 ==========
+# 所有可能的标识符；除 output 外都会更新到左侧表单
+TAG_IDENTIFIERS = ('time', 'topic', 'participants', 'location', 'type', 'output')
+FORM_FIELDS = ('time', 'topic', 'participants', 'location', 'type')
+# 标识值的最大字符数：更长的 [标识]:{... 视为普通文本，流式解析时未闭合的标识最多暂扣这么多文本
+TAG_MAX_VALUE_CHARS = int(os.environ.get("TAG_MAX_VALUE_CHARS", "4096"))
+
+# 预编译：一次扫描同时匹配全部标识
+TAG_PATTERN = re.compile(r'\[(' + '|'.join(TAG_IDENTIFIERS) + r')\]:\{([^}]{1,%d})\}' % TAG_MAX_VALUE_CHARS)
+TAG_OPENERS = tuple(f'[{identifier}]:{{' for identifier in TAG_IDENTIFIERS)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+class TagStreamParser:
+    """增量解析 [标识]:{值} 格式，可按SSE片段逐块喂入
+
+    feed() 返回本次新产生的事件：
+        ('field', 标识, 值)  某个标识的值已闭合（每个标识只在首次出现时产生）
+        ('text', 文本)       已确定不属于任何标识的普通文本
+    close() 返回与一次性解析相同的结果字典。
+
+    规则：每个标识只取第一次出现的值；值非空时该标识的所有出现都从正文中移除，
+    首次出现的值为空时该标识的所有出现都按原文保留。
+
+    未闭合的标识只在收到 '}' 或暂扣内容超过 TAG_MAX_VALUE_CHARS 时重新扫描，每段输入只扫描常数次。
+    """
+
+    def __init__(self):
+        self.buffer = ""  # 尚未确定的尾部（可能是未闭合的标识）
+        self.open_tag = None  # buffer 以完整的 '[标识]:{' 开头时为该前缀的长度
+        self.text_parts = []
+        self.extracted = {}
+        self.blank_tags = set()
+
+    def feed(self, chunk):
+        events = []
+        if (self.open_tag is not None and '}' not in chunk and
+                len(self.buffer) + len(chunk) - self.open_tag <= TAG_MAX_VALUE_CHARS):
+            # 标识值仍未闭合，没有 '}' 就不会产生新的匹配，无需重新扫描
+            self.buffer += chunk
+            return events
+
+        self.buffer += chunk
+        pos = 0
+        for match in TAG_PATTERN.finditer(self.buffer):
+            self._text(self.buffer[pos:match.start()], events)
+            self._tag(match, events)
+            pos = match.end()
+
+        tail = self.buffer[pos:]
+        hold = self._pending_tag_start(tail)
+        if hold is None:
+            self._text(tail, events)
+            self.buffer = ""
+        else:
+            self._text(tail[:hold], events)
+            self.buffer = tail[hold:]
+        self.open_tag = next((len(opener) for opener in TAG_OPENERS if self.buffer.startswith(opener)), None)
+        return events
+
+    def close(self):
+        """结束输入，返回 {标识: 值}，未标识的文本合并为 output"""
+        if self.buffer:
+            self.text_parts.append(self.buffer)
+            self.buffer = ""
+            self.open_tag = None
+
+        extracted_info = {
+            identifier: self.extracted[identifier]
+            for identifier in TAG_IDENTIFIERS if identifier in self.extracted
+        }
+
+        remaining_text = WHITESPACE_PATTERN.sub(' ', ''.join(self.text_parts)).strip()
+        if 'output' not in extracted_info:
+            extracted_info['output'] = remaining_text
+        return extracted_info
+
+    def _text(self, text, events):
+        if text:
+            self.text_parts.append(text)
+            events.append(('text', text))
+
+    def _tag(self, match, events):
+        identifier = match.group(1)
+        if identifier in self.extracted:
+            # 同一标识的后续出现：只取第一次的值，其余直接移除
+            return
+        if identifier not in self.blank_tags:
+            value = match.group(2).strip()
+            if value:
+                self.extracted[identifier] = value
+                events.append(('field', identifier, value))
+                return
+            self.blank_tags.add(identifier)
+        # 首次值为空的标识按原文保留
+        self._text(match.group(0), events)
+
+    @staticmethod
+    def _pending_tag_start(tail):
+        """返回尾部中可能是未闭合标识的起始位置，没有则返回 None"""
+        start = tail.find('[')
+        while start != -1:
+            rest = tail[start:]
+            # 已出现 '}' 却没有匹配，或值已超过长度上限，说明从这里开始不是标识
+            if '}' not in rest:
+                for opener in TAG_OPENERS:
+                    if opener.startswith(rest) or (
+                            rest.startswith(opener) and len(rest) - len(opener) <= TAG_MAX_VALUE_CHARS):
+                        return start
+            start = tail.find('[', start + 1)
+        return None
+
+
+def parse_tagged_text(text):
+    """一次性解析完整文本"""
+    parser = TagStreamParser()
+    parser.feed(text)
+    return parser.close()